@@ -1,5 +1,19 @@
 __version__ = '0.16.0'
 
+# Submodules pull in lxml, regex and sqlite3, so they are only imported on
+# first attribute access (e.g. kaplan.kxliff) to keep `import kaplan` cheap.
+_lazy_submodules = ('kdb', 'kxliff', 'language_codes', 'project', 'sdlxliff',
+                    'tmx', 'tools', 'utils', 'xliff')
+
+def __getattr__(name):
+    if name in _lazy_submodules:
+        import importlib
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+
+def __dir__():
+    return sorted(list(globals()) + list(_lazy_submodules))
+
 def can_process(input_file):
     '''
     Determines whether kaplan can handle input_file.
@@ -12,23 +26,71 @@ def can_process(input_file):
     else:
         return False
 
-def open_bilingualfile(bilingualfile):
+def open_bilingualfile(bilingualfile, name=None):
     '''
     Opens a compatible xliff variant.
 
+    The file head is sniffed first so that the file is parsed only once, by
+    the class that can handle it. Should that class reject the file, KXLIFF,
+    SDLXLIFF and XLIFF are tried in turn.
+
     Args:
-        bilingualfile: Path to a .kxliff, .xliff, or .sdlxliff file.
+        bilingualfile: Path to a .kxliff, .xliff, or .sdlxliff file, a bytes
+                       buffer, or an already-parsed lxml tree.
+        name (optional): Name of the file (Defaults to the name of the path;
+                         required to tell variants apart for buffers and trees).
     '''
-    try:
-        from .kxliff import KXLIFF
-        return KXLIFF.open_bilingualfile(bilingualfile)
-    except:
-        try:
-            from .sdlxliff import SDLXLIFF
-            return SDLXLIFF.open_bilingualfile(bilingualfile)
-        except:
+    from lxml import etree
+
+    if isinstance(bilingualfile, (etree._ElementTree, etree._Element)):
+        xml_head = bilingualfile.getroot() if isinstance(bilingualfile, etree._ElementTree) else bilingualfile
+    else:
+        if isinstance(bilingualfile, bytes):
+            from io import BytesIO
+            head_source = BytesIO(bilingualfile)
+        else:
+            from pathlib import Path
+            if name is None:
+                name = Path(bilingualfile).name
+            try:
+                head_source = open(bilingualfile, 'rb')
+            except OSError:
+                raise TypeError('File not compatible.')
+        with head_source:
             try:
-                from .xliff import XLIFF
-                return XLIFF.open_bilingualfile(bilingualfile)
-            except:
+                _, xml_head = next(etree.iterparse(head_source, events=('start',)))
+            except (etree.XMLSyntaxError, StopIteration):
                 raise TypeError('File not compatible.')
+
+    if etree.QName(xml_head).localname != 'xliff' or 'version' not in xml_head.attrib:
+        raise TypeError('File not compatible.')
+
+    if name is None:
+        if 'kaplan' in xml_head.nsmap:
+            name = 'untitled.kxliff'
+        elif 'sdl' in xml_head.nsmap:
+            name = 'untitled.sdlxliff'
+        else:
+            name = 'untitled.xliff'
+
+    from .kxliff import KXLIFF
+    from .sdlxliff import SDLXLIFF
+    from .xliff import XLIFF
+
+    # The class the file head points to goes first, and the others are tried
+    # in their usual order if it rejects the file.
+    bilingualfile_classes = [KXLIFF, SDLXLIFF, XLIFF]
+    if name.lower().endswith('.kxliff') and 'kaplan' in xml_head.nsmap:
+        bilingualfile_classes.insert(0, KXLIFF)
+    elif name.lower().endswith('.sdlxliff') and 'sdl' in xml_head.nsmap:
+        bilingualfile_classes.insert(0, SDLXLIFF)
+    else:
+        bilingualfile_classes.insert(0, XLIFF)
+
+    for bilingualfile_class in dict.fromkeys(bilingualfile_classes):
+        try:
+            return bilingualfile_class.open_bilingualfile(bilingualfile, name)
+        except (KeyError, TypeError, ValueError, etree.XMLSyntaxError):
+            continue
+
+    raise TypeError('File not compatible.')
@@ -20,9 +20,13 @@ class KDB:
     '''
     Kaplan Database file
     .kdb can be either a termbase or a translation memory file.
+    path_to_kdb can also be an open sqlite3 connection to one.
     '''
     def __init__(self, path_to_kdb, src=None, trgt=None):
-        self.conn = sqlite3.connect(path_to_kdb)
+        if isinstance(path_to_kdb, sqlite3.Connection):
+            self.conn = path_to_kdb
+        else:
+            self.conn = sqlite3.connect(path_to_kdb)
 
         kdb_metadata = self.conn.execute('''SELECT * FROM metadata''').fetchone()
 
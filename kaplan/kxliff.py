@@ -3,18 +3,27 @@ from lxml import etree
 import regex
 
 # Standard Python libraries
-from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy, deepcopy
 from datetime import datetime
+import difflib
+import hashlib
 import html
+import io
 import json
+import os
 from pathlib import Path
-import random
-import string
+import shutil
+import sqlite3
+import struct
 import tempfile
+import time
 import zipfile
+import zlib
 
 # Internal Python files
-from .xliff import XLIFF
+from .utils import get_segmenter, write_raw_zip_member
+from .xliff import XLIFF, _get_journal_path
 
 nsmap = {
     'kaplan': 'https://kaplan.pro',
@@ -22,6 +31,156 @@ nsmap = {
     'xml': 'http://www.w3.org/XML/1998/namespace'
 }
 
+class _OriginalData:
+    '''
+    The originalData of a translation unit, with each fragment parsed once.
+
+    Args:
+        trans_unit: The translation unit.
+        nsmap: Namespace map of the bilingual file.
+    '''
+    def __init__(self, trans_unit, nsmap):
+        self.data = {data.attrib['id']: data.text for data in trans_unit.iterfind('originalData/data', nsmap)}
+        self.fragments = {}
+
+    def get(self, data_id, copy=True):
+        '''
+        Returns the parsed fragment for a data ID.
+
+        Args:
+            data_id: ID of the data element.
+            copy: Whether a copy, safe to insert into a tree, is returned.
+        '''
+        fragment = self.fragments.get(data_id)
+        if fragment is None:
+            fragment = self.fragments[data_id] = etree.fromstring(self.data[data_id])
+
+        return deepcopy(fragment) if copy else fragment
+
+class SegmentHistory:
+    '''
+    Append-only version history of segments, kept in a sidecar SQLite file
+    rather than in the kaplan:history elements of a .kxliff file.
+
+    Each version is stored as a compressed diff against the previous version of
+    its segment, with a full copy every keyframe_interval versions to keep
+    lookups short.
+
+    Args:
+        path_to_store: Path to the history file. It is created if it does not
+                       exist.
+    '''
+    keyframe_interval = 16
+
+    def __init__(self, path_to_store):
+        self.conn = sqlite3.connect(str(path_to_store))
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS history (id INTEGER PRIMARY KEY AUTOINCREMENT, segment TEXT, keyframe INTEGER, data BLOB, digest TEXT, state TEXT, modified_on TEXT, modified_by TEXT)''')
+        self.conn.execute('''CREATE INDEX IF NOT EXISTS history_segment ON history (segment, id)''')
+        self.conn.commit()
+
+        self._last_versions = {}
+
+    def add_version(self, segment_i, target, state='N/A', modified_on='N/A', modified_by='N/A', skip_stored=False):
+        '''
+        Appends a version of a segment, unless it is the same as the last one.
+        Returns whether a version was added.
+
+        Args:
+            segment_i: ID of the segment.
+            target: Target element of the version.
+            state (optional): State of the segment.
+            modified_on (optional): Time of the modification.
+            modified_by (optional): Author of the modification.
+            skip_stored (optional): Whether the version is skipped if any
+                                    stored version of the segment has the same
+                                    content, state, modified_on and modified_by.
+        '''
+        segment_i = str(segment_i)
+        text = etree.tostring(target, encoding='UTF-8').decode('UTF-8')
+        digest = hashlib.sha256(text.encode('UTF-8')).hexdigest()
+
+        last_text, last_digest, n_deltas = self._get_last_version(segment_i)
+        if digest == last_digest:
+            return False
+
+        if skip_stored and self.conn.execute('''SELECT 1 FROM history WHERE segment=? AND digest=? AND state=? AND modified_on=? AND modified_by=? LIMIT 1''',
+                                             (segment_i, digest, state, modified_on, modified_by)).fetchone() is not None:
+            return False
+
+        if last_text is None or n_deltas + 1 >= self.keyframe_interval:
+            keyframe, data, n_deltas = 1, text, 0
+        else:
+            keyframe, data, n_deltas = 0, json.dumps(_get_delta(last_text, text)), n_deltas + 1
+
+        self.conn.execute('''INSERT INTO history (segment, keyframe, data, digest, state, modified_on, modified_by) VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                          (segment_i, keyframe, zlib.compress(data.encode('UTF-8')), digest, state, modified_on, modified_by))
+        self._last_versions[segment_i] = (text, digest, n_deltas)
+
+        return True
+
+    def close(self):
+        '''
+        Commits pending versions and closes the history file.
+        '''
+        self.conn.commit()
+        self.conn.close()
+
+    def commit(self):
+        '''
+        Commits pending versions to the history file.
+        '''
+        self.conn.commit()
+
+    def gen_versions(self, segment_i):
+        '''
+        Yields the versions of a segment, oldest first, as target elements with
+        the attributes state, modified_on and modified_by.
+        '''
+        for text, _, state, modified_on, modified_by in self._gen_rows(str(segment_i)):
+            version = etree.fromstring(text)
+            version.attrib['state'] = state
+            version.attrib['modified_on'] = modified_on
+            version.attrib['modified_by'] = modified_by
+            yield version
+
+    def get_segment_history(self, segment_i):
+        '''
+        Returns the versions of a segment as a kaplan:segment element, in the
+        format of the kaplan:history elements of a .kxliff file, or None if the
+        segment has no history.
+        '''
+        segment_history = None
+        for version in self.gen_versions(segment_i):
+            if segment_history is None:
+                segment_history = etree.Element('{{{0}}}segment'.format(nsmap['kaplan']),
+                                                {'id':str(segment_i)},
+                                                nsmap={'kaplan':nsmap['kaplan'], None:nsmap['xliff']})
+            segment_history.append(version)
+
+        return segment_history
+
+    def _gen_rows(self, segment_i, since_last_keyframe=False):
+        sql_query = '''SELECT keyframe, data, digest, state, modified_on, modified_by FROM history WHERE segment=?'''
+        parameters = (segment_i,)
+        if since_last_keyframe:
+            sql_query += ''' AND id >= (SELECT MAX(id) FROM history WHERE segment=? AND keyframe=1)'''
+            parameters = (segment_i, segment_i)
+
+        text = None
+        for keyframe, data, digest, state, modified_on, modified_by in self.conn.execute(sql_query + ''' ORDER BY id''', parameters):
+            data = zlib.decompress(data).decode('UTF-8')
+            text = data if keyframe else _apply_delta(text, json.loads(data))
+            yield text, digest, state, modified_on, modified_by
+
+    def _get_last_version(self, segment_i):
+        if segment_i not in self._last_versions:
+            last_version = (None, None, 0)
+            for n_deltas, (text, digest, _, _, _) in enumerate(self._gen_rows(segment_i, since_last_keyframe=True)):
+                last_version = (text, digest, n_deltas)
+            self._last_versions[segment_i] = last_version
+
+        return self._last_versions[segment_i]
+
 class KXLIFF(XLIFF):
     '''
     A slightly modified version of the XML Localisation File Format (http://docs.oasis-open.org/xliff/xliff-core/v2.1/xliff-core-v2.1.html).
@@ -38,6 +197,8 @@ class KXLIFF(XLIFF):
             raise TypeError('This class may only handle .kxliff files.')
         super().__init__(name, xml_root)
 
+        self.history_store = None
+
     def add_comment(self, segment_i, comment, author):
         '''
         Adds a segment-level comment.
@@ -63,6 +224,8 @@ class KXLIFF(XLIFF):
 
             note.text = comment
 
+            self._mark_changed(unit)
+
         else:
             raise ValueError('Segment not found.')
 
@@ -85,6 +248,8 @@ class KXLIFF(XLIFF):
                                                  'added_at': datetime.utcnow().isoformat(),
                                                  'added_by': author})
 
+        self._mark_changed(tu)
+
     def generate_lqi_report(self, output_path):
         '''
         Generates a localization quality issue report.
@@ -221,7 +386,7 @@ class KXLIFF(XLIFF):
 
         report.getroottree().write(str(output_path))
 
-    def generate_target_translation(self, output_directory, path_to_source_file=None, target_filename=None):
+    def generate_target_translation(self, output_directory, path_to_source_file=None, target_filename=None, stream=False):
         '''
         Generates a "clean" target file.
 
@@ -232,6 +397,11 @@ class KXLIFF(XLIFF):
                                             .kxliff file).
             target_filename (optional): Name for the target file (Defaults to the
                                         name of the source file).
+            stream (optional): For .docx, .odp, .ods and .odt files, copies the
+                               untouched members of the source archive straight
+                               into the target archive, without extracting or
+                               recompressing them, and writes only the modified
+                               parts.
 
         '''
         if not self.name.endswith('.kxliff'):
@@ -257,7 +427,7 @@ class KXLIFF(XLIFF):
             for trans_unit in source_file.findall('.//unit', self.nsmap):
                 target_unit = etree.SubElement(target_units, 'target-unit', trans_unit.attrib)
 
-                original_data = trans_unit.find('originalData', self.nsmap)
+                original_data = _OriginalData(trans_unit, self.nsmap)
                 active_tags = []
 
                 last_parent = None
@@ -285,7 +455,7 @@ class KXLIFF(XLIFF):
                         if target_child_localname == 'sc':
                             active_tags.append((target_child.attrib['id'], target_child.attrib['dataRef']))
 
-                            new_element = etree.fromstring(original_data.find('data[@id="{0}"]'.format(active_tags[0][1]), self.nsmap).text)
+                            new_element = original_data.get(active_tags[0][1])
                             new_element_localname = etree.QName(new_element).localname
 
                             if len(active_tags) == 1:
@@ -306,7 +476,7 @@ class KXLIFF(XLIFF):
                         elif target_child_localname == 'ec':
                             for active_tag in active_tags:
                                 if active_tag[0] == target_child.attrib['id']:
-                                    removed_element = etree.fromstring(original_data.find('data[@id="{0}"]'.format(active_tag[1]), self.nsmap).text)
+                                    removed_element = original_data.get(active_tag[1], copy=False)
                                     if last_parent is not None and removed_element.tag == last_parent.tag:
                                         last_parent = None
                                     if last_run is not None and removed_element.tag == last_run.tag:
@@ -315,7 +485,7 @@ class KXLIFF(XLIFF):
                                     break
                             if len(active_tags) > 0:
                                 if last_parent is None:
-                                    new_element = etree.fromstring(original_data.find('data[@id="{0}"]'.format(active_tags[0][1]), self.nsmap).text)
+                                    new_element = original_data.get(active_tags[0][1])
                                     new_element_localname = etree.QName(new_element).localname
 
                                     target_unit.append(new_element)
@@ -330,7 +500,7 @@ class KXLIFF(XLIFF):
                                 elif last_run is None:
                                     if len(active_tags) > 1:
                                         for active_tag in active_tags[1:]:
-                                            new_element = etree.fromstring(original_data.find('data[@id="{0}"]'.format(active_tag[1]), self.nsmap).text)
+                                            new_element = original_data.get(active_tag[1])
                                             new_element_localname = etree.QName(new_element).localname
 
                                             if new_element_localname == 'r':
@@ -338,7 +508,7 @@ class KXLIFF(XLIFF):
                                                 last_run = new_element
 
                         elif target_child_localname == 'ph':
-                            new_element = etree.fromstring(original_data.find('data[@id="{0}"]'.format(target_child.attrib['dataRef']), self.nsmap).text)
+                            new_element = original_data.get(target_child.attrib['dataRef'])
 
                             if last_parent is None:
                                 last_parent = last_run = etree.SubElement(target_unit, '{{{0}}}r'.format(source_nsmap['w']))
@@ -359,28 +529,10 @@ class KXLIFF(XLIFF):
                             w_t.text = target_child.tail
 
 
-            for target_unit in target_units:
-                placeholder = self.xml_root.find('.//kaplan:placeholder[@id="{0}"]'.format(target_unit.attrib['id']), self.nsmap)
-                paragraph_parent = placeholder.getparent()
-                child_i = paragraph_parent.index(placeholder)
-                paragraph_parent.remove(placeholder)
-                for target_child in target_unit:
-                    paragraph_parent.insert(child_i, target_child)
-                    child_i += 1
-
-            with tempfile.TemporaryDirectory() as tmp_dir:
-                tmp_dir_path = Path(tmp_dir)
-                with zipfile.ZipFile(path_to_source_file) as source_zip:
-                    source_zip.extractall(tmp_dir)
-
-                internal_file = self.xml_root.find('.//kaplan:internal-file', self.nsmap)
-                etree.ElementTree(internal_file[0]).write(str(tmp_dir_path / internal_file.attrib['rel']),
-                                                          encoding='UTF-8',
-                                                          xml_declaration=True)
-
-                with zipfile.ZipFile((output_directory / target_filename), 'w') as target_zip:
-                    for path_to_file in tmp_dir_path.rglob('*'):
-                        target_zip.write(path_to_file, path_to_file.relative_to(tmp_dir_path))
+            self._write_archive(path_to_source_file,
+                                output_directory / target_filename,
+                                target_units,
+                                stream)
 
         elif source_filename.lower().endswith(('.odp', '.ods', '.odt')):
             def add_text(last_span, text):
@@ -395,15 +547,13 @@ class KXLIFF(XLIFF):
                     else:
                         last_span[-1].tail += text
 
-            duplicated_xml_root = deepcopy(self.xml_root)
-
             source_nsmap = source_file[0][0].nsmap
             target_units = etree.Element('target-units')
 
-            for trans_unit in duplicated_xml_root.findall('.//unit', self.nsmap):
+            for trans_unit in source_file.findall('.//unit', self.nsmap):
                 target_unit = etree.SubElement(target_units, 'target-unit', trans_unit.attrib)
 
-                original_data = trans_unit.find('originalData', self.nsmap)
+                original_data = _OriginalData(trans_unit, self.nsmap)
                 active_tags = []
 
                 last_parent = target_unit
@@ -423,7 +573,7 @@ class KXLIFF(XLIFF):
                         if child_localname == 'sc':
                             last_parent_localname = etree.QName(last_parent).localname
                             active_tags.append(child.attrib['dataRef'])
-                            new_child = etree.fromstring(original_data.find('data[@id="{0}"]'.format(child.attrib['dataRef']), self.nsmap).text)
+                            new_child = original_data.get(child.attrib['dataRef'])
                             new_child_localname = etree.QName(new_child).localname
                             if len(active_tags) == 1:
                                 new_child_span = new_child.find('text:span', source_nsmap)
@@ -450,14 +600,14 @@ class KXLIFF(XLIFF):
                             active_tags.remove(child.attrib['dataRef'])
 
                             if len(active_tags) > 1:
-                                new_child = etree.fromstring(original_data.find('data[@id="{0}"]'.format(active_tags[1]), self.nsmap).text)
+                                new_child = original_data.get(active_tags[1])
                                 new_child_localname = etree.QName(new_child).localname
                                 if last_parent_localname == 'a' and new_child_localname == 'span':
                                     last_parent.append(new_child)
                                     last_span = new_child
                             elif len(active_tags) == 1:
                                 if last_parent == target_unit:
-                                    new_child = etree.fromstring(original_data.find('data[@id="{0}"]'.format(active_tags[0]), self.nsmap).text)
+                                    new_child = original_data.get(active_tags[0])
                                     new_child_span = new_child.find('text:span', source_nsmap)
                                     target_unit.append(new_child)
                                     if new_child_span is not None:
@@ -466,104 +616,52 @@ class KXLIFF(XLIFF):
                                     else:
                                         last_parent = last_span = new_child
                         else:
-                            last_span.append(etree.fromstring(original_data.find('data[@id="{0}"]'.format(child.attrib['dataRef']), self.nsmap).text))
+                            last_span.append(original_data.get(child.attrib['dataRef']))
 
                         if child.tail is not None:
                             add_text(last_span, child.tail)
 
 
-                placeholder = duplicated_xml_root.find('.//kaplan:placeholder[@id="{0}"]'.format(target_unit.attrib['id']), self.nsmap)
-                placeholder_parent = placeholder.getparent()
-                placeholder_i = placeholder_parent.index(placeholder)
-                placeholder_parent.remove(placeholder)
-
-                if target_unit.text is not None:
-                    if placeholder_i == 0:
-                        placeholder_parent.text = target_unit.text
-                    else:
-                        placeholder_parent[-1].tail = target_unit.text
-
-                for child in target_unit:
-                    placeholder_parent.insert(placeholder_i, child)
-                    placeholder_i += 1
-
-            with tempfile.TemporaryDirectory() as tmp_dir:
-
-                tmp_dir_path = Path(tmp_dir)
-
-                with zipfile.ZipFile(path_to_source_file) as source_zip:
-                    source_zip.extractall(tmp_dir_path)
-
-                internal_file = duplicated_xml_root.find('.//kaplan:internal-file', self.nsmap)
-                etree.ElementTree(internal_file[0]).write(str(tmp_dir_path / internal_file.attrib['rel']),
-                                                          encoding='UTF-8',
-                                                          xml_declaration=True)
-
-                with zipfile.ZipFile((output_directory / target_filename), 'w') as target_zip:
-                    for path_to_file in tmp_dir_path.rglob('*'):
-                        target_zip.write(path_to_file, path_to_file.relative_to(tmp_dir_path))
+            self._write_archive(path_to_source_file,
+                                output_directory / target_filename,
+                                target_units,
+                                stream)
 
         elif source_filename.lower().endswith('.po'):
-            po_entries = {}
-
-            for trans_unit in source_file.findall('.//unit', self.nsmap):
-                po_id = int(trans_unit.attrib.get('rid', trans_unit.attrib['id']))
-                keys = trans_unit.attrib['keys'].split(';')
-                if po_id not in po_entries:
-                    po_entries[po_id] = [trans_unit.attrib['metadata'], [], []]
-
-                segment = ['' ,'']
-                for xml_segment in trans_unit.xpath('.//xliff:segment|.//xliff:ignorable', namespaces={'xliff':self.nsmap[None]}):
-                    segment[0] += xml_segment.find('source', self.nsmap).text
-                    target = xml_segment.find('target', self.nsmap)
-                    if target is not None and target.text is not None:
-                        segment[1] += target.text
-                else:
-                    for s_i in range(len(segment)):
-                        source_or_target_segment = ['']
-                        for regex_hit in regex.findall('([^\s]+)?([\s]+)?', segment[s_i]):
-                            for text_or_space in regex_hit:
-                                if (text_or_space != '' and (len(source_or_target_segment[-1]) >= 80 or len(source_or_target_segment[-1] + text_or_space) >= 80)):
-                                    source_or_target_segment.append(text_or_space)
-                                else:
-                                    source_or_target_segment[-1] += text_or_space
-                        else:
-                            if len(source_or_target_segment) > 1 and source_or_target_segment[0] != '':
-                                source_or_target_segment.insert(0, '')
-
-                            for i in range(len(source_or_target_segment)):
-                                source_or_target_segment[i] = '"' + source_or_target_segment[i] + '"'
-
-                            segment[s_i] = source_or_target_segment
-
-                    po_entries[po_id][1].append('{0} {1}'.format(keys[0], '\n'.join(segment[0])))
-                    po_entries[po_id][2].append('{0} {1}'.format(keys[1], '\n'.join(segment[1])))
-
             with open((output_directory / target_filename), 'w') as outfile:
                 outfile.write(source_file.find('kaplan:internal-file', self.nsmap).text + '\n')
 
-                for po_entry_i in sorted(po_entries):
-                    po_entry = po_entries[po_entry_i]
-                    outfile.write(po_entry[0] + '\n')
-                    for line in po_entry[1] + po_entry[2]:
-                        outfile.write(line + '\n')
-                    else:
-                        outfile.write('\n')
+                po_entry = None
+                for trans_unit in source_file.iterfind('.//unit', self.nsmap):
+                    po_id = int(trans_unit.attrib.get('rid', trans_unit.attrib['id']))
+                    keys = trans_unit.attrib['keys'].split(';')
+                    if po_entry is None or po_entry[0] != po_id:
+                        if po_entry is not None:
+                            _write_po_entry(outfile, po_entry)
+                        po_entry = [po_id, trans_unit.attrib['metadata'], [], []]
+
+                    segment = ['' ,'']
+                    for xml_segment in trans_unit.xpath('.//xliff:segment|.//xliff:ignorable', namespaces={'xliff':self.nsmap[None]}):
+                        segment[0] += xml_segment.find('source', self.nsmap).text
+                        target = xml_segment.find('target', self.nsmap)
+                        if target is not None and target.text is not None:
+                            segment[1] += target.text
+
+                    po_entry[2].append('{0} {1}'.format(keys[0], '\n'.join(_wrap_po_string(segment[0]))))
+                    po_entry[3].append('{0} {1}'.format(keys[1], '\n'.join(_wrap_po_string(segment[1]))))
+
+                if po_entry is not None:
+                    _write_po_entry(outfile, po_entry)
 
         elif source_filename.lower().endswith('.txt'):
             with open((output_directory / target_filename), 'w') as outfile:
-                for trans_unit in source_file.findall('.//unit', self.nsmap):
-                    for segment in trans_unit.xpath('.//xliff:segment|.//xliff:ignorable', namespaces={'xliff':self.nsmap[None]}):
-                        target = segment.find('target', self.nsmap)
-                        if target is not None and target.text is not None:
-                            outfile.write(target.text)
-
-                        else:
-                            outfile.write(segment.find('source', self.nsmap).text)
+                for trans_unit in source_file.iterfind('.//unit', self.nsmap):
+                    _write_txt_unit(outfile, trans_unit, self.nsmap)
 
         elif source_filename.lower().endswith('.json'):
-            target_list = []
-            for trans_unit in source_file.findall('.//unit', self.nsmap):
+            target_dict = {}
+            last_key = None
+            for trans_unit in source_file.iterfind('.//unit', self.nsmap):
                 target_segment = ''
                 for segment in trans_unit.xpath('.//xliff:segment|.//xliff:ignorable', namespaces={'xliff':self.nsmap[None]}):
                     target = segment.find('target', self.nsmap)
@@ -574,42 +672,21 @@ class KXLIFF(XLIFF):
                         target_segment += segment.find('source', self.nsmap).text
 
                 key = trans_unit.attrib['{{{0}}}key'.format(self.nsmap['kaplan'])]
-                target_list.append([key, target_segment])
+                segment_keys = key.split('.')
 
-            for i in range(1, len(target_list)):
-                p_i = i - 1
-                while target_list[i][0] == target_list[p_i][0]:
-                    if target_list[p_i][1] is None:
-                        p_i -= 1
-                        continue
-                    if isinstance(target_list[p_i][1], list):
-                        target_list[p_i][1].append(target_list[i][1])
-                    else:
-                        target_list[p_i][1] = [target_list[p_i][1], target_list[i][1]]
-                    target_list[i][1] = None
-                    break
-
-            target_list = list(filter(lambda x: x[1] is not None, target_list))
-
-            for i, segment in enumerate(target_list):
-                segment_keys = segment[0].split('.')
-                segment_keys.reverse()
-                segment_new = {segment_keys[0]: segment[1]}
-                for segment_key in segment_keys[1:]:
-                    segment_new = {segment_key: segment_new}
-                target_list[i] = segment_new
-
-            def _mergedict(to_dict, from_dict):
-                for k, v in from_dict.items():
-                    if k not in to_dict:
-                        to_dict[k] = v
-                    else:
-                        to_dict[k] = _mergedict(to_dict[k], from_dict[k])
-                return to_dict
+                parent_dict = target_dict
+                for segment_key in segment_keys[:-1]:
+                    parent_dict = parent_dict.setdefault(segment_key, {})
 
-            target_dict = {}
-            for segment in target_list:
-                target_dict = _mergedict(target_dict, segment)
+                # Consecutive units with the same key come from a list.
+                if key == last_key:
+                    if isinstance(parent_dict[segment_keys[-1]], list):
+                        parent_dict[segment_keys[-1]].append(target_segment)
+                    else:
+                        parent_dict[segment_keys[-1]] = [parent_dict[segment_keys[-1]], target_segment]
+                else:
+                    parent_dict[segment_keys[-1]] = target_segment
+                last_key = key
 
             with open((output_directory / target_filename), 'w') as outfile:
                 json.dump(target_dict, outfile, indent=4)
@@ -617,13 +694,87 @@ class KXLIFF(XLIFF):
         else:
             raise ValueError('Filetype incompatible for this task!')
 
+    def _write_archive(self, path_to_source_file, path_to_target_file, target_units, stream=False):
+        '''
+        Writes a target .docx, .odp, .ods or .odt file. Placeholders in the
+        internal files are replaced with target units in place for as long as
+        it takes to write the file and restored afterwards, so that the
+        bilingual file is never copied and stays unchanged.
+        '''
+        placeholders = {placeholder.attrib['id']: placeholder
+                        for placeholder in self.xml_root.iterfind('.//kaplan:placeholder', self.nsmap)}
+
+        replacements = []
+        try:
+            for target_unit in target_units:
+                placeholder = placeholders[target_unit.attrib['id']]
+                placeholder_parent = placeholder.getparent()
+                placeholder_i = placeholder_parent.index(placeholder)
+                placeholder_parent.remove(placeholder)
+
+                replaced_text = None
+                if target_unit.text is not None:
+                    if placeholder_i == 0:
+                        replaced_text = (placeholder_parent.text,)
+                        placeholder_parent.text = target_unit.text
+                    else:
+                        # The text follows the sibling before the placeholder,
+                        # which is only the last child if the placeholder was.
+                        replaced_text = (placeholder_parent[placeholder_i-1].tail,)
+                        placeholder_parent[placeholder_i-1].tail = target_unit.text
+
+                replacements.append((placeholder, placeholder_parent, placeholder_i, len(target_unit), replaced_text))
+
+                for child in target_unit:
+                    placeholder_parent.insert(placeholder_i, child)
+                    placeholder_i += 1
+
+            if stream:
+                _stream_archive(path_to_source_file,
+                                path_to_target_file,
+                                self.xml_root.findall('.//kaplan:internal-file', self.nsmap))
+                return
+
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                tmp_dir_path = Path(tmp_dir)
+                with zipfile.ZipFile(path_to_source_file) as source_zip:
+                    source_zip.extractall(tmp_dir_path)
+
+                internal_file = self.xml_root.find('.//kaplan:internal-file', self.nsmap)
+                etree.ElementTree(internal_file[0]).write(str(tmp_dir_path / internal_file.attrib['rel']),
+                                                          encoding='UTF-8',
+                                                          xml_declaration=True)
+
+                with zipfile.ZipFile(path_to_target_file, 'w') as target_zip:
+                    for path_to_file in tmp_dir_path.rglob('*'):
+                        target_zip.write(path_to_file, path_to_file.relative_to(tmp_dir_path))
+
+        finally:
+            for placeholder, placeholder_parent, placeholder_i, len_children, replaced_text in reversed(replacements):
+                for _ in range(len_children):
+                    placeholder_parent.remove(placeholder_parent[placeholder_i])
+                if replaced_text is not None:
+                    if placeholder_i == 0:
+                        placeholder_parent.text = replaced_text[0]
+                    else:
+                        placeholder_parent[placeholder_i-1].tail = replaced_text[0]
+                placeholder_parent.insert(placeholder_i, placeholder)
+
     def get_segment_history(self, segment_i):
         '''
-        Returns the version history of a segment.
+        Returns the version history of a segment, including versions in the
+        history store, if one is set.
         '''
         segment_history = self.xml_root.find('.//kaplan:history/kaplan:segment[@id="{0}"]'.format(segment_i), self.nsmap)
         if segment_history is not None:
             segment_history = deepcopy(segment_history)
+        if self.history_store is not None:
+            stored_segment_history = self.history_store.get_segment_history(segment_i)
+            if segment_history is None:
+                segment_history = stored_segment_history
+            elif stored_segment_history is not None:
+                segment_history.extend(stored_segment_history)
+        if segment_history is not None:
             for any_child in segment_history.findall('.//'):
                 any_child.tag = any_child.tag.split('}')[-1]
                 if 'equiv' in any_child.attrib:
@@ -714,8 +865,10 @@ class KXLIFF(XLIFF):
 
             translation_unit.remove(segment)
 
+        self._mark_changed(translation_unit)
+
     @classmethod
-    def new(cls, source_file, src, trgt, segmentation='default'):
+    def new(cls, source_file, src, trgt, segmentation='default', stream=False):
         '''
         Takes in a source file and returns a KXLIFF instance.
 
@@ -726,7 +879,11 @@ class KXLIFF(XLIFF):
             segmentation: Sets whether kaplan should split translation units
                           into sentences. This should be either set to False or
                           left as is for .po files where segments are
-                          already translated.
+                          already translated. Can also be a path to an .srx
+                          file (or a kaplan.utils.SRX instance) whose rules for
+                          src are used instead of the built-in ones.
+            stream (optional): Parses .json files incrementally instead of
+                               loading them whole, for very large files.
         '''
 
         source_file_path = Path(source_file)
@@ -1081,474 +1238,221 @@ class KXLIFF(XLIFF):
 
         elif name.lower().endswith('.po'):
 
-            def entry_checkpoint(entry, entry_metadata, entries):
-                if entry.get('msgid', None) is not None:
-                    entry['metadata'] = '\n'.join(entry_metadata)
-                    entries.append(entry)
-
-                return entries
-
-            entries = []
-
-            regex_compile = regex.compile('([a-z0-9\[\]_]+)?\s?"(.*?)"$')
-
-            with open(source_file_path, encoding='UTF-8') as po_file:
-                entry = {}
-                entry_metadata = []
-                last_element = ''
+            if segmentation == 'default':
+                segmentation = False
 
-                for line in po_file:
-                    line = line.strip()
+            for element in _gen_po_elements(source_file_path, _create_segmenter(src, segmentation)):
+                source_file_reference.append(element)
 
-                    if line.startswith('#'):
-                        entry_metadata.append(line)
-                        continue
+            return cls(name + '.kxliff', xml_root)
 
-                    if line == '':
-                        entries = entry_checkpoint(entry, entry_metadata, entries)
-                        entry, entry_metadata, last_element = {}, [], ''
-                        continue
+        elif name.lower().endswith('.txt'):
 
-                    regex_match = regex_compile.search(line)
+            for element in _gen_txt_elements(source_file_path, _create_segmenter(src, segmentation)):
+                source_file_reference.append(element)
 
-                    if regex_match == None:
-                        continue
+            return cls(name + '.kxliff', xml_root)
 
-                    if regex_match.group(1):
-                        last_element = regex_match.group(1)
-                        entry[last_element] = ''
+        elif name.lower().endswith('.json'):
 
-                    if regex_match.group(2):
-                        entry[last_element] += regex_match.group(2)
+            with open(source_file_path, 'rb') as source_file:
+                if stream:
+                    json_items = _gen_json_stream_items(io.TextIOWrapper(source_file, encoding='utf-8-sig'))
                 else:
-                    entries = entry_checkpoint(entry, entry_metadata, entries)
-
-            po_metadata = '{0}\nmsgid ""\nmsgstr ""\n{1}\n'.format(entries[0]['metadata'],
-                                                                     '\n'.join('"' + line + '\\n"' for line in entries[0]['msgstr'].split('\\n') if line))
-
-            source_file_content = etree.Element('{{{0}}}internal-file'.format(nsmap['kaplan']), nsmap={None:nsmap['kaplan']})
-            source_file_content.attrib['{{{0}}}rel'.format(nsmap['kaplan'])] = 'self'
-            source_file_content.text = po_metadata
-            source_file_reference.insert(0, source_file_content)
-
-            entries = entries[1:]
-
-            for entry in entries:
-                _tu = deepcopy(_tu_template)
-                _tu.attrib['id'] = str(_tu_counter)
-                _tu.attrib['metadata'] = entry.get('metadata', '')
-                source_file_reference.append(_tu)
-                _tu_counter += 1
-                _source = _tu.find('.//xliff:source', nsmap)
-                _target = _tu.find('.//xliff:target', nsmap)
-                _source.text = entry['msgid']
-                _target_key = 'msgstr' if 'msgstr' in entry else 'msgstr[0]'
-                _target.text = entry[_target_key]
-
-                _tu.attrib['keys'] = ';'.join(('msgid', _target_key))
-
-                if 'msgid_plural' in entry or 'plural' in entry:
-                    _tu.attrib['rid'] = _tu.attrib['id']
-                    _source_key = 'msgid_plural' if 'msgid_plural' in entry else 'plural'
-                    _tu = deepcopy(_tu)
-                    _tu.attrib['id'] = str(_tu_counter)
-                    source_file_reference.append(_tu)
-                    _tu_counter += 1
-                    _source = _tu.find('.//xliff:source', nsmap)
-                    _target = _tu.find('.//xliff:target', nsmap)
-                    _source.text = entry[_source_key]
-                    _target.text = entry.get('msgstr[1]', '')
-
-                    _tu.attrib['keys'] = ';'.join((_source_key, 'msgstr[1]'))
+                    json_items = _gen_json_items(json.load(source_file))
 
-            if segmentation == 'default':
-                segmentation = False
-
-        elif name.lower().endswith('.txt'):
-
-            with open(source_file_path, encoding='UTF-8') as source_file:
-                for line in source_file:
+                for keys, source in json_items:
                     _tu = deepcopy(_tu_template)
-                    _tu.attrib['id'] = str(_tu_counter)
+                    _tu.attrib['{{{0}}}key'.format(nsmap['kaplan'])] = '.'.join(keys)
                     source_file_reference.append(_tu)
-                    _tu_counter += 1
-                    _source = _tu.find('.//xliff:source', nsmap)
-                    _target = _tu.find('.//xliff:target', nsmap)
 
-                    if line.strip() == '':
+                    _source = _tu[0][0]
+                    _target = _tu[0][1]
+
+                    if source.strip() == '':
                         _tu[0].tag = '{{{0}}}ignorable'.format(nsmap['xliff'])
                         _tu[0].remove(_target)
-
-                    _source.text = line
-
-        elif name.lower().endswith('.json'):
-            def _create_unit(source, key):
-
-                _tu = deepcopy(_tu_template)
-                _tu.attrib['{{{0}}}key'.format(nsmap['kaplan'])] = '.'.join(key)
-                source_file_reference.append(_tu)
-
-                _source = _tu.find('.//xliff:source', nsmap)
-                _target = _tu.find('.//xliff:target', nsmap)
-
-                if source.strip() == '':
-                    _tu[0].tag = '{{{0}}}ignorable'.format(nsmap['xliff'])
-                    _tu[0].remove(_target)
-                else:
-                    _tu.attrib['id'] = str(len(source_file_reference.findall('xliff:unit', nsmap)))
-
-                _source.text = source
-
-            def _extract_json(kaynak, keys=[]):
-                for k, v in kaynak.items():
-                    if isinstance(v, dict):
-                        _extract_json(v, (keys + [k]))
-                    elif isinstance(v, list):
-                        for child_v in v:
-                            _create_unit(child_v, (keys + [k]))
                     else:
-                        _create_unit(v, (keys + [k]))
-
-            with open(source_file_path, 'rb') as source_file:
-                _extract_json(json.load(source_file))
-
-        if not segmentation:
-            for tu in source_file_reference.findall('xliff:unit', nsmap):
-                segment = tu.find('xliff:segment', nsmap)
-                if segment is not None:
-                    segment.attrib['id'] = tu.attrib['id']
-            return cls(name + '.kxliff', xml_root)
+                        _tu.attrib['id'] = str(_tu_counter)
+                    _tu_counter += 1
 
-        _regex = (regex.compile(r'(\s+|^)'
-                                r'(\p{Lu}\p{L}{0,3})'
-                                r'(\.+)'
-                                r'(\s+|$)'),
-                  regex.compile(r'(\s+|^)'
-                                r'([\p{Lu}\p{L}]+)'
-                                r'([\.\!\?\:]+)'
-                                r'(\s+|$)'))
+                    _source.text = source
 
-        for segment in source_file_reference.findall('.//xliff:segment', nsmap):
+        segmenter = _create_segmenter(src, segmentation)
+        segment_counter = 1
 
-            source = segment.find('xliff:source', nsmap)
-            source_text = ''
+        for tu in source_file_reference.findall('xliff:unit', nsmap):
+            segment_counter = _segment_unit(tu, segmenter, segment_counter)
 
-            source_text += source.text if source.text is not None else ''
-            for child in source:
-                source_text += child.tail if child.tail is not None else ''
+        return cls(name + '.kxliff', xml_root)
 
-            if len(source_text.split()) <= 1:
-                continue
+    @classmethod
+    def new_to_file(cls, source_file, src, trgt, output_directory, segmentation='default'):
+        '''
+        Takes in a source file and saves it as a .kxliff file in a given
+        directory. .po and .txt files are converted entry by entry (line by
+        line) and written straight to disk, so that the whole file is never
+        held in memory. Other files are created with KXLIFF.new and saved.
 
-            placeholders = ['placeholder_to_keep_segment_going',
-                            'placeholder_to_end_segment']
-            while placeholders[0] in source_text:
-                placeholders[0] += random.choice(string.ascii_letters)
-            while placeholders[1] in source_text:
-                placeholders[1] += random.choice(string.ascii_letters)
-
-            for hit in regex.findall(_regex[0], source_text):
-                if hit is not None:
-                    source_text = regex.sub(regex.escape(''.join(hit)),
-                                            ''.join((hit[0],
-                                                     hit[1],
-                                                     hit[2],
-                                                     placeholders[0],
-                                                     hit[3])),
-                                            source_text,
-                                            1)
-
-            for hit in regex.findall(_regex[1], source_text):
-                if hit is not None and hit[-1] != '':
-                    source_text = regex.sub(regex.escape(''.join(hit)),
-                                            ''.join((hit[0],
-                                                     hit[1],
-                                                     hit[2],
-                                                     placeholders[1],
-                                                     hit[3])),
-                                            source_text,
-                                            1)
-
-            source_text = regex.sub(placeholders[0], '', source_text)
-            len_sentences = []
-            for sentence in source_text.split(placeholders[1]):
-                if sentence is not None and sentence != '':
-                    len_sentences.append(len(sentence))
-
-            new_segments = etree.Element('{{{0}}}segments'.format(nsmap['xliff']))
-            new_segment = etree.SubElement(new_segments, '{{{0}}}segment'.format(nsmap['xliff']))
-            new_source = etree.SubElement(new_segment, '{{{0}}}source'.format(nsmap['xliff']))
-            if not name.lower().endswith('.po'):
-                etree.SubElement(new_segment, '{{{0}}}target'.format(nsmap['xliff']))
-            else:
-                new_segment.append(segment.find('xliff:target', nsmap))
+        Args:
+            source_file: Path to a source file.
+            src: ISO 639-1 code for the source language.
+            trgt: ISO 639-1 code for the target language.
+            output_directory: Path to the directory where the .kxliff file will
+                              be saved.
+            segmentation: See KXLIFF.new.
 
-            def create_segments(text_element, len_sentences, new_segment, new_source, new_segments=new_segments):
-                while text_element is not None and len(text_element) > 0:
-                    if len(text_element) >= len_sentences[0]:
+        Returns the path to the .kxliff file.
+        '''
+        source_file_path = Path(source_file)
 
-                        if len(new_source) == 0:
-                            if new_source.text is None:
-                                new_source.text = ''
-                            new_source.text += text_element[:len_sentences[0]]
-                        else:
-                            if new_source[-1].tail is None:
-                                new_source[-1].tail = ''
-                            new_source[-1].tail += text_element[:len_sentences[0]]
-                        text_element = text_element[len_sentences[0]:]
-
-                        len_sentences = len_sentences[1:]
-                        new_segment = etree.SubElement(new_segments, '{{{0}}}segment'.format(nsmap['xliff']))
-                        new_source = etree.SubElement(new_segment, '{{{0}}}source'.format(nsmap['xliff']))
-                        etree.SubElement(new_segment, '{{{0}}}target'.format(nsmap['xliff']))
-                    else:
-                        if len(new_source) == 0:
-                            if new_source.text is None:
-                                new_source.text = ''
-                            new_source.text += text_element
-                        else:
-                            if new_source[-1].tail is None:
-                                new_source[-1].tail = ''
-                            new_source[-1].tail += text_element
-
-                        len_sentences[0] -= len(text_element)
-                        text_element = None
-
-                return len_sentences, new_segment, new_source
-
-            source_text = source.text
-            if source_text is not None:
-                source.text = None
-                len_sentences, new_segment, new_source = create_segments(source_text,
-                                                                         len_sentences,
-                                                                         new_segment,
-                                                                         new_source)
-
-            for child in source:
-                child_tail = child.tail
-                new_source.append(child)
-                if child.tail is not None:
-                    child.tail = None
-                    len_sentences, new_segment, new_source = create_segments(child_tail,
-                                                                             len_sentences,
-                                                                             new_segment,
-                                                                             new_source)
-
-            if len(new_source) == 1 and etree.QName(new_source[0]).localname == 'ec' and new_source.text is None:
-                new_child = new_source[0]
-                new_segment.getprevious().find('xliff:source', nsmap).append(new_child)
-                if new_child.tail:
-                    new_source.text = new_child.tail
-                else:
-                    new_segments.remove(new_segment)
+        if source_file_path.name.lower().endswith('.po'):
+            if segmentation == 'default':
+                segmentation = False
+            elements = _gen_po_elements(source_file_path, _create_segmenter(src, segmentation))
+        elif source_file_path.name.lower().endswith('.txt'):
+            elements = _gen_txt_elements(source_file_path, _create_segmenter(src, segmentation))
+        else:
+            kxliff = cls.new(source_file, src, trgt, segmentation)
+            kxliff.save(output_directory)
+            return Path(output_directory, kxliff.name)
+
+        path_to_kxliff = Path(output_directory, source_file_path.name + '.kxliff')
+        # The file is written under a temporary name and renamed once it is
+        # complete, so that a conversion that stops halfway leaves no .kxliff
+        # file behind.
+        temporary_path = path_to_kxliff.with_name(path_to_kxliff.name + '.tmp')
+
+        try:
+            with etree.xmlfile(str(temporary_path), encoding='UTF-8') as xf:
+                xf.write_declaration()
+                with xf.element('{{{0}}}xliff'.format(nsmap['xliff']),
+                                attrib={'version':'2.1',
+                                        'srcLang': src,
+                                        'trgLang': trgt},
+                                nsmap={None:nsmap['xliff'], 'kaplan':nsmap['kaplan']}):
+                    with xf.element('{{{0}}}file'.format(nsmap['xliff']),
+                                    attrib={'id': '1',
+                                            'original': str(source_file_path)}):
+                        for element in elements:
+                            _write_element(xf, element)
+            os.replace(temporary_path, path_to_kxliff)
+        except Exception:
+            temporary_path.unlink(missing_ok=True)
+            raise
+
+        return path_to_kxliff
 
+    @classmethod
+    def generate_target_from_file(cls, path_to_kxliff, output_directory, path_to_source_file=None, target_filename=None):
+        '''
+        Generates a "clean" target file from a .kxliff file on disk. For .txt
+        files, the .kxliff file is parsed and the target file written unit by
+        unit, so that neither is ever held in memory. Other files are
+        generated with KXLIFF.generate_target_translation. A journal of the
+        .kxliff file (see XLIFF.save) is merged into the file first.
 
-            segment_parent = segment.getparent()
-            segment_i = segment_parent.index(segment)
-            segment_parent.remove(segment)
+        Args:
+            path_to_kxliff: Path to the .kxliff file.
+            output_directory: Path to target directory where the target file will be saved.
+            path_to_source_file (optional): See KXLIFF.generate_target_translation.
+            target_filename (optional): See KXLIFF.generate_target_translation.
 
-            for new_segment in new_segments:
-                segment_parent.insert(segment_i, new_segment)
-                segment_i += 1
+        Returns the path to the target file.
+        '''
+        output_directory = Path(output_directory)
 
-        def set_up_ignorable(segment, prev_or_next):
-            ignorable_sibling = segment.getprevious() if prev_or_next == 'prev' else segment.getnext()
-            if ignorable_sibling is None or etree.QName(ignorable_sibling).localname != 'ignorable':
-                segment_parent = segment.getparent()
-                ignorable_i = segment_parent.index(segment)
-                if prev_or_next == 'next':
-                    ignorable_i += 1
+        if _get_journal_path(Path(path_to_kxliff)).exists():
+            cls.open_bilingualfile(path_to_kxliff).close()
 
-                ignorable_sibling = etree.Element('{{{0}}}ignorable'.format(nsmap['xliff']))
-                etree.SubElement(ignorable_sibling, '{{{0}}}source'.format(nsmap['xliff']))
-                segment_parent.insert(ignorable_i, ignorable_sibling)
+        events = etree.iterparse(str(path_to_kxliff),
+                                 events=('start', 'end'),
+                                 tag=('{{{0}}}file'.format(nsmap['xliff']), '{{{0}}}unit'.format(nsmap['xliff'])))
 
-            return ignorable_sibling
+        for event, element in events:
+            if event == 'start':
+                break
 
-        segment_counter = 1
+        if path_to_source_file is None:
+            path_to_source_file = element.attrib['original']
+        source_filename = Path(path_to_source_file).name
 
-        for segment in source_file_reference.findall('.//xliff:segment', nsmap):
+        if target_filename is None:
+            target_filename = source_filename
 
-            source = segment.find('xliff:source', nsmap)
+        if not source_filename.lower().endswith('.txt'):
+            cls.open_bilingualfile(path_to_kxliff).generate_target_translation(output_directory,
+                                                                               path_to_source_file,
+                                                                               target_filename)
+            return output_directory / target_filename
 
-            for ec in source.findall('xliff:ec', nsmap):
-                if ((ec.tail is not None and ec.tail != '')
-                or ec.attrib.get('dataRef') is None or ec.getnext() is None):
+        with open((output_directory / target_filename), 'w') as outfile:
+            for event, element in events:
+                if event != 'end' or etree.QName(element).localname != 'unit':
                     continue
-                next_sibling = ec.getnext()
-
-                if (next_sibling.tag.split('}')[-1] == 'sc' and next_sibling.attrib.get('dataRef') is not None
-                and ec.attrib['dataRef'] == next_sibling.attrib['dataRef']):
-                    if next_sibling.tail is not None and next_sibling.tail != '':
-                        prev_sibling = ec.getprevious()
-                        if prev_sibling is not None:
-                            if prev_sibling.tail is None:
-                                prev_sibling.tail = ''
-                            prev_sibling.tail += next_sibling.tail
-                        else:
-                            if source.text is None:
-                                source.text = ''
-                            source.text += next_sibling.tail
-                    source.remove(ec)
-                    source.remove(next_sibling)
-
-            prev_ignorable = None
-            prev_ignorable_complete = False
-
-            while not prev_ignorable_complete:
-                if source.text is not None:
-                    lstripped_source_text = source.text.lstrip()
-                    if lstripped_source_text != source.text:
-                        if lstripped_source_text != '':
-                            text_to_ignore = source.text[:-len(lstripped_source_text)]
-                            source.text = lstripped_source_text
-                            prev_ignorable_complete = True
-                        else:
-                            text_to_ignore = source.text
-                            source.text = None
-                        if prev_ignorable is None:
-                            prev_ignorable = set_up_ignorable(segment, 'prev')
-                        if len(prev_ignorable[0]) > 0:
-                            if prev_ignorable[0][-1].tail is None:
-                                prev_ignorable[0][-1].tail = text_to_ignore
-                            else:
-                                prev_ignorable[0][-1].tail += text_to_ignore
-                        elif prev_ignorable[0].text is None:
-                            prev_ignorable[0].text = text_to_ignore
-                        else:
-                            prev_ignorable[0].text += text_to_ignore
-                    else:
-                        prev_ignorable_complete = True
-                elif len(source) == 1 and source[0].tail is None:
-                    if prev_ignorable is not None:
-                        prev_ignorable[0].append(source[0])
-                        segment.getparent().remove(segment)
-
-                    segment.tag = '{{{0}}}ignorable'.format(nsmap['xliff'])
-                    prev_ignorable_complete = True
-
-                elif len(source) > 0:
-                    first_child = source[0]
-                    first_child_localname = etree.QName(first_child).localname
-                    if first_child_localname == 'ec':
-                        pass
-                    elif first_child_localname == 'sc':
-                        ph_pairs = source.xpath('xliff:sc|xliff:ec', namespaces=nsmap)
-                        if (len(ph_pairs) == 1 or (len(ph_pairs) == 2
-                        and source[-1].tail is None and ph_pairs[1] == source[-1])):
-                            pass
-                        else:
-                            prev_ignorable_complete = True
-                    else:
-                        if '&lt;tab' not in first_child.attrib.get('equiv', '') and '&lt;br' not in first_child.attrib.get('equiv', ''):
-                            prev_ignorable_complete = True
-
-                    if not prev_ignorable_complete:
-                        if prev_ignorable is None:
-                            prev_ignorable = set_up_ignorable(segment, 'prev')
-                        source.text = first_child.tail
-                        first_child.tail = None
-                        prev_ignorable[0].append(first_child)
-                else:
-                    segment.getparent().remove(segment)
-                    prev_ignorable_complete = True
+                _write_txt_unit(outfile, element, element.nsmap)
 
-            if etree.QName(segment).localname == 'ignorable' or segment.getparent() is None:
-                continue
-
-            next_ignorable = None
-            next_ignorable_complete = False
-
-            while not next_ignorable_complete:
-                if len(source) > 0 and source[-1].tail is not None:
-                    last_child = source[-1]
-                    rstripped_last_child_tail = last_child.tail.rstrip()
-                    if rstripped_last_child_tail != last_child.tail:
-                        if rstripped_last_child_tail != '':
-                            text_to_ignore = last_child.tail[len(rstripped_last_child_tail):]
-                            last_child.tail = rstripped_last_child_tail
-                            next_ignorable_complete = True
-                        else:
-                            text_to_ignore = last_child.tail
-                            last_child.tail = None
+                element.clear(keep_tail=True)
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
 
-                        if next_ignorable is None:
-                            next_ignorable = set_up_ignorable(segment, 'next')
+        return output_directory / target_filename
 
-                        if next_ignorable[0].text is None:
-                            next_ignorable[0].text = text_to_ignore
-                        else:
-                            next_ignorable[0].text = text_to_ignore + next_ignorable[0].text
-
-                    else:
-                        next_ignorable_complete = True
-                elif len(source) > 0:
-                    last_child = source[-1]
-                    last_child_localname = etree.QName(last_child).localname
-                    if last_child_localname == 'sc':
-                        pass
-                    elif last_child_localname == 'ec' and len(source.xpath('xliff:sc|xliff:ec', namespaces=nsmap)) == 1:
-                        pass
-                    elif last_child_localname == 'ph' and last_child.attrib.get('equiv', '').startswith(('&lt;br', '&lt;tab')):
-                        pass
-                    else:
-                        next_ignorable_complete = True
-
-                    if not next_ignorable_complete:
-                        if next_ignorable is None:
-                            next_ignorable = set_up_ignorable(segment, 'next')
-                        next_ignorable[0].insert(0, last_child)
-                        last_child.tail = next_ignorable[0].text
-                        next_ignorable[0].text = None
-                elif source.text is not None:
-                    rstripped_source_text = source.text.rstrip()
-                    if rstripped_source_text != source.text:
-                        if rstripped_source_text != '':
-                            text_to_ignore = source.text[len(rstripped_source_text):]
-                            source.text = rstripped_source_text
-                            next_ignorable_complete = True
-                        else:
-                            text_to_ignore = source.text
-                            source.text = None
-
-                        if next_ignorable is None:
-                            next_ignorable = set_up_ignorable(segment, 'next')
-
-                        if next_ignorable[0].text is None:
-                            next_ignorable[0].text = text_to_ignore
-                        else:
-                            next_ignorable[0].text = text_to_ignore + next_ignorable[0].text
-
-                    else:
-                        next_ignorable_complete = True
-                else:
-                    segment.getparent().remove(segment)
-                    next_ignorable_complete = True
-
-            for sc_child in source.findall('xliff:sc', nsmap):
-                next_sibling = sc_child.getnext()
-                if (sc_child.tail is None and next_sibling is not None
-                and etree.QName(next_sibling).localname == 'ec'
-                and sc_child.attrib['id'] == next_sibling.attrib['id']):
-                    source.remove(sc_child)
-                    if next_sibling.tail is not None:
-                        target_child = next_sibling.getprevious()
-                        if target_child is not None:
-                            if target_child.tail is None:
-                                target_child.tail = next_sibling.tail
-                            else:
-                                target_child.tail += next_sibling.tail
-                        else:
-                            if source.text is None:
-                                source.text = next_sibling.tail
-                            else:
-                                source.text += next_sibling.tail
-                    source.remove(next_sibling)
+    @classmethod
+    def new_batch(cls, source_files, src, trgt, output_directory, segmentation='default', workers=None):
+        '''
+        Creates .kxliff files for a list of source files in parallel and saves
+        them in a given directory. A file that fails does not stop the batch.
+        A source file with the same name as a source file before it fails,
+        rather than overwriting its .kxliff file.
 
-            segment.attrib['id'] = str(segment_counter)
-            segment_counter += 1
+        Args:
+            source_files: List of paths to source files.
+            src: ISO 639-1 code for the source language.
+            trgt: ISO 639-1 code for the target language.
+            output_directory: Path to the directory where the .kxliff files will
+                              be saved.
+            segmentation: See KXLIFF.new.
+            workers (optional): Number of worker processes (Defaults to the
+                                number of CPUs).
+
+        Returns a list of dicts, in the order of source_files, with the keys
+        source, kxliff, status ('ok' or 'failed'), error and time (seconds).
+        '''
+        output_directory = Path(output_directory)
+        output_directory.mkdir(parents=True, exist_ok=True)
+
+        kxliff_names = {}
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for source_file in source_files:
+                kxliff_name = Path(source_file).name + '.kxliff'
+                if kxliff_name in kxliff_names:
+                    futures.append('ValueError: The .kxliff file {0} is created for {1} already.'.format(kxliff_name,
+                                                                                                          kxliff_names[kxliff_name]))
+                    continue
+                kxliff_names[kxliff_name] = str(source_file)
+                futures.append(executor.submit(_new_and_save, cls, source_file, src, trgt, output_directory, segmentation))
+
+            results = []
+            for source_file, future in zip(source_files, futures):
+                if isinstance(future, str):
+                    results.append({'source': str(source_file),
+                                    'kxliff': None,
+                                    'status': 'failed',
+                                    'error': future,
+                                    'time': None})
+                    continue
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append({'source': str(source_file),
+                                    'kxliff': None,
+                                    'status': 'failed',
+                                    'error': '{0}: {1}'.format(type(e).__name__, e),
+                                    'time': None})
 
-        return cls(name + '.kxliff', xml_root)
+        return results
 
     def resolve_comment(self, segment_i, comment_i, author):
         '''
@@ -1560,6 +1464,8 @@ class KXLIFF(XLIFF):
             comment.attrib['resolved_at'] = datetime.utcnow().isoformat()
             comment.attrib['resolved_by'] = author
             comment.attrib['state'] = 'resolved'
+
+            self._mark_changed(comment)
         else:
             raise ValueError('Comment not found.')
 
@@ -1580,9 +1486,63 @@ class KXLIFF(XLIFF):
             loc_quality_issue.attrib['resolved_at'] = datetime.utcnow().isoformat()
             loc_quality_issue.attrib['resolved_by'] = author
             loc_quality_issue.attrib['resolved'] = 'true'
+
+            self._mark_changed(loc_quality_issue)
         else:
             raise ValueError('LQI not found.')
 
+    def close(self):
+        '''
+        Compacts the journal of the bilingual file, if it has one, and closes
+        the history store, if one is set.
+        '''
+        super().close()
+
+        if self.history_store is not None:
+            self.history_store.close()
+
+    def save(self, output_directory, journal=False):
+        '''
+        Saves the bilingual file in a given directory, and commits the history
+        store, if one is set. See XLIFF.save.
+        '''
+        super().save(output_directory, journal)
+
+        if self.history_store is not None:
+            self.history_store.commit()
+
+    def set_history_store(self, path_to_store, move_history=True):
+        '''
+        Keeps the version history of segments in a sidecar file instead of the
+        .kxliff file. See SegmentHistory.
+
+        Args:
+            path_to_store: Path to the history file. It is created if it does
+                           not exist.
+            move_history (optional): Whether the history already in the .kxliff
+                                     file is moved to the history file. Versions
+                                     that are there already are not added again.
+        '''
+        self.history_store = SegmentHistory(path_to_store)
+
+        if move_history:
+            for tu_history in self.xml_root.findall('.//kaplan:history', self.nsmap):
+                for segment_history in tu_history.iterfind('kaplan:segment', self.nsmap):
+                    for version in segment_history:
+                        version = deepcopy(version)
+                        state = version.attrib.pop('state', 'N/A')
+                        modified_on = version.attrib.pop('modified_on', 'N/A')
+                        modified_by = version.attrib.pop('modified_by', 'N/A')
+                        self.history_store.add_version(segment_history.attrib['id'],
+                                                       version,
+                                                       state,
+                                                       modified_on,
+                                                       modified_by,
+                                                       skip_stored=True)
+                self._mark_changed(tu_history.getparent())
+                tu_history.getparent().remove(tu_history)
+            self.history_store.commit()
+
     def update_segment(self, target_segment, tu_i, segment_i, segment_state=None, submitted_by=None, save_history=True):
         '''
         Updates a target segment.
@@ -1592,20 +1552,767 @@ class KXLIFF(XLIFF):
             segment = tu.find('xliff:segment[@id="{0}"]'.format(segment_i), namespaces=nsmap)
             target = segment.find('xliff:target', namespaces=nsmap)
             if target is not None and (len(target) > 0 or target.text is not None):
-                tu_history = tu.find('kaplan:history', namespaces=nsmap)
-                if tu_history is None:
-                    tu_history = etree.SubElement(tu, '{{{0}}}history'.format(nsmap['kaplan']))
-                segment_history = tu_history.find('kaplan:segment[@id="{0}"]'.format(segment_i), namespaces=nsmap)
-                if segment_history is None:
-                    segment_history = etree.SubElement(tu_history,
-                                                       '{{{0}}}segment'.format(nsmap['kaplan']),
-                                                       {'id':str(segment_i)})
-                if len(segment_history) == 0 or etree.tostring(segment_history[-1], encoding='UTF-8') != etree.tostring(target, encoding='UTF-8'):
-                    copy_target = deepcopy(target)
-                    copy_target.attrib['state'] = segment.attrib.get('state', 'N/A')
-                    copy_target.attrib['modified_on'] = segment.attrib.get('modified_on', 'N/A')
-                    copy_target.attrib['modified_by'] = segment.attrib.get('modified_by', 'N/A')
-
-                    segment_history.append(copy_target)
+                if self.history_store is not None:
+                    self.history_store.add_version(segment_i,
+                                                   target,
+                                                   segment.attrib.get('state', 'N/A'),
+                                                   segment.attrib.get('modified_on', 'N/A'),
+                                                   segment.attrib.get('modified_by', 'N/A'))
+                else:
+                    tu_history = tu.find('kaplan:history', namespaces=nsmap)
+                    if tu_history is None:
+                        tu_history = etree.SubElement(tu, '{{{0}}}history'.format(nsmap['kaplan']))
+                    segment_history = tu_history.find('kaplan:segment[@id="{0}"]'.format(segment_i), namespaces=nsmap)
+                    if segment_history is None:
+                        segment_history = etree.SubElement(tu_history,
+                                                           '{{{0}}}segment'.format(nsmap['kaplan']),
+                                                           {'id':str(segment_i)})
+                    if len(segment_history) == 0 or etree.tostring(segment_history[-1], encoding='UTF-8') != etree.tostring(target, encoding='UTF-8'):
+                        copy_target = deepcopy(target)
+                        copy_target.attrib['state'] = segment.attrib.get('state', 'N/A')
+                        copy_target.attrib['modified_on'] = segment.attrib.get('modified_on', 'N/A')
+                        copy_target.attrib['modified_by'] = segment.attrib.get('modified_by', 'N/A')
+
+                        segment_history.append(copy_target)
 
         super().update_segment(target_segment, tu_i, segment_i, segment_state, submitted_by)
+
+_po_token_regex = regex.compile(r'\S+|\s+')
+
+def _apply_delta(text, delta):
+    '''
+    Applies a delta from _get_delta to a string.
+    '''
+    new_text = []
+    i = 0
+    for start, end, replacement in delta:
+        new_text.append(text[i:start])
+        new_text.append(replacement)
+        i = end
+    new_text.append(text[i:])
+
+    return ''.join(new_text)
+
+def _get_delta(text, new_text):
+    '''
+    Returns the changes that turn a string into another as a list of (start,
+    end, replacement) tuples.
+    '''
+    return [(start, end, new_text[new_start:new_end])
+            for tag, start, end, new_start, new_end in difflib.SequenceMatcher(None, text, new_text, autojunk=False).get_opcodes()
+            if tag != 'equal']
+
+def _wrap_po_string(text, width=80):
+    '''
+    Wraps a PO string into quoted lines shorter than width.
+    '''
+    lines = [[]]
+    len_line = 0
+    for token in _po_token_regex.finditer(text):
+        token = token.group()
+        if len_line >= width or len_line + len(token) >= width:
+            lines.append([token])
+            len_line = len(token)
+        else:
+            lines[-1].append(token)
+            len_line += len(token)
+
+    if len(lines) > 1 and lines[0] != []:
+        lines.insert(0, [])
+
+    return ['"' + ''.join(line) + '"' for line in lines]
+
+def _write_po_entry(outfile, po_entry):
+    '''
+    Writes a PO entry collected by KXLIFF.generate_target_translation.
+    '''
+    outfile.write(po_entry[1] + '\n')
+    for line in po_entry[2] + po_entry[3]:
+        outfile.write(line + '\n')
+    outfile.write('\n')
+
+def _stream_archive(path_to_source_file, path_to_target_file, internal_files):
+    '''
+    Builds a target archive from a source archive. Members that are not among
+    internal_files are copied as they are, compressed data included.
+    '''
+    internal_files = {internal_file.attrib['rel']: internal_file for internal_file in internal_files}
+
+    with open(path_to_source_file, 'rb') as source_file, \
+         zipfile.ZipFile(source_file) as source_zip, \
+         zipfile.ZipFile(path_to_target_file, 'w') as target_zip:
+        for zip_info in source_zip.infolist():
+            internal_file = internal_files.get(zip_info.filename)
+            if internal_file is None:
+                _copy_zip_member(source_file, source_zip, target_zip, zip_info)
+                continue
+
+            target_zip_info = zipfile.ZipInfo(zip_info.filename, zip_info.date_time)
+            target_zip_info.compress_type = zip_info.compress_type
+            target_zip_info.external_attr = zip_info.external_attr
+            with target_zip.open(target_zip_info, 'w') as target_member:
+                etree.ElementTree(internal_file[0]).write(target_member,
+                                                          encoding='UTF-8',
+                                                          xml_declaration=True)
+
+def _copy_zip_member(source_file, source_zip, target_zip, zip_info, chunk_size=1024*1024):
+    '''
+    Copies the raw, still compressed, data of an archive member to another
+    archive (see utils.write_raw_zip_member), or decompresses and compresses
+    it again where that is not supported.
+
+    Args:
+        source_file: File object of the source archive.
+        source_zip: zipfile.ZipFile of source_file.
+        target_zip: zipfile.ZipFile open for writing.
+        zip_info: zipfile.ZipInfo of the member in the source archive.
+    '''
+    source_file.seek(zip_info.header_offset)
+    local_header = source_file.read(30)
+    if local_header[:4] != b'PK\x03\x04':
+        raise zipfile.BadZipFile('Bad local file header for {0}.'.format(zip_info.filename))
+    filename_length, extra_length = struct.unpack('<HH', local_header[26:30])
+    source_file.seek(filename_length + extra_length, 1)
+
+    if write_raw_zip_member(target_zip, copy(zip_info), source_file, chunk_size):
+        return
+
+    with source_zip.open(zip_info) as source_member, \
+         target_zip.open(copy(zip_info), 'w') as target_member:
+        shutil.copyfileobj(source_member, target_member, chunk_size)
+
+_po_line_regex = regex.compile(r'([a-z0-9\[\]_]+)?\s?"(.*?)"$')
+
+def _gen_po_entries(po_file):
+    '''
+    Yields the entries of a .po file as dicts, one at a time, as they are read.
+    '''
+    entry = {}
+    entry_metadata = []
+    last_element = ''
+
+    for line in po_file:
+        line = line.strip()
+
+        if line.startswith('#'):
+            entry_metadata.append(line)
+            continue
+
+        if line == '':
+            if entry.get('msgid', None) is not None:
+                entry['metadata'] = '\n'.join(entry_metadata)
+                yield entry
+            entry, entry_metadata, last_element = {}, [], ''
+            continue
+
+        regex_match = _po_line_regex.search(line)
+
+        if regex_match == None:
+            continue
+
+        if regex_match.group(1):
+            last_element = regex_match.group(1)
+            entry[last_element] = ''
+
+        if regex_match.group(2):
+            entry[last_element] += regex_match.group(2)
+
+    if entry.get('msgid', None) is not None:
+        entry['metadata'] = '\n'.join(entry_metadata)
+        yield entry
+
+def _gen_po_elements(source_file_path, segmenter=None):
+    '''
+    Yields the internal file holding the header of a .po file, followed by a
+    translation unit per entry, as the file is read. Units are split into
+    sentences as they are created if a segmenter is given.
+    '''
+    tu_template = etree.Element('{{{0}}}unit'.format(nsmap['xliff']),
+                                nsmap={None:nsmap['xliff'], 'kaplan':nsmap['kaplan']})
+    segment = etree.SubElement(tu_template, '{{{0}}}segment'.format(nsmap['xliff']))
+    etree.SubElement(segment, '{{{0}}}source'.format(nsmap['xliff']))
+    etree.SubElement(segment, '{{{0}}}target'.format(nsmap['xliff']))
+
+    tu_counter = 1
+    segment_counter = 1
+
+    with open(source_file_path, encoding='UTF-8') as po_file:
+        entries = _gen_po_entries(po_file)
+
+        header = next(entries, None)
+        if header is None:
+            raise ValueError('No entries found in {0}.'.format(source_file_path))
+
+        po_metadata = '{0}\nmsgid ""\nmsgstr ""\n{1}\n'.format(header['metadata'],
+                                                                 '\n'.join('"' + line + '\\n"' for line in header['msgstr'].split('\\n') if line))
+
+        internal_file = etree.Element('{{{0}}}internal-file'.format(nsmap['kaplan']),
+                                      nsmap={None:nsmap['xliff'], 'kaplan':nsmap['kaplan']})
+        internal_file.attrib['{{{0}}}rel'.format(nsmap['kaplan'])] = 'self'
+        internal_file.text = po_metadata
+        yield internal_file
+
+        for entry in entries:
+            tu = deepcopy(tu_template)
+            tu.attrib['id'] = str(tu_counter)
+            tu.attrib['metadata'] = entry.get('metadata', '')
+            tu_counter += 1
+            tu[0][0].text = entry['msgid']
+            target_key = 'msgstr' if 'msgstr' in entry else 'msgstr[0]'
+            tu[0][1].text = entry[target_key]
+
+            tu.attrib['keys'] = ';'.join(('msgid', target_key))
+
+            tus = [tu]
+
+            if 'msgid_plural' in entry or 'plural' in entry:
+                tu.attrib['rid'] = tu.attrib['id']
+                source_key = 'msgid_plural' if 'msgid_plural' in entry else 'plural'
+                tu = deepcopy(tu)
+                tu.attrib['id'] = str(tu_counter)
+                tu_counter += 1
+                tu[0][0].text = entry[source_key]
+                tu[0][1].text = entry.get('msgstr[1]', '')
+
+                tu.attrib['keys'] = ';'.join((source_key, 'msgstr[1]'))
+
+                tus.append(tu)
+
+            for tu in tus:
+                segment_counter = _segment_unit(tu, segmenter, segment_counter, keep_target=True)
+                yield tu
+
+def _gen_txt_elements(source_file_path, segmenter=None):
+    '''
+    Yields a translation unit per line of a .txt file, as the file is read.
+    Units are split into sentences as they are created if a segmenter is
+    given.
+    '''
+    tu_template = etree.Element('{{{0}}}unit'.format(nsmap['xliff']),
+                                nsmap={None:nsmap['xliff'], 'kaplan':nsmap['kaplan']})
+    segment = etree.SubElement(tu_template, '{{{0}}}segment'.format(nsmap['xliff']))
+    etree.SubElement(segment, '{{{0}}}source'.format(nsmap['xliff']))
+    etree.SubElement(segment, '{{{0}}}target'.format(nsmap['xliff']))
+
+    ignorable_template = deepcopy(tu_template)
+    ignorable_template[0].tag = '{{{0}}}ignorable'.format(nsmap['xliff'])
+    ignorable_template[0].remove(ignorable_template[0][1])
+
+    tu_counter = 1
+    segment_counter = 1
+
+    with open(source_file_path, encoding='UTF-8') as source_file:
+        for line in source_file:
+            if line.strip() == '':
+                tu = deepcopy(ignorable_template)
+            else:
+                tu = deepcopy(tu_template)
+            tu.attrib['id'] = str(tu_counter)
+            tu_counter += 1
+            tu[0][0].text = line
+
+            segment_counter = _segment_unit(tu, segmenter, segment_counter)
+            yield tu
+
+def _write_element(xf, element):
+    '''
+    Writes an element to an etree.xmlfile with element contexts, so that it
+    uses the namespaces declared by the elements it is written in rather than
+    declaring them again.
+    '''
+    with xf.element(element.tag, element.attrib):
+        if element.text is not None:
+            xf.write(element.text)
+        for child in element:
+            if isinstance(child.tag, str):
+                _write_element(xf, child)
+            else:
+                xf.write(deepcopy(child), with_tail=False)
+            if child.tail is not None:
+                xf.write(child.tail)
+
+def _write_txt_unit(outfile, trans_unit, nsmap):
+    '''
+    Writes the target text of a translation unit of a .txt file, or its
+    source text where there is no target.
+    '''
+    source_tag = '{{{0}}}source'.format(nsmap[None])
+    target_tag = '{{{0}}}target'.format(nsmap[None])
+
+    for segment in trans_unit.iterchildren('{{{0}}}segment'.format(nsmap[None]), '{{{0}}}ignorable'.format(nsmap[None])):
+        source_text, target_text = None, None
+        for child in segment:
+            if child.tag == target_tag:
+                target_text = child.text
+            elif child.tag == source_tag:
+                source_text = child.text
+
+        if target_text is not None:
+            outfile.write(target_text)
+
+        else:
+            outfile.write(source_text)
+
+_json_token_regex = regex.compile(r'[ \t\n\r]*(?:([\{\}\[\]:,])|(")|(?:(-?(?:0|[1-9][0-9]*)(\.[0-9]+)?([eE][+\-]?[0-9]+)?)|(true|false|null))(?=[ \t\n\r,:\]\}]|$))')
+_json_literals = {'true': True, 'false': False, 'null': None}
+
+def _gen_json_events(json_file, chunk_size=1024*1024):
+    '''
+    Parses a JSON file incrementally, reading chunk_size characters at a time,
+    and yields (event, value) tuples in document order. Events are start_map,
+    map_key, end_map, start_array, end_array and value. The file is expected
+    to be well-formed.
+    '''
+    buffer = json_file.read(chunk_size)
+    eof = buffer == ''
+    i = 0
+    in_map = []
+    expect_key = False
+
+    while True:
+        token = _json_token_regex.match(buffer, i)
+        if not eof and (token is None or token.end() == len(buffer)):
+            chunk = json_file.read(chunk_size)
+            eof = chunk == ''
+            buffer = buffer[i:] + chunk
+            i = 0
+            continue
+
+        if token is None:
+            if buffer[i:].strip(' \t\n\r') == '' and len(in_map) == 0:
+                return
+            raise json.JSONDecodeError('Invalid JSON', buffer, i)
+
+        if token.group(2):
+            try:
+                value, end = json.decoder.scanstring(buffer, token.end())
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = json_file.read(chunk_size)
+                eof = chunk == ''
+                buffer = buffer[i:] + chunk
+                i = 0
+                continue
+            i = end
+            if expect_key:
+                expect_key = False
+                yield 'map_key', value
+            else:
+                yield 'value', value
+            continue
+
+        i = token.end()
+        punctuation = token.group(1)
+
+        if punctuation == '{':
+            in_map.append(True)
+            expect_key = True
+            yield 'start_map', None
+        elif punctuation == '[':
+            in_map.append(False)
+            yield 'start_array', None
+        elif punctuation == '}':
+            in_map.pop()
+            expect_key = False
+            yield 'end_map', None
+        elif punctuation == ']':
+            in_map.pop()
+            yield 'end_array', None
+        elif punctuation == ',':
+            expect_key = in_map[-1]
+        elif punctuation == ':':
+            pass
+        elif token.group(3):
+            if token.group(4) or token.group(5):
+                yield 'value', float(token.group(3))
+            else:
+                yield 'value', int(token.group(3))
+        else:
+            yield 'value', _json_literals[token.group(6)]
+
+def _gen_json_items(json_object, keys=[]):
+    '''
+    Yields (keys, value) tuples for the values of a JSON object. The values
+    of an array share the keys of the array.
+    '''
+    for k, v in json_object.items():
+        if isinstance(v, dict):
+            yield from _gen_json_items(v, (keys + [k]))
+        elif isinstance(v, list):
+            for child_v in v:
+                yield (keys + [k]), child_v
+        else:
+            yield (keys + [k]), v
+
+def _gen_json_stream_items(json_file):
+    '''
+    Same as _gen_json_items, for a JSON file that is parsed incrementally.
+    '''
+    keys = []
+    for event, value in _gen_json_events(json_file):
+        if event == 'value':
+            yield list(keys), value
+        elif event == 'map_key':
+            keys[-1] = value
+        elif event == 'start_map':
+            keys.append(None)
+        elif event == 'end_map':
+            keys.pop()
+
+def _create_segmenter(src, segmentation):
+    '''
+    Returns the segmenter for the segmentation argument of KXLIFF.new, or None
+    if the translation units are not to be split into sentences.
+    '''
+    if not segmentation:
+        return None
+    elif segmentation is True or segmentation == 'default':
+        return get_segmenter(src)
+    else:
+        return get_segmenter(src, segmentation)
+
+def _segment_unit(unit, segmenter, segment_counter, keep_target=False):
+    '''
+    Splits the segments of a new translation unit into sentences, moves
+    leading and trailing whitespace and tags to ignorables, and numbers the
+    segments starting from segment_counter. Without a segmenter, the segment
+    takes the id of the unit.
+
+    Returns the next segment number.
+    '''
+    if segmenter is None:
+        segment = unit.find('xliff:segment', nsmap)
+        if segment is not None:
+            segment.attrib['id'] = unit.attrib['id']
+        return segment_counter
+
+    for segment in unit.findall('.//xliff:segment', nsmap):
+        _split_segment(segment, segmenter, keep_target)
+
+    for segment in unit.findall('.//xliff:segment', nsmap):
+        if _clean_up_segment(segment):
+            segment.attrib['id'] = str(segment_counter)
+            segment_counter += 1
+
+    return segment_counter
+
+def _split_segment(segment, segmenter, keep_target=False):
+    '''
+    Splits a segment into sentences in place. The target of the segment is
+    kept with the first sentence if keep_target is True.
+    '''
+    source = segment.find('xliff:source', nsmap)
+    source_text = ''
+
+    source_text += source.text if source.text is not None else ''
+    for child in source:
+        source_text += child.tail if child.tail is not None else ''
+
+    if len(source_text.split()) <= 1:
+        return
+
+    len_sentences = segmenter.get_sentence_lengths(source_text)
+
+    new_segments = etree.Element('{{{0}}}segments'.format(nsmap['xliff']))
+    new_segment = etree.SubElement(new_segments, '{{{0}}}segment'.format(nsmap['xliff']))
+    new_source = etree.SubElement(new_segment, '{{{0}}}source'.format(nsmap['xliff']))
+    if not keep_target:
+        etree.SubElement(new_segment, '{{{0}}}target'.format(nsmap['xliff']))
+    else:
+        new_segment.append(segment.find('xliff:target', nsmap))
+
+    source_text = source.text
+    if source_text is not None:
+        source.text = None
+        len_sentences, new_segment, new_source = _create_segments(source_text,
+                                                                  len_sentences,
+                                                                  new_segment,
+                                                                  new_source,
+                                                                  new_segments)
+
+    for child in source:
+        child_tail = child.tail
+        new_source.append(child)
+        if child.tail is not None:
+            child.tail = None
+            len_sentences, new_segment, new_source = _create_segments(child_tail,
+                                                                      len_sentences,
+                                                                      new_segment,
+                                                                      new_source,
+                                                                      new_segments)
+
+    if len(new_source) == 1 and etree.QName(new_source[0]).localname == 'ec' and new_source.text is None:
+        new_child = new_source[0]
+        new_segment.getprevious().find('xliff:source', nsmap).append(new_child)
+        if new_child.tail:
+            new_source.text = new_child.tail
+        else:
+            new_segments.remove(new_segment)
+
+    segment_parent = segment.getparent()
+    segment_i = segment_parent.index(segment)
+    segment_parent.remove(segment)
+
+    for new_segment in new_segments:
+        segment_parent.insert(segment_i, new_segment)
+        segment_i += 1
+
+def _create_segments(text_element, len_sentences, new_segment, new_source, new_segments):
+    '''
+    Moves text_element into new_source, starting a new segment wherever a
+    sentence in len_sentences ends.
+    '''
+    while text_element is not None and len(text_element) > 0:
+        if len(text_element) >= len_sentences[0]:
+
+            if len(new_source) == 0:
+                if new_source.text is None:
+                    new_source.text = ''
+                new_source.text += text_element[:len_sentences[0]]
+            else:
+                if new_source[-1].tail is None:
+                    new_source[-1].tail = ''
+                new_source[-1].tail += text_element[:len_sentences[0]]
+            text_element = text_element[len_sentences[0]:]
+
+            len_sentences = len_sentences[1:]
+            new_segment = etree.SubElement(new_segments, '{{{0}}}segment'.format(nsmap['xliff']))
+            new_source = etree.SubElement(new_segment, '{{{0}}}source'.format(nsmap['xliff']))
+            etree.SubElement(new_segment, '{{{0}}}target'.format(nsmap['xliff']))
+        else:
+            if len(new_source) == 0:
+                if new_source.text is None:
+                    new_source.text = ''
+                new_source.text += text_element
+            else:
+                if new_source[-1].tail is None:
+                    new_source[-1].tail = ''
+                new_source[-1].tail += text_element
+
+            len_sentences[0] -= len(text_element)
+            text_element = None
+
+    return len_sentences, new_segment, new_source
+
+def _set_up_ignorable(segment, prev_or_next):
+    '''
+    Returns the ignorable before or after a segment, creating it if need be.
+    '''
+    ignorable_sibling = segment.getprevious() if prev_or_next == 'prev' else segment.getnext()
+    if ignorable_sibling is None or etree.QName(ignorable_sibling).localname != 'ignorable':
+        segment_parent = segment.getparent()
+        ignorable_i = segment_parent.index(segment)
+        if prev_or_next == 'next':
+            ignorable_i += 1
+
+        ignorable_sibling = etree.Element('{{{0}}}ignorable'.format(nsmap['xliff']))
+        etree.SubElement(ignorable_sibling, '{{{0}}}source'.format(nsmap['xliff']))
+        segment_parent.insert(ignorable_i, ignorable_sibling)
+
+    return ignorable_sibling
+
+def _clean_up_segment(segment):
+    '''
+    Moves the leading and trailing whitespace and tags of a segment to
+    ignorables, and drops tag pairs with nothing in between.
+
+    Returns False if the segment itself has turned into an ignorable.
+    '''
+    source = segment.find('xliff:source', nsmap)
+
+    for ec in source.findall('xliff:ec', nsmap):
+        if ((ec.tail is not None and ec.tail != '')
+        or ec.attrib.get('dataRef') is None or ec.getnext() is None):
+            continue
+        next_sibling = ec.getnext()
+
+        if (next_sibling.tag.split('}')[-1] == 'sc' and next_sibling.attrib.get('dataRef') is not None
+        and ec.attrib['dataRef'] == next_sibling.attrib['dataRef']):
+            if next_sibling.tail is not None and next_sibling.tail != '':
+                prev_sibling = ec.getprevious()
+                if prev_sibling is not None:
+                    if prev_sibling.tail is None:
+                        prev_sibling.tail = ''
+                    prev_sibling.tail += next_sibling.tail
+                else:
+                    if source.text is None:
+                        source.text = ''
+                    source.text += next_sibling.tail
+            source.remove(ec)
+            source.remove(next_sibling)
+
+    prev_ignorable = None
+    prev_ignorable_complete = False
+
+    while not prev_ignorable_complete:
+        if source.text is not None:
+            lstripped_source_text = source.text.lstrip()
+            if lstripped_source_text != source.text:
+                if lstripped_source_text != '':
+                    text_to_ignore = source.text[:-len(lstripped_source_text)]
+                    source.text = lstripped_source_text
+                    prev_ignorable_complete = True
+                else:
+                    text_to_ignore = source.text
+                    source.text = None
+                if prev_ignorable is None:
+                    prev_ignorable = _set_up_ignorable(segment, 'prev')
+                if len(prev_ignorable[0]) > 0:
+                    if prev_ignorable[0][-1].tail is None:
+                        prev_ignorable[0][-1].tail = text_to_ignore
+                    else:
+                        prev_ignorable[0][-1].tail += text_to_ignore
+                elif prev_ignorable[0].text is None:
+                    prev_ignorable[0].text = text_to_ignore
+                else:
+                    prev_ignorable[0].text += text_to_ignore
+            else:
+                prev_ignorable_complete = True
+        elif len(source) == 1 and source[0].tail is None:
+            if prev_ignorable is not None:
+                prev_ignorable[0].append(source[0])
+                segment.getparent().remove(segment)
+
+            segment.tag = '{{{0}}}ignorable'.format(nsmap['xliff'])
+            prev_ignorable_complete = True
+
+        elif len(source) > 0:
+            first_child = source[0]
+            first_child_localname = etree.QName(first_child).localname
+            if first_child_localname == 'ec':
+                pass
+            elif first_child_localname == 'sc':
+                ph_pairs = source.xpath('xliff:sc|xliff:ec', namespaces=nsmap)
+                if (len(ph_pairs) == 1 or (len(ph_pairs) == 2
+                and source[-1].tail is None and ph_pairs[1] == source[-1])):
+                    pass
+                else:
+                    prev_ignorable_complete = True
+            else:
+                if '&lt;tab' not in first_child.attrib.get('equiv', '') and '&lt;br' not in first_child.attrib.get('equiv', ''):
+                    prev_ignorable_complete = True
+
+            if not prev_ignorable_complete:
+                if prev_ignorable is None:
+                    prev_ignorable = _set_up_ignorable(segment, 'prev')
+                source.text = first_child.tail
+                first_child.tail = None
+                prev_ignorable[0].append(first_child)
+        else:
+            segment.getparent().remove(segment)
+            prev_ignorable_complete = True
+
+    if etree.QName(segment).localname == 'ignorable' or segment.getparent() is None:
+        return False
+
+    next_ignorable = None
+    next_ignorable_complete = False
+
+    while not next_ignorable_complete:
+        if len(source) > 0 and source[-1].tail is not None:
+            last_child = source[-1]
+            rstripped_last_child_tail = last_child.tail.rstrip()
+            if rstripped_last_child_tail != last_child.tail:
+                if rstripped_last_child_tail != '':
+                    text_to_ignore = last_child.tail[len(rstripped_last_child_tail):]
+                    last_child.tail = rstripped_last_child_tail
+                    next_ignorable_complete = True
+                else:
+                    text_to_ignore = last_child.tail
+                    last_child.tail = None
+
+                if next_ignorable is None:
+                    next_ignorable = _set_up_ignorable(segment, 'next')
+
+                if next_ignorable[0].text is None:
+                    next_ignorable[0].text = text_to_ignore
+                else:
+                    next_ignorable[0].text = text_to_ignore + next_ignorable[0].text
+
+            else:
+                next_ignorable_complete = True
+        elif len(source) > 0:
+            last_child = source[-1]
+            last_child_localname = etree.QName(last_child).localname
+            if last_child_localname == 'sc':
+                pass
+            elif last_child_localname == 'ec' and len(source.xpath('xliff:sc|xliff:ec', namespaces=nsmap)) == 1:
+                pass
+            elif last_child_localname == 'ph' and last_child.attrib.get('equiv', '').startswith(('&lt;br', '&lt;tab')):
+                pass
+            else:
+                next_ignorable_complete = True
+
+            if not next_ignorable_complete:
+                if next_ignorable is None:
+                    next_ignorable = _set_up_ignorable(segment, 'next')
+                next_ignorable[0].insert(0, last_child)
+                last_child.tail = next_ignorable[0].text
+                next_ignorable[0].text = None
+        elif source.text is not None:
+            rstripped_source_text = source.text.rstrip()
+            if rstripped_source_text != source.text:
+                if rstripped_source_text != '':
+                    text_to_ignore = source.text[len(rstripped_source_text):]
+                    source.text = rstripped_source_text
+                    next_ignorable_complete = True
+                else:
+                    text_to_ignore = source.text
+                    source.text = None
+
+                if next_ignorable is None:
+                    next_ignorable = _set_up_ignorable(segment, 'next')
+
+                if next_ignorable[0].text is None:
+                    next_ignorable[0].text = text_to_ignore
+                else:
+                    next_ignorable[0].text = text_to_ignore + next_ignorable[0].text
+
+            else:
+                next_ignorable_complete = True
+        else:
+            segment.getparent().remove(segment)
+            next_ignorable_complete = True
+
+    for sc_child in source.findall('xliff:sc', nsmap):
+        next_sibling = sc_child.getnext()
+        if (sc_child.tail is None and next_sibling is not None
+        and etree.QName(next_sibling).localname == 'ec'
+        and sc_child.attrib['id'] == next_sibling.attrib['id']):
+            source.remove(sc_child)
+            if next_sibling.tail is not None:
+                target_child = next_sibling.getprevious()
+                if target_child is not None:
+                    if target_child.tail is None:
+                        target_child.tail = next_sibling.tail
+                    else:
+                        target_child.tail += next_sibling.tail
+                else:
+                    if source.text is None:
+                        source.text = next_sibling.tail
+                    else:
+                        source.text += next_sibling.tail
+            source.remove(next_sibling)
+
+    return True
+
+def _new_and_save(cls, source_file, src, trgt, output_directory, segmentation):
+    '''
+    Worker for KXLIFF.new_batch.
+    '''
+    start = time.perf_counter()
+    try:
+        path_to_kxliff = cls.new_to_file(source_file, src, trgt, output_directory, segmentation)
+    except Exception as e:
+        return {'source': str(source_file),
+                'kxliff': None,
+                'status': 'failed',
+                'error': '{0}: {1}'.format(type(e).__name__, e),
+                'time': time.perf_counter() - start}
+
+    return {'source': str(source_file),
+            'kxliff': str(path_to_kxliff),
+            'status': 'ok',
+            'error': None,
+            'time': time.perf_counter() - start}
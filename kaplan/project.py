@@ -1,15 +1,17 @@
-# Installed libraries
-from lxml import etree
-
 # Standard Python libraries
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 import difflib
+import hashlib
 import json
-from pathlib import PurePosixPath
+from pathlib import Path, PurePosixPath
+import shutil
+import tempfile
+import time
 import zipfile
+import zlib
 
 # Internal Python files
-from .kdb import KDB
 import kaplan
 
 class Project:
@@ -43,6 +45,7 @@ class Project:
         '''
         Returns an analysis report for the project.
         '''
+        from .kdb import KDB
 
         project_entries = []
 
@@ -125,9 +128,41 @@ class Project:
 
         return project_report
 
-    def export(self, target_path, files_to_export=None, include_source_and_resources=True, task='translation', due_datetime=None, notes=None):
+    def export(self, target_path, files_to_export=None, include_source_and_resources=True, task='translation', due_datetime=None, notes=None, parallel=False, workers=None, baseline=None, deduplicate=False):
         '''
         Exports the project as a package that can be imported.
+
+        Args:
+            target_path: Path to the .kpp file.
+            files_to_export (optional): List of file IDs (Defaults to all files).
+            include_source_and_resources (optional): Includes source files,
+                                                     original bilingual files,
+                                                     TMs and termbases.
+            task (optional): Task of the recipient.
+            due_datetime (optional): datetime or ISO 8601 string.
+            notes (optional): Notes for the recipient.
+            parallel (optional): Compresses the files in a thread pool before
+                                 they are written to the package. Formats that
+                                 are compressed already are stored as they are.
+            workers (optional): Number of threads for parallel (Defaults to
+                                the number of CPUs).
+            baseline (optional): Manifest of a package exported before (see
+                                 Project.get_manifest), or the path to the
+                                 package. Exports a delta package with only
+                                 the files whose bilingual file has changed
+                                 since, leaving out any source file, original
+                                 bilingual file, TM and termbase that has not
+                                 changed either (see Project.extract).
+            deduplicate (optional): Stores files with identical content once
+                                    (see Project.extract). The manifest of a
+                                    package with such files lists them under
+                                    duplicates, and has the version 2, which
+                                    older versions of kaplan cannot extract
+                                    (see ProjectPackage.manifest_version).
+
+        The manifest of the package lists the SHA-256 digest of every file.
+        Journals of bilingual files (see XLIFF.save) are merged into their
+        files before these are exported.
         '''
         if not target_path.lower().endswith('.kpp'):
             target_path += '.kpp'
@@ -155,108 +190,535 @@ class Project:
         if notes is not None and notes != '':
             manifest['notes'] = notes
 
+        digests = {}
+        if baseline is not None:
+            if not isinstance(baseline, dict):
+                baseline = Project.get_manifest(baseline)
+            if 'digests' not in baseline:
+                raise ValueError('Baseline manifest has no digests.')
+            manifest['baseline'] = _get_manifest_digest(baseline)
+
+        members = []
+
+        for i in self.files:
+            if files_to_export and i not in files_to_export:
+                continue
+
+            targetBF = PurePosixPath(self.files[i]['targetBF'])
+            _compact_journal(targetBF)
+            targetBF_zip_path = PurePosixPath(self.target_language, targetBF.name)
+            if baseline is not None:
+                digests[str(targetBF_zip_path)] = _get_digest(targetBF)
+                if digests[str(targetBF_zip_path)] == baseline['digests'].get(str(targetBF_zip_path)):
+                    continue
+
+            file_dict = {}
+
+            if include_source_and_resources:
+                source = self.files[i].get('source')
+                if source:
+                    source = PurePosixPath(source)
+                    source_zip_path = PurePosixPath(self.source_language, source.name)
+                    file_dict['source'] = str(source_zip_path)
+                    members.append((source, source_zip_path))
+
+                originalBF = PurePosixPath(self.files[i]['originalBF'])
+                originalBF_zip_path = PurePosixPath(self.source_language, originalBF.name)
+                file_dict['originalBF'] = str(originalBF_zip_path)
+                members.append((originalBF, originalBF_zip_path))
+
+            file_dict['targetBF'] = str(targetBF_zip_path)
+            members.append((targetBF, targetBF_zip_path))
+
+            manifest['files'][i] = file_dict
+
+        if self.translation_memories != {} and include_source_and_resources:
+            manifest['tms'] = {}
+            for i in range(len(self.translation_memories)):
+                tm_path = PurePosixPath(self.translation_memories[i])
+                tm_zip_path = PurePosixPath('TM', tm_path.name)
+                manifest['tms'][i] = str(tm_zip_path)
+                members.append((tm_path, tm_zip_path))
+
+        if self.termbases != {} and include_source_and_resources:
+            manifest['tbs'] = {}
+            for i in range(len(self.termbases)):
+                tb_path = PurePosixPath(self.termbases[i])
+                tb_zip_path = PurePosixPath('TB', tb_path.name)
+                manifest['tbs'][i] = str(tb_zip_path)
+                members.append((tb_path, tb_zip_path))
+
+        if self.reports != {}:
+            manifest['reports'] = self.reports
+
+        if baseline is not None:
+            for path, zip_path in members:
+                if str(zip_path) not in digests:
+                    digests[str(zip_path)] = _get_digest(path)
+            members = [(path, zip_path) for path, zip_path in members
+                       if digests[str(zip_path)] != baseline['digests'].get(str(zip_path))]
+
         with zipfile.ZipFile(target_path, 'w') as project_package:
+            duplicates, member_digests = _write_members(project_package, members, parallel, workers, deduplicate)
+            digests.update(member_digests)
+            if duplicates != {}:
+                manifest['version'] = 2
+                manifest['duplicates'] = duplicates
+
+            if baseline is not None:
+                manifest['digests'] = {**baseline['digests'], **digests}
+            else:
+                manifest['digests'] = digests
+
+            project_package.writestr('manifest.json',
+                                     json.dumps(manifest, indent=4))
+
+    @staticmethod
+    def extract(project_package, project_directory):
+        '''
+        Extracts a project package. Files that were stored once for several
+        paths (see Project.export) are extracted to each of their paths, and
+        files that are in the project directory already, with the digest in
+        the manifest, are skipped.
+
+        A delta package is applied to the project directory of the package
+        it was exported against. Files it leaves out must be there unchanged.
+        '''
+        with ProjectPackage(project_package) as project_package:
+            return project_package.extract(project_directory)
+
+    @staticmethod
+    def extract_target_files(project_package, project_directory, project_files):
+        '''
+        Extracts target files from a project package.
+        '''
+        with ProjectPackage(project_package) as project_package:
+            project_package.extract_target_files(project_directory, project_files)
+
+    def generate_targets(self, output_directory, workers=None, files_to_generate=None, force=False, stream=False):
+        '''
+        Generates the target files of the project in parallel.
+
+        A record of the bilingual files, source files and options used is kept
+        in the output directory, and files for which none of these has changed
+        since their target file was last generated there are skipped. Journals
+        of bilingual files (see XLIFF.save) are merged into their files first.
+        A file whose target file has the same name as the target file of a file
+        before it fails, rather than overwriting it.
+
+        Args:
+            output_directory: Path to the directory where target files will be saved.
+            workers (optional): Number of worker processes (Defaults to the
+                                number of CPUs).
+            files_to_generate (optional): List of file IDs (Defaults to all files).
+            force (optional): Regenerates target files even if nothing has
+                              changed.
+            stream (optional): See KXLIFF.generate_target_translation.
+
+        Returns a dict of file IDs and dicts with the keys name, target, status
+        ('ok', 'skipped' or 'failed'), error and time (seconds).
+        '''
+        output_directory = Path(output_directory)
+        output_directory.mkdir(parents=True, exist_ok=True)
+
+        path_to_record = output_directory / '.kaplan-targets.json'
+        if path_to_record.exists():
+            with open(path_to_record, encoding='UTF-8') as record_file:
+                record = json.load(record_file)
+        else:
+            record = {}
+
+        results = {}
+        futures = {}
+        target_files = {}
+        with ProcessPoolExecutor(max_workers=workers) as executor:
             for i in self.files:
-                if files_to_export and i not in files_to_export:
+                if files_to_generate and i not in files_to_generate:
                     continue
-                file_dict = {}
-
-                if include_source_and_resources:
+                targetBF = self.files[i]['targetBF']
+                try:
+                    _compact_journal(targetBF)
+                    digest = _get_digest(targetBF)
                     source = self.files[i].get('source')
-                    if source:
-                        source = PurePosixPath(source)
-                        source_zip_path = PurePosixPath(self.source_language, source.name)
-                        file_dict['source'] = str(source_zip_path)
-                        project_package.write(source,
-                                              source_zip_path)
+                    if source is None:
+                        source = _get_original_source(targetBF)
+                    source = str(source)
+                    source_digest = _get_digest(source)
+                    target_filename = Path(source).name
+                    if target_filename in target_files:
+                        raise ValueError('The target file {0} is generated for file {1} already.'.format(target_filename,
+                                                                                                          target_files[target_filename]))
+                except Exception as e:
+                    results[i] = {'name': self.files[i].get('name'),
+                                  'target': None,
+                                  'status': 'failed',
+                                  'error': '{0}: {1}'.format(type(e).__name__, e),
+                                  'time': None}
+                    continue
+                target_files[target_filename] = i
+
+                generation = {'digest': digest,
+                              'source': source,
+                              'source_digest': source_digest,
+                              'stream': stream,
+                              'target': target_filename}
+                if (not force and record.get(str(targetBF)) == generation
+                and (output_directory / target_filename).exists()):
+                    results[i] = {'name': self.files[i].get('name'),
+                                  'target': str(output_directory / target_filename),
+                                  'status': 'skipped',
+                                  'error': None,
+                                  'time': 0.0}
+                    continue
 
-                    originalBF = PurePosixPath(self.files[i]['originalBF'])
-                    originalBF_zip_path = PurePosixPath(self.source_language, originalBF.name)
-                    file_dict['originalBF'] = str(originalBF_zip_path)
+                futures[i] = (generation, executor.submit(_generate_target,
+                                                          targetBF,
+                                                          output_directory,
+                                                          source,
+                                                          stream))
 
-                    project_package.write(originalBF,
-                                          originalBF_zip_path)
+            for i, (generation, future) in futures.items():
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    results[i] = {'target': None,
+                                  'status': 'failed',
+                                  'error': '{0}: {1}'.format(type(e).__name__, e),
+                                  'time': None}
+                results[i]['name'] = self.files[i].get('name')
 
-                targetBF = PurePosixPath(self.files[i]['targetBF'])
-                targetBF_zip_path = PurePosixPath(self.target_language, targetBF.name)
-                file_dict['targetBF'] = str(targetBF_zip_path)
+                if results[i]['status'] == 'ok':
+                    record[str(self.files[i]['targetBF'])] = generation
 
-                project_package.write(targetBF,
-                                      targetBF_zip_path)
+        with open(path_to_record, 'w', encoding='UTF-8') as record_file:
+            json.dump(record, record_file, indent=4)
 
-                manifest['files'][i] = file_dict
+        return {i: results[i] for i in self.files if i in results}
 
-            if self.translation_memories != {} and include_source_and_resources:
-                manifest['tms'] = {}
-                for i in range(len(self.translation_memories)):
-                    tm_path = PurePosixPath(self.translation_memories[i])
-                    tm_zip_path = PurePosixPath('TM', tm_path.name)
-                    manifest['tms'][i] = str(tm_zip_path)
+    @staticmethod
+    def get_manifest(project_package):
+        '''
+        Returns the project manifest from a package.
+        '''
+        with ProjectPackage(project_package) as project_package:
+            return project_package.manifest
 
-                    project_package.write(tm_path,
-                                          tm_zip_path)
+class ProjectPackage:
+    '''
+    A project package opened for reading. The archive is kept open and its
+    manifest is read once, so that files can be read, or opened as bilingual
+    files and KDBs, without extracting the package.
 
-            if self.termbases != {} and include_source_and_resources:
-                manifest['tbs'] = {}
-                for i in range(len(self.translation_memories)):
-                    tb_path = PurePosixPath(self.termbases[i])
-                    tb_zip_path = PurePosixPath('TB', tb_path.name)
-                    manifest['tbs'][i] = str(tb_zip_path)
+    Args:
+        project_package: Path to a .kpp file.
+    '''
+    # KDBs up to this size are loaded into memory rather than a temporary file.
+    max_kdb_size_in_memory = 256*1024*1024
+    # Latest version of the manifest that can be read. Manifests without a
+    # version are version 1.
+    manifest_version = 2
 
-                    project_package.write(tb_path,
-                                          tb_zip_path)
+    def __init__(self, project_package):
+        self.zip_file = zipfile.ZipFile(project_package)
+        self.manifest = json.loads(self.zip_file.read('manifest.json'))
+        self._temp_files = []
 
-            if self.reports != {}:
-                manifest['reports'] = self.reports
+        if self.manifest.get('version', 1) > self.manifest_version:
+            self.zip_file.close()
+            raise ValueError('Package version {0} is not supported.'.format(self.manifest['version']))
 
-            project_package.writestr('manifest.json',
-                                     json.dumps(manifest, indent=4))
+    def __enter__(self):
+        return self
 
-    @staticmethod
-    def extract(project_package, project_directory):
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
         '''
-        Extracts a project package.
+        Closes the archive, and the KDBs in temporary files along with their
+        files.
         '''
-        with zipfile.ZipFile(project_package) as project_package:
-            manifest = json.loads(project_package.read('manifest.json'))
+        self.zip_file.close()
+        for temp_file, kdb in self._temp_files:
+            kdb.conn.close()
+            Path(temp_file).unlink(missing_ok=True)
+        self._temp_files = []
 
+    def extract(self, project_directory):
+        '''
+        Extracts the package. See Project.extract.
+        '''
+        for i in self.manifest['files']:
+            for key in self.manifest['files'][i]:
+                self.extract_file(self.manifest['files'][i][key], project_directory)
 
+        if 'tms' in self.manifest:
+            for i in self.manifest['tms']:
+                self.extract_file(self.manifest['tms'][i], project_directory)
 
-            for i in manifest['files']:
-                for key in manifest['files'][i]:
-                    project_package.extract(str(PurePosixPath(manifest['files'][i][key])),
-                                            project_directory)
+        if 'tbs' in self.manifest:
+            for i in self.manifest['tbs']:
+                self.extract_file(self.manifest['tbs'][i], project_directory)
 
-            if 'tms' in manifest:
-                for i in manifest['tms']:
-                    project_package.extract(str(PurePosixPath(manifest['tms'][i])),
-                                            project_directory)
+        return self.manifest
 
-            if 'tbs' in manifest:
-                for i in manifest['tbs']:
-                    project_package.extract(str(PurePosixPath(manifest['tbs'][i])),
-                                            project_directory)
+    def extract_file(self, path_in_package, project_directory):
+        '''
+        Extracts a file from the package, unless it is in the project directory
+        already with the digest in the manifest. Raises ValueError for a path
+        that leads outside of the project directory.
+        '''
+        path_in_package = str(PurePosixPath(path_in_package))
+        target_path = Path(project_directory, path_in_package).resolve()
+        try:
+            target_path.relative_to(Path(project_directory).resolve())
+        except ValueError:
+            raise ValueError('{0} is outside of {1}.'.format(path_in_package, project_directory)) from None
+
+        digest = self.manifest.get('digests', {}).get(path_in_package)
+        if digest is not None and target_path.is_file() and _get_digest(target_path) == digest:
+            return
+
+        if path_in_package in self.manifest.get('duplicates', {}):
+            target_path.parent.mkdir(parents=True, exist_ok=True)
+            with self.open(path_in_package) as source_file, open(target_path, 'wb') as target_file:
+                shutil.copyfileobj(source_file, target_file, 1024*1024)
+            return
+
+        try:
+            self.zip_file.extract(path_in_package, project_directory)
+        except KeyError:
+            raise ValueError('{0} is neither in the package nor unchanged in {1}.'.format(path_in_package, project_directory)) from None
+
+    def extract_target_files(self, project_directory, project_files):
+        '''
+        Extracts target files from the package.
+        '''
+        for project_file in project_files:
+            self.extract_file(self.manifest['files'][str(project_file)]['targetBF'], project_directory)
 
-        return manifest
+    def open(self, path_in_package):
+        '''
+        Returns a file object to read a file in the package.
+        '''
+        path_in_package = str(PurePosixPath(path_in_package))
+        return self.zip_file.open(self.manifest.get('duplicates', {}).get(path_in_package, path_in_package))
 
-    @staticmethod
-    def extract_target_files(project_package, project_directory, project_files):
+    def open_bilingualfile(self, file_id, key='targetBF'):
         '''
-        Extracts target files from a project package.
+        Opens a bilingual file of the package straight from the archive.
+
+        Args:
+            file_id: ID of the file in the manifest.
+            key (optional): Either targetBF or originalBF.
         '''
-        with zipfile.ZipFile(project_package) as project_package:
-            manifest = json.loads(project_package.read('manifest.json'))
+        from lxml import etree
 
-            for project_file in project_files:
-                project_package.extract(str(PurePosixPath(manifest['files'][project_file]['targetBF'])),
-                                        project_directory)
+        path_in_package = self.manifest['files'][str(file_id)][key]
+        with self.open(path_in_package) as bilingualfile:
+            xml_tree = etree.parse(bilingualfile)
 
-    @staticmethod
-    def get_manifest(project_package):
+        return kaplan.open_bilingualfile(xml_tree, PurePosixPath(path_in_package).name)
+
+    def open_kdb(self, path_in_package, src=None, trgt=None):
         '''
-        Returns the project manifest from a package.
+        Opens a TM or termbase of the package (see the tms and tbs of the
+        manifest). Databases up to max_kdb_size_in_memory are loaded into
+        memory where SQLite supports it (Python 3.11+). Others are copied to a
+        temporary file, as SQLite needs one, which is removed on close.
+        Changes to the KDB are not saved to the package.
+        '''
+        import sqlite3
+        from .kdb import KDB
+
+        path_in_package = str(PurePosixPath(path_in_package))
+        zip_info = self.zip_file.getinfo(self.manifest.get('duplicates', {}).get(path_in_package, path_in_package))
+
+        if hasattr(sqlite3.Connection, 'deserialize') and zip_info.file_size <= self.max_kdb_size_in_memory:
+            conn = sqlite3.connect(':memory:')
+            with self.open(path_in_package) as kdb_file:
+                conn.deserialize(kdb_file.read())
+            return KDB(conn, src, trgt)
+
+        with tempfile.NamedTemporaryFile(suffix='.kdb', delete=False) as temp_file, \
+             self.open(path_in_package) as kdb_file:
+            shutil.copyfileobj(kdb_file, temp_file, 1024*1024)
+
+        try:
+            kdb = KDB(temp_file.name, src, trgt)
+        except Exception:
+            Path(temp_file.name).unlink(missing_ok=True)
+            raise
+        self._temp_files.append((temp_file.name, kdb))
+
+        return kdb
+
+    def read(self, path_in_package):
+        '''
+        Returns the content of a file in the package.
         '''
-        with zipfile.ZipFile(project_package) as project_package:
-            manifest = json.loads(project_package.read('manifest.json'))
+        with self.open(path_in_package) as package_file:
+            return package_file.read()
+
+# Formats that are compressed already, and are stored as they are by
+# Project.export(parallel=True).
+_stored_suffixes = ('.7z', '.docx', '.gif', '.gz', '.jpeg', '.jpg', '.kpp',
+                    '.odp', '.ods', '.odt', '.pdf', '.png', '.pptx', '.xlsx',
+                    '.zip')
+
+def _compact_journal(bilingualfile):
+    '''
+    Merges the journal of a bilingual file into the file, if it has one, so
+    that the file has every change saved.
+    '''
+    if Path(str(bilingualfile) + '.journal').exists():
+        kaplan.open_bilingualfile(str(bilingualfile)).close()
+
+def _compress_member(path, chunk_size=1024*1024):
+    '''
+    Worker for Project.export. Reads a file once, and returns its SHA-256
+    digest, CRC-32, size and a temporary file with its compressed data.
+    '''
+    digest = hashlib.sha256()
+    crc = 0
+    file_size = 0
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    compressed_file = tempfile.SpooledTemporaryFile(max_size=4*1024*1024)
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            compressed_file.write(compressor.compress(chunk))
+
+    compressed_file.write(compressor.flush())
 
-        return manifest
+    return digest.hexdigest(), crc, file_size, compressed_file
+
+def _write_members(project_package, members, parallel=False, workers=None, deduplicate=False, chunk_size=1024*1024):
+    '''
+    Writes files to an archive in order, reading each file once where it
+    can. With parallel, files are compressed in a thread pool first, except
+    the formats in _stored_suffixes, and otherwise they are stored. With
+    deduplicate, a file with the same content as a file written before it is
+    not written again.
+
+    Returns a dict of the paths of the files that were not written and the
+    paths of the files with the same content, and a dict of the paths and
+    digests of all files.
+    '''
+    from .utils import write_raw_zip_member
+
+    duplicates = {}
+    digests = {}
+    written_digests = {}
+    written_sizes = set()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for path, zip_path in members:
+            if parallel and PurePosixPath(path).suffix.lower() not in _stored_suffixes:
+                futures.append((path, zip_path, executor.submit(_compress_member, path)))
+            else:
+                futures.append((path, zip_path, None))
+
+        for path, zip_path, future in futures:
+            zip_info = zipfile.ZipInfo.from_file(path, zip_path)
+
+            if future is None:
+                # Only a file as large as one written before may be one of its
+                # duplicates, and needs to be read before it is written.
+                if deduplicate and zip_info.file_size in written_sizes:
+                    digest = _get_digest(path)
+                    if digest in written_digests:
+                        digests[str(zip_path)] = digest
+                        if written_digests[digest] != str(zip_path):
+                            duplicates[str(zip_path)] = written_digests[digest]
+                        continue
+
+                digest = hashlib.sha256()
+                zip_info.compress_type = zipfile.ZIP_STORED
+                with open(path, 'rb') as f, project_package.open(zip_info, 'w') as member:
+                    for chunk in iter(lambda: f.read(chunk_size), b''):
+                        digest.update(chunk)
+                        member.write(chunk)
+                digest = digest.hexdigest()
+
+            else:
+                digest, crc, file_size, compressed_file = future.result()
+                with compressed_file:
+                    if deduplicate and digest in written_digests:
+                        digests[str(zip_path)] = digest
+                        if written_digests[digest] != str(zip_path):
+                            duplicates[str(zip_path)] = written_digests[digest]
+                        continue
+
+                    zip_info.compress_type = zipfile.ZIP_DEFLATED
+                    zip_info.CRC = crc
+                    zip_info.file_size = file_size
+                    zip_info.compress_size = compressed_file.tell()
+                    compressed_file.seek(0)
+                    if not write_raw_zip_member(project_package, zip_info, compressed_file, chunk_size):
+                        project_package.write(path, zip_path, zipfile.ZIP_DEFLATED)
+
+            digests[str(zip_path)] = digest
+            written_digests.setdefault(digest, str(zip_path))
+            written_sizes.add(zip_info.file_size)
+
+    return duplicates, digests
+
+def _get_digest(path, chunk_size=1024*1024):
+    '''
+    Returns the SHA-256 digest of a file.
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def _get_manifest_digest(manifest):
+    '''
+    Returns the SHA-256 digest of the file digests in a package manifest.
+    '''
+    return hashlib.sha256(json.dumps(manifest['digests'], sort_keys=True).encode()).hexdigest()
+
+def _get_original_source(bilingualfile):
+    '''
+    Returns the path to the source file of a bilingual file, from the
+    original attribute of its first file element, parsing only up to it.
+    '''
+    from lxml import etree
+
+    for _, element in etree.iterparse(str(bilingualfile), events=('start',)):
+        if etree.QName(element).localname == 'file':
+            return element.attrib['original']
+
+    raise ValueError('{0} has no file element.'.format(bilingualfile))
+
+def _generate_target(targetBF, output_directory, path_to_source_file=None, stream=False):
+    '''
+    Worker for Project.generate_targets.
+    '''
+    start = time.perf_counter()
+    try:
+        bilingualfile = kaplan.open_bilingualfile(targetBF)
+        if path_to_source_file is None:
+            path_to_source_file = bilingualfile.xml_root.find('file', bilingualfile.nsmap).attrib['original']
+        target_filename = Path(path_to_source_file).name
+        bilingualfile.generate_target_translation(output_directory,
+                                                  path_to_source_file,
+                                                  target_filename,
+                                                  stream=stream)
+    except Exception as e:
+        return {'target': None,
+                'status': 'failed',
+                'error': '{0}: {1}'.format(type(e).__name__, e),
+                'time': time.perf_counter() - start}
+
+    return {'target': str(Path(output_directory, target_filename)),
+            'status': 'ok',
+            'error': None,
+            'time': time.perf_counter() - start}
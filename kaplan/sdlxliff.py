@@ -58,6 +58,8 @@ class SDLXLIFF(XLIFF):
         else:
             segment_details.attrib.pop('locked', None)
 
+        self._mark_changed(segment_details)
+
     def update_segment(self, target_segment, tu_no, segment_no, segment_state, submitted_by):
         '''
         Updates a target segment.
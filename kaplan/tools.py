@@ -1,41 +1,208 @@
+from lxml import etree
 import regex
 
+from array import array
 from collections import Counter
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 import csv
+import functools
+import heapq
+import html
 import io
+import json
+import mmap
 from pathlib import Path
 import string
-import tempfile
+import struct
+import sys
+import time
 import zipfile
 
+import kaplan
+
+_letter_regex = regex.compile(r'\p{L}')
+_punctuation_regex = regex.compile(r'([\.\!\?\:]+)$')
+_tag_regex = regex.compile(r'<[^<>]+>')
+_entry_tag_regex = regex.compile(r'<([^<>\s/]+)-([^<>\s/-]+)/>')
+_number_regex = regex.compile(r'\p{N}+(?:[\.,\u00a0\u202f\' ]\p{N}+)*')
+_number_separator_regex = regex.compile(r'[^\p{N}]')
+_double_space_regex = regex.compile(r'  +')
+
+
+def _get_edit_distance(word_a, word_b, max_distance):
+    '''
+    Returns the optimal string alignment distance between two words, or
+    max_distance + 1 as soon as it is known to be larger than max_distance.
+    '''
+    if abs(len(word_a) - len(word_b)) > max_distance:
+        return max_distance + 1
+
+    previous_previous_row = None
+    previous_row = list(range(len(word_b) + 1))
+    for i in range(1, len(word_a) + 1):
+        row = [i] + [0] * len(word_b)
+        for j in range(1, len(word_b) + 1):
+            row[j] = min(previous_row[j] + 1,
+                         row[j - 1] + 1,
+                         previous_row[j - 1] + (word_a[i - 1] != word_b[j - 1]))
+            if (i > 1 and j > 1
+            and word_a[i - 1] == word_b[j - 2]
+            and word_a[i - 2] == word_b[j - 1]):
+                row[j] = min(row[j], previous_previous_row[j - 2] + 1)
+        if min(row) > max_distance:
+            return max_distance + 1
+        previous_previous_row, previous_row = previous_row, row
+
+    return min(previous_row[-1], max_distance + 1)
 
 class QAChecker:
-    def __init__(self):
+    '''
+    Typo suggestions are looked up in a symmetric delete index: every known
+    word is stored under the strings that can be made from its first
+    prefix_length letters by deleting up to max_edit_distance of them, so that
+    the candidates for a word are found through its own deletes only.
+    '''
+    max_edit_distance = 2
+    prefix_length = 7
+    max_cached_corrections = 4096
+    model_version = 2
+
+    def __init__(self, rules=None):
         '''
         Creates a QAChecker instance.
+
+        Args:
+            rules (optional): List of QARule instances, or names of rules in
+                              qa_rules, to apply in QAChecker.check (Defaults
+                              to default_qa_rules).
         '''
 
-        self.letters = {}
-        self.word_counter = {}
+        self.rules = [qa_rules[rule]() if isinstance(rule, str) else rule
+                      for rule in (default_qa_rules if rules is None else rules)]
+        self.rule_timings = Counter()
+        self.letters = set()
+        self.word_counter = Counter()
+        self.deletes = {}
+        self.total = 0
+        self.__path_to_mapped_model = None
+        self.__get_corrections = functools.lru_cache(maxsize=self.max_cached_corrections)(self.__find_corrections)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_QAChecker__get_corrections']
+        if self.__path_to_mapped_model is not None:
+            del state['word_counter'], state['deletes']
+        elif not isinstance(self.word_counter, Counter):
+            state['word_counter'] = Counter(dict(self.word_counter.items()))
+            state['deletes'] = dict(self.deletes.items())
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.__path_to_mapped_model is not None:
+            mapped_model = self.open(self.__path_to_mapped_model)
+            self.word_counter = mapped_model.word_counter
+            self.deletes = mapped_model.deletes
+        self.__get_corrections = functools.lru_cache(maxsize=self.max_cached_corrections)(self.__find_corrections)
 
     def build(self, target_segments):
-        target_segments = '\n'.join(target_segments)
-        self.letters = set(filter(lambda x: regex.match('\p{L}', x),
-                                   set(target_segments)))
+        '''
+        Builds the model from scratch. See QAChecker.update.
+        '''
+        self.letters = set()
+        self.word_counter = Counter()
+        self.deletes = {}
+        self.total = 0
+        self.__path_to_mapped_model = None
+
+        self.update(target_segments)
+
+    def update(self, target_segments):
+        '''
+        Adds target segments to the model. Segments are consumed one at a
+        time, so they can be streamed from a TM or bilingual files (see
+        QAChecker.gen_kdb_segments and QAChecker.gen_bilingualfile_segments).
+
+        Args:
+            target_segments: Iterable of strings.
+        '''
+        self.__make_mutable()
+
+        letters = self.letters
+        word_counter = self.word_counter
+        for target_segment in target_segments:
+            letters.update(character for character in set(target_segment).difference(letters)
+                           if _letter_regex.match(character))
+            for word in self.__words(target_segment):
+                if word not in word_counter:
+                    self.__add_to_index(word)
+                word_counter[word] += 1
+                self.total += 1
+
+        self.__get_corrections.cache_clear()
+
+    def merge(self, *qa_checkers):
+        '''
+        Merges other models into this one, for example partial models built
+        in parallel from parts of a corpus.
+        '''
+        self.__make_mutable()
+
+        for qa_checker in qa_checkers:
+            self.letters.update(qa_checker.letters)
+            for word, count in qa_checker.word_counter.items():
+                if word not in self.word_counter:
+                    self.__add_to_index(word)
+                self.word_counter[word] += count
+            self.total += qa_checker.total
+
+        self.__get_corrections.cache_clear()
+
+    @staticmethod
+    def gen_bilingualfile_segments(bilingualfile):
+        '''
+        Yields the target segments of a bilingual file as plain text.
+
+        Args:
+            bilingualfile: Path to a bilingual file, or a bilingual file
+                           instance.
+        '''
+        if isinstance(bilingualfile, (str, Path)):
+            bilingualfile = kaplan.open_bilingualfile(bilingualfile)
 
-        self.word_counter = Counter(self.__words(target_segments))
+        for translation_unit in bilingualfile.gen_translation_units():
+            for segment in translation_unit:
+                for child in segment:
+                    if isinstance(child.tag, str) and etree.QName(child).localname == 'target':
+                        yield _get_text(child)
+
+    @staticmethod
+    def gen_kdb_segments(kdb):
+        '''
+        Yields the target entries of a TM as plain text.
+
+        Args:
+            kdb: Path to a .kdb file, or a KDB instance.
+        '''
+        if not isinstance(kdb, kaplan.kdb.KDB):
+            kdb = kaplan.kdb.KDB(kdb)
+
+        for row in kdb.conn.execute('''SELECT target FROM main'''):
+            yield html.unescape(_tag_regex.sub(' ', row[0]))
 
     def check(self, segments: dict):
         '''
-        Checks a dict of segments.
+        Checks a dict of segments. Every rule in self.rules is applied to a
+        segment before moving on to the next one, and the time spent in each
+        rule is added to self.rule_timings.
 
         Args:
             segments dict(dict)
         '''
         results = {}
 
-        _regex = regex.compile('([\.\!\?\:]+)$')
-
+        rule_timings = self.rule_timings
         for i, segment in segments.items():
             if segment.get('source', '') == '':
                 continue
@@ -46,104 +213,657 @@ class QAChecker:
 
             segment_results = []
 
-            source = segment['source']
-            target = segment['target']
+            for rule in self.rules:
+                start = time.perf_counter()
+                segment_results += rule.check(segment, self)
+                rule_timings[rule.name] += time.perf_counter() - start
 
-            if (source[0].lower() == source[0]) != (target[0].lower() == target[0]):
-                segment_results.append({'level':'info',
-                                        'type':'capitalization'})
+            results[i] = segment_results
+
+        return results
 
-            source_punctuation = _regex.search(source)
-            target_punctuation = _regex.search(target)
+    def check_bilingualfile(self, bilingualfile):
+        '''
+        Checks the segments of a bilingual file in one pass over it. Besides
+        their text, the inline tags of the source and the target are passed to
+        the rules as lists (source_tags and target_tags), so that the tags rule
+        can compare them.
 
-            if (bool(source_punctuation) != bool(target_punctuation) or
-                source_punctuation.groups() != target_punctuation.groups()):
-                segment_results.append({'level':'info',
-                                        'type':'punctuation'})
+        Args:
+            bilingualfile: Path to a bilingual file, or a bilingual file
+                           instance.
 
-            if all((self.letters, self.word_counter)):
-                for correction in self.corrections_for_sentence(target):
-                    word = correction['word']
-                    suggestions = correction['suggestions']
-                    segment_results.append({'level':'info',
-                                            'type':'typo',
-                                            'word':word,
-                                            'suggestions':suggestions})
+        Returns a dict of (unit ID, segment ID) tuples and the results of
+        QAChecker.check.
+        '''
+        if isinstance(bilingualfile, (str, Path)):
+            bilingualfile = kaplan.open_bilingualfile(bilingualfile)
 
-            results[i] = segment_results
+        results = {}
+        for translation_unit in bilingualfile.gen_translation_units():
+            segments = {}
+            for segment in translation_unit:
+                if segment.tag.endswith('segment'):
+                    segments[(translation_unit.attrib.get('id'), segment.attrib.get('id'))] = _get_segment(segment)
+            results.update(self.check(segments))
 
         return results
 
-    def __P(self, word):
-        return self.word_counter[word] / sum(self.word_counter.values())
+    def check_files(self, bilingualfiles, workers=None):
+        '''
+        Checks bilingual files in parallel. Segments are streamed from each
+        file one translation unit at a time, and every worker process uses a
+        single read-only copy of this QAChecker.
+
+        Args:
+            bilingualfiles: List of paths to bilingual files, or Project
+                            instances whose bilingual files will be checked.
+            workers (optional): Number of worker processes (Defaults to the
+                                number of CPUs).
+
+        Returns a dict with the keys files, segments, time (seconds) and
+        throughput (segments per second). files is a list of dicts, in input
+        order, with the keys file, status ('ok' or 'failed'), error, segments,
+        time (seconds) and results, which maps (unit ID, segment ID) tuples to
+        the results of QAChecker.check. Time spent in each rule across workers
+        is added to self.rule_timings.
+        '''
+        paths = []
+        for bilingualfile in bilingualfiles:
+            if isinstance(bilingualfile, kaplan.project.Project):
+                paths += [bilingualfile.files[i]['targetBF'] for i in bilingualfile.files]
+            else:
+                paths.append(bilingualfile)
+
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_set_up_qa_worker,
+                                 initargs=(self,)) as executor:
+            futures = [executor.submit(_check_file, path) for path in paths]
+
+            files = []
+            for path, future in zip(paths, futures):
+                try:
+                    files.append(future.result())
+                    self.rule_timings.update(files[-1].pop('rule_timings'))
+                except Exception as e:
+                    files.append({'file': str(path),
+                                  'status': 'failed',
+                                  'error': '{0}: {1}'.format(type(e).__name__, e),
+                                  'segments': 0,
+                                  'time': None,
+                                  'results': {}})
+        elapsed = time.perf_counter() - start
+
+        segments = sum(result['segments'] for result in files)
+        return {'files': files,
+                'segments': segments,
+                'time': elapsed,
+                'throughput': segments / elapsed if elapsed else 0.0}
 
     def corrections(self, word, n=5):
-        return sorted(self.__candidates(word), key=self.__P, reverse=True)[:n]
+        '''
+        Returns the n most probable known words for a word. Results are cached
+        per model, as the same misspellings tend to recur throughout a file.
+        '''
+        return list(self.__get_corrections(word, n))
 
     def corrections_for_sentence(self, sentence, n=5):
         for word in self.__words(sentence):
             if word in self.word_counter:
                 continue
-            yield {'word':word, 'suggestions':self.corrections(word)}
+            yield {'word':word, 'suggestions':self.corrections(word, n)}
 
     @classmethod
-    def open(cls, path):
-        with zipfile.ZipFile(path) as zf:
-            letters = set(zf.read('letters.txt').decode('UTF-8').strip())
+    def open(cls, path, memory_map=True, rules=None):
+        '''
+        Opens a .kqac file.
 
-            with zf.open('word_counter.csv') as csvfile:
-                fieldnames = ['word', 'count']
-                csvreader = csv.DictReader(io.TextIOWrapper(csvfile, 'UTF-8'), fieldnames=fieldnames)
-                word_counter = Counter({row['word']:int(row['count']) for row in csvreader})
+        Args:
+            path: Path to the .kqac file.
+            memory_map (optional): Whether the words, counts and index of the
+                                   model are memory-mapped from the file rather
+                                   than read into memory. Mapped models load
+                                   almost instantly, and processes that open the
+                                   same file share its pages.
+            rules (optional): See QAChecker.
+        '''
+        qac = cls(rules)
 
-        qac = cls()
-        qac.letters = letters
-        qac.word_counter = word_counter
+        with zipfile.ZipFile(path) as zf:
+            qac.letters = set(zf.read('letters.txt').decode('UTF-8').strip())
+
+            if 'kqac.json' not in zf.namelist():
+                qac.__open_csv_model(zf)
+                return qac
+
+            metadata = json.loads(zf.read('kqac.json'))
+            if metadata['version'] > cls.model_version:
+                raise ValueError('Model version {0} is not supported.'.format(metadata['version']))
+
+            if memory_map:
+                with open(path, 'rb') as f:
+                    buffer = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            else:
+                buffer = None
+            members = {name: _read_member(zf, name, buffer) for name in _model_members}
+
+        byteswap = metadata['byteorder'] != sys.byteorder
+        words = _SortedStrings(members['words.bin'], _get_uint32_array(members['word_offsets.bin'], byteswap))
+        qac.word_counter = _MappedWordCounter(words,
+                                              _get_uint32_array(members['counts.bin'], byteswap))
+        qac.deletes = _MappedDeletes(_SortedStrings(members['deletes.bin'], _get_uint32_array(members['delete_offsets.bin'], byteswap)),
+                                     _get_uint32_array(members['posting_offsets.bin'], byteswap),
+                                     _get_uint32_array(members['postings.bin'], byteswap),
+                                     words)
+        qac.max_edit_distance = metadata['max_edit_distance']
+        qac.prefix_length = metadata['prefix_length']
+        qac.total = metadata['total']
+        if memory_map:
+            qac.__path_to_mapped_model = str(path)
 
         return qac
 
-    def save(self, path):
-        path = Path(path).with_suffix('.kqac')
-
-        with tempfile.TemporaryDirectory() as tmpdir:
-            path_letters = Path(tmpdir, 'letters.txt')
-            with open(path_letters, 'w', encoding='UTF-8') as f:
-                for l in self.letters:
-                    f.write(l)
+    def probability(self, word):
+        '''
+        Returns the probability of a word in the corpus of the model.
+        '''
+        return self.word_counter.get(word, 0) / self.total if self.total else 0.0
 
-            path_word_counter = Path(tmpdir, 'word_counter.csv')
-            with open(path_word_counter, 'w', encoding='UTF-8') as csvfile:
-                fieldnames = ['word', 'count']
-                csvwriter = csv.DictWriter(csvfile, fieldnames=fieldnames)
+    def save(self, path):
+        '''
+        Saves the model as a .kqac file.
 
-                #csvwriter.writeheader()
-                for word, count in self.word_counter.most_common():
-                    csvwriter.writerow({'word':word, 'count':count})
+        Words are sorted and stored as UTF-8 with an array of offsets, next to
+        an array of their counts. The delete index is stored the same way, with
+        lists of word numbers for each delete. Members are not compressed, so
+        that they can be memory-mapped.
+        '''
+        path = Path(path).with_suffix('.kqac')
 
-            with zipfile.ZipFile(path, 'w') as zf:
-                zf.write(path_letters, 'letters.txt')
-                zf.write(path_word_counter, 'word_counter.csv')
+        words = sorted(self.word_counter)
+        word_numbers = {word: i for i, word in enumerate(words)}
+        deletes = sorted(self.deletes)
+
+        postings = array('I')
+        posting_offsets = array('I', [0])
+        for delete in deletes:
+            postings.extend(sorted(word_numbers[word] for word in self.deletes[delete]))
+            posting_offsets.append(len(postings))
+
+        word_blob, word_offsets = _join_strings(words)
+        delete_blob, delete_offsets = _join_strings(deletes)
+
+        metadata = {'version': self.model_version,
+                    'byteorder': sys.byteorder,
+                    'max_edit_distance': self.max_edit_distance,
+                    'prefix_length': self.prefix_length,
+                    'total': sum(self.word_counter.values())}
+
+        with zipfile.ZipFile(path, 'w') as zf:
+            zf.writestr('kqac.json', json.dumps(metadata))
+            zf.writestr('letters.txt', ''.join(self.letters))
+            zf.writestr('words.bin', word_blob)
+            zf.writestr('word_offsets.bin', word_offsets.tobytes())
+            zf.writestr('counts.bin', array('I', (self.word_counter[word] for word in words)).tobytes())
+            zf.writestr('deletes.bin', delete_blob)
+            zf.writestr('delete_offsets.bin', delete_offsets.tobytes())
+            zf.writestr('posting_offsets.bin', posting_offsets.tobytes())
+            zf.writestr('postings.bin', postings.tobytes())
+
+        return path
 
     def __candidates(self, word, n_edits=2):
-        words = set([word])
+        n_edits = min(n_edits, self.max_edit_distance)
+
+        candidates = set()
+        checked_words = set()
+        for delete in self.__deletes(word):
+            for candidate in self.deletes.get(delete, ()):
+                if candidate in checked_words:
+                    continue
+                checked_words.add(candidate)
+                if _get_edit_distance(word, candidate, n_edits) <= n_edits:
+                    candidates.add(candidate)
+
+        return candidates
+
+    def __find_corrections(self, word, n):
+        # Counts rank candidates the same way as their probabilities.
+        return tuple(heapq.nlargest(n, self.__candidates(word), key=self.word_counter.__getitem__))
+
+    def __deletes(self, word):
+        word = word[:self.prefix_length]
+        deletes = set([word])
+
+        edge = deletes
+        for n in range(self.max_edit_distance):
+            edge = set([w[:i] + w[i+1:] for w in edge for i in range(len(w))])
+            deletes.update(edge)
+
+        return deletes
+
+    def __add_to_index(self, word):
+        for delete in self.__deletes(word):
+            self.deletes.setdefault(delete, []).append(word)
+
+    def __make_mutable(self):
+        # Models opened from .kqac files are read-only, memory-mapped or not.
+        if not isinstance(self.word_counter, Counter):
+            self.word_counter = Counter(dict(self.word_counter.items()))
+            self.deletes = dict(self.deletes.items())
+        self.__path_to_mapped_model = None
+
+    def __open_csv_model(self, zf):
+        with zf.open('word_counter.csv') as csvfile:
+            fieldnames = ['word', 'count']
+            csvreader = csv.DictReader(io.TextIOWrapper(csvfile, 'UTF-8'), fieldnames=fieldnames)
+            self.word_counter = Counter({row['word']:int(row['count']) for row in csvreader})
+
+        # CSV models have no index, so one is built on load.
+        for word in self.word_counter:
+            self.__add_to_index(word)
+        self.total = sum(self.word_counter.values())
 
-        for n in range(n_edits):
-            words.update([edit for edit in self.__edits(word) for word in words])
+    def __words(self, text):
+        return filter(lambda x: len(x) > 1 and regex.match('^[\p{L}\'-]+$', x),
+                      regex.sub('[^\p{L}\p{N}\s\'-]', '', text).split())
 
-        return self.__known(words)
+class QARule:
+    '''
+    Base class for the rules applied by QAChecker.check. Anything a rule needs
+    (regexes, term lists) is compiled once when the rule is created.
 
-    def __known(self, words):
-        return set([w for w in words if w in self.word_counter])
+    Subclasses set name and implement check.
+    '''
+    name = None
 
-    def __edits(self, word):
-        letters    = self.letters
-        splits     = [(word[:i], word[i:])    for i in range(len(word) + 1)]
-        deletes    = [L + R[1:]               for L, R in splits if R]
-        transposes = [L + R[1] + R[0] + R[2:] for L, R in splits if len(R)>1]
-        replaces   = [L + c + R[1:]           for L, R in splits if R for c in letters]
-        inserts    = [L + c + R               for L, R in splits for c in letters]
-        return set(deletes + transposes + replaces + inserts)
+    def check(self, segment, qa_checker):
+        '''
+        Returns a list of results for a segment.
 
-    def __words(self, text):
-        return filter(lambda x: len(x) > 1 and regex.match('^[\p{L}\'-]+$', x),
-                      regex.sub('[^\p{L}\p{N}\s\'-]', '', text).split())
+        Args:
+            segment: Dict with the keys source and target.
+            qa_checker: The QAChecker applying the rule.
+        '''
+        raise NotImplementedError
+
+class CapitalizationRule(QARule):
+    '''
+    Flags segments whose source and target do not start with the same case.
+    '''
+    name = 'capitalization'
+
+    def check(self, segment, qa_checker):
+        source, target = segment['source'], segment['target']
+        if (source[0].lower() == source[0]) != (target[0].lower() == target[0]):
+            return [{'level':'info',
+                     'type':'capitalization'}]
+        return []
+
+class PunctuationRule(QARule):
+    '''
+    Flags segments whose source and target end with different punctuation.
+    '''
+    name = 'punctuation'
+
+    def check(self, segment, qa_checker):
+        source_punctuation = _punctuation_regex.search(segment['source'])
+        target_punctuation = _punctuation_regex.search(segment['target'])
+
+        if (bool(source_punctuation) != bool(target_punctuation) or
+            source_punctuation and source_punctuation.groups() != target_punctuation.groups()):
+            return [{'level':'info',
+                     'type':'punctuation'}]
+        return []
+
+class TypoRule(QARule):
+    '''
+    Flags unknown words in the target, with suggestions from the model of the
+    QAChecker.
+    '''
+    name = 'typo'
+
+    def check(self, segment, qa_checker):
+        if not all((qa_checker.letters, qa_checker.word_counter)):
+            return []
+        return [{'level':'info',
+                 'type':'typo',
+                 'word':correction['word'],
+                 'suggestions':correction['suggestions']}
+                for correction in qa_checker.corrections_for_sentence(segment['target'])]
+
+class TagRule(QARule):
+    '''
+    Flags inline tags missing from, added to or reordered in the target.
+    Tags are only known for segments checked through
+    QAChecker.check_bilingualfile.
+    '''
+    name = 'tags'
+
+    def check(self, segment, qa_checker):
+        source_tags = segment.get('source_tags')
+        target_tags = segment.get('target_tags')
+        if source_tags is None or target_tags is None or source_tags == target_tags:
+            return []
+
+        source_tag_counter = Counter(source_tags)
+        target_tag_counter = Counter(target_tags)
+        if source_tag_counter == target_tag_counter:
+            return [{'level':'info',
+                     'type':'tag_order'}]
+        return [{'level':'info',
+                 'type':'tags',
+                 'missing':list((source_tag_counter - target_tag_counter).elements()),
+                 'extra':list((target_tag_counter - source_tag_counter).elements())}]
+
+class NumberRule(QARule):
+    '''
+    Flags numbers missing from, or added to, the target. Digit group and
+    decimal separators are ignored, so that 1,000.5 matches 1.000,5.
+    '''
+    name = 'numbers'
+
+    def check(self, segment, qa_checker):
+        source_numbers = Counter(_number_separator_regex.sub('', number) for number in _number_regex.findall(segment['source']))
+        target_numbers = Counter(_number_separator_regex.sub('', number) for number in _number_regex.findall(segment['target']))
+        if source_numbers != target_numbers:
+            return [{'level':'info',
+                     'type':'numbers',
+                     'missing':list((source_numbers - target_numbers).elements()),
+                     'extra':list((target_numbers - source_numbers).elements())}]
+        return []
+
+class DoubleSpaceRule(QARule):
+    '''
+    Flags double spaces in the target that are not in the source.
+    '''
+    name = 'double_space'
+
+    def check(self, segment, qa_checker):
+        if (_double_space_regex.search(segment['target'])
+        and not _double_space_regex.search(segment['source'])):
+            return [{'level':'info',
+                     'type':'double_space'}]
+        return []
+
+class ForbiddenTermRule(QARule):
+    '''
+    Flags forbidden terms in the target. All terms are compiled into a single
+    pattern.
+
+    Args:
+        terms: List of forbidden terms.
+        casesensitive (optional): Whether terms are matched case-sensitively.
+    '''
+    name = 'forbidden_terms'
+
+    def __init__(self, terms=(), casesensitive=False):
+        self.term_regex = _compile_terms(terms, casesensitive)
+
+    def check(self, segment, qa_checker):
+        if self.term_regex is None:
+            return []
+        return [{'level':'info',
+                 'type':'forbidden_terms',
+                 'term':term}
+                for term in self.term_regex.findall(segment['target'])]
+
+class TermbaseRule(QARule):
+    '''
+    Flags source terms whose target terms are missing from the target. All
+    source terms are compiled into a single pattern.
+
+    Args:
+        terms: Iterable of (source term, target term) pairs, or a KDB instance
+               or path to a termbase.
+        casesensitive (optional): Whether terms are matched case-sensitively.
+    '''
+    name = 'termbase'
+
+    def __init__(self, terms=(), casesensitive=False):
+        if isinstance(terms, (str, Path)):
+            terms = kaplan.kdb.KDB(terms)
+        if isinstance(terms, kaplan.kdb.KDB):
+            terms = [(html.unescape(_tag_regex.sub('', source_term)), html.unescape(_tag_regex.sub('', target_term)))
+                     for source_term, target_term in terms.conn.execute('''SELECT source, target FROM main''')]
+
+        self.casesensitive = casesensitive
+        self.target_terms = {}
+        for source_term, target_term in terms:
+            if not casesensitive:
+                source_term = source_term.lower()
+            self.target_terms.setdefault(source_term, []).append(target_term)
+        self.term_regex = _compile_terms(self.target_terms, casesensitive)
+
+    def check(self, segment, qa_checker):
+        if self.term_regex is None:
+            return []
+
+        target = segment['target'] if self.casesensitive else segment['target'].lower()
+
+        results = []
+        for source_term in self.term_regex.findall(segment['source']):
+            if not self.casesensitive:
+                source_term = source_term.lower()
+            if not any((target_term if self.casesensitive else target_term.lower()) in target
+                       for target_term in self.target_terms[source_term]):
+                results.append({'level':'info',
+                                'type':'termbase',
+                                'term':source_term,
+                                'suggestions':self.target_terms[source_term]})
+        return results
+
+# Rules by name, for QAChecker(rules=[...]). Custom rules can be added here.
+qa_rules = {rule.name: rule for rule in (CapitalizationRule,
+                                         PunctuationRule,
+                                         TypoRule,
+                                         TagRule,
+                                         NumberRule,
+                                         DoubleSpaceRule,
+                                         ForbiddenTermRule,
+                                         TermbaseRule)}
+
+default_qa_rules = ('capitalization', 'punctuation', 'typo', 'tags')
+
+def _compile_terms(terms, casesensitive=False):
+    '''
+    Compiles a list of terms into a single pattern that matches whole words.
+    '''
+    terms = [term for term in terms if term]
+    if not terms:
+        return None
+    return regex.compile(r'(?<!\w)\L<terms>(?!\w)',
+                         terms=terms,
+                         flags=0 if casesensitive else regex.IGNORECASE)
+
+_model_members = ('words.bin', 'word_offsets.bin', 'counts.bin', 'deletes.bin',
+                  'delete_offsets.bin', 'posting_offsets.bin', 'postings.bin')
+
+class _SortedStrings:
+    '''
+    Read-only sequence of sorted strings stored as a UTF-8 blob and an array
+    of offsets into it.
+    '''
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return str(self.blob[self.offsets[i]:self.offsets[i+1]], 'UTF-8')
+
+    def find(self, text):
+        '''
+        Returns the index of a string, or -1 if it is not in the sequence.
+        '''
+        encoded_text = text.encode('UTF-8')
+        blob, offsets = self.blob, self.offsets
+        low, high = 0, len(offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if bytes(blob[offsets[middle]:offsets[middle+1]]) < encoded_text:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(offsets) - 1 and bytes(blob[offsets[low]:offsets[low+1]]) == encoded_text:
+            return low
+        return -1
+
+class _MappedWordCounter(Mapping):
+    '''
+    Read-only word counts of a .kqac model.
+    '''
+    def __init__(self, words, counts):
+        self.words = words
+        self.counts = counts
+
+    def __contains__(self, word):
+        return self.words.find(word) != -1
+
+    def __getitem__(self, word):
+        i = self.words.find(word)
+        if i == -1:
+            raise KeyError(word)
+        return self.counts[i]
+
+    def __iter__(self):
+        for i in range(len(self.words)):
+            yield self.words[i]
+
+    def __len__(self):
+        return len(self.words)
+
+class _MappedDeletes(Mapping):
+    '''
+    Read-only delete index of a .kqac model.
+    '''
+    def __init__(self, deletes, posting_offsets, postings, words):
+        self.deletes = deletes
+        self.posting_offsets = posting_offsets
+        self.postings = postings
+        self.words = words
+
+    def __getitem__(self, delete):
+        i = self.deletes.find(delete)
+        if i == -1:
+            raise KeyError(delete)
+        return [self.words[j] for j in self.postings[self.posting_offsets[i]:self.posting_offsets[i+1]]]
+
+    def __iter__(self):
+        for i in range(len(self.deletes)):
+            yield self.deletes[i]
+
+    def __len__(self):
+        return len(self.deletes)
+
+def _get_uint32_array(buffer, byteswap=False):
+    '''
+    Returns a buffer of unsigned 32-bit integers as a sequence.
+    '''
+    if byteswap:
+        uint32_array = array('I', bytes(buffer))
+        uint32_array.byteswap()
+        return uint32_array
+    return buffer.cast('B').cast('I')
+
+def _join_strings(strings):
+    '''
+    Returns strings as a UTF-8 blob and an array of offsets into it.
+    '''
+    blob = bytearray()
+    offsets = array('I', [0])
+    for text in strings:
+        blob += text.encode('UTF-8')
+        offsets.append(len(blob))
+
+    return bytes(blob), offsets
+
+def _read_member(zf, name, buffer=None):
+    '''
+    Returns a member of a zip file as a memoryview. Members that are not
+    compressed are sliced out of buffer, a memory map of the zip file, when it
+    is given.
+    '''
+    zip_info = zf.getinfo(name)
+    if buffer is None or zip_info.compress_type != zipfile.ZIP_STORED:
+        return memoryview(zf.read(name))
+
+    len_filename, len_extra = struct.unpack('<HH', buffer[zip_info.header_offset+26:zip_info.header_offset+30])
+    data_offset = zip_info.header_offset + 30 + len_filename + len_extra
+    return buffer[data_offset:data_offset+zip_info.file_size]
+
+_qa_checker = None
+
+def _set_up_qa_worker(qa_checker):
+    '''
+    Initializer for the worker processes of QAChecker.check_files.
+    '''
+    global _qa_checker
+    _qa_checker = qa_checker
+
+def _check_file(path):
+    '''
+    Worker for QAChecker.check_files.
+    '''
+    start = time.perf_counter()
+    results = {}
+    _qa_checker.rule_timings.clear()
+    try:
+        results = _qa_checker.check_bilingualfile(path)
+    except Exception as e:
+        return {'file': str(path),
+                'status': 'failed',
+                'error': '{0}: {1}'.format(type(e).__name__, e),
+                'segments': 0,
+                'time': time.perf_counter() - start,
+                'results': results,
+                'rule_timings': dict(_qa_checker.rule_timings)}
+
+    return {'file': str(path),
+            'status': 'ok',
+            'error': None,
+            'segments': len(results),
+            'time': time.perf_counter() - start,
+            'results': results,
+            'rule_timings': dict(_qa_checker.rule_timings)}
+
+def _get_segment(segment):
+    '''
+    Returns a segment from gen_translation_units as a dict of the text and
+    tags of its source and target. Tags are normalised by
+    KDB.segment_to_entry, which pairs opening and closing tags.
+    '''
+    source_or_target = {}
+    for child in segment:
+        if isinstance(child.tag, str) and etree.QName(child).localname in ('source', 'target'):
+            source_or_target[etree.QName(child).localname] = child
+
+    qa_segment = {}
+    tags = {}
+    for key in ('source', 'target'):
+        if key not in source_or_target:
+            continue
+        qa_segment[key] = _get_text(source_or_target[key])
+        entry, tags = kaplan.kdb.KDB.segment_to_entry(source_or_target[key], tags)
+        qa_segment[key + '_tags'] = entry
+
+    reversed_tags = {tag_no: tag_id for tag_id, tag_no in tags.items()}
+    for key in ('source_tags', 'target_tags'):
+        if key in qa_segment:
+            qa_segment[key] = ['{0}-{1}'.format(tag, reversed_tags[tag_no].split('-', 1)[-1])
+                               for tag, tag_no in _entry_tag_regex.findall(qa_segment[key])]
+
+    return qa_segment
+
+def _get_text(source_or_target):
+    '''
+    Returns the text of a source or target element, inline tags left out.
+    '''
+    text = source_or_target.text or ''
+    for child in source_or_target:
+        text += child.tail or ''
+
+    return text
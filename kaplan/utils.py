@@ -1,7 +1,9 @@
+import functools
 import os
-import random
 import regex
 import string
+import sys
+import zipfile
 
 def remove_dir(path_to_dir):
     '''Removes a non-empty dir.'''
@@ -11,44 +13,267 @@ def remove_dir(path_to_dir):
             os.remove(os.path.join(root, target_file))
         os.rmdir(root)
 
-def split_into_sentences(text_unit: string):
-    _regex = (regex.compile(r'(\s+|^)'
-                            r'(\p{Lu}\p{L}{0,3})'
-                            r'(\.+)'
-                            r'(\s+|$)'),
-              regex.compile(r'(\s+|^)'
-                            r'([\p{Lu}\p{L}]+)'
-                            r'([\.\!\?\:]+)'
-                            r'(\s+|$)'))
-
-    placeholders = ['placeholder_to_keep_segment_going',
-                    'placeholder_to_end_segment']
-    while placeholders[0] in text_unit:
-        placeholders[0] += random.choice(string.ascii_letters)
-    while placeholders[1] in text_unit:
-        placeholders[1] += random.choice(string.ascii_letters)
-
-    for hit in regex.findall(_regex[0], text_unit):
-        if hit is not None:
-            text_unit = regex.sub(regex.escape(''.join(hit)),
-                                  ''.join((hit[0],
-                                           hit[1],
-                                           hit[2],
-                                           placeholders[0],
-                                           hit[3])),
-                                  text_unit,
-                                  1)
-
-    for hit in regex.findall(_regex[1], text_unit):
-        if hit is not None and hit[-1] != '':
-            text_unit = regex.sub(regex.escape(''.join(hit)),
-                                  ''.join((hit[0],
-                                           hit[1],
-                                           hit[2],
-                                           placeholders[1])),
-                                  text_unit,
-                                  1)
-
-    text_unit = regex.sub(placeholders[0], '', text_unit)
-
-    return text_unit.split(placeholders[1])
+# Segmentation rules per ISO 639-1 language code. Each rule set is a pair of
+# patterns with four groups each (leading space, word, punctuation, trailing
+# space): a match of the first pattern keeps the segment going, a match of the
+# second one ends it. Languages without their own rule set use 'default'.
+segmentation_rules = {
+    'default': (r'(\s+|^)'
+                r'(\p{Lu}\p{L}{0,3})'
+                r'(\.+)'
+                r'(\s+|$)',
+                r'(\s+|^)'
+                r'([\p{Lu}\p{L}]+)'
+                r'([\.\!\?\:]+)'
+                r'(\s+|$)')
+}
+
+class Segmenter:
+    '''
+    Splits text into sentences with a precompiled rule set.
+
+    Args:
+        rules: A (keep, end) pair of patterns. See segmentation_rules.
+    '''
+    def __init__(self, rules):
+        self.keep_regex = regex.compile(rules[0])
+        self.end_regex = regex.compile(rules[1])
+
+    def get_boundaries(self, text):
+        '''
+        Returns a list of (sentence_end, next_sentence_start) offsets.
+        '''
+        keep_offsets = set(hit.end(3) for hit in self.keep_regex.finditer(text))
+
+        boundaries = []
+        i = 0
+        while True:
+            hit = self.end_regex.search(text, i)
+            if hit is None:
+                break
+            if hit.end(3) in keep_offsets:
+                i = hit.start() + 1
+                continue
+            if hit.group(4) != '':
+                boundaries.append((hit.end(3), hit.end(4)))
+            i = hit.end()
+
+        return boundaries
+
+    def get_sentence_lengths(self, text):
+        '''
+        Returns the lengths of the non-empty sentences in text. Whitespace
+        between sentences is kept at the start of the next sentence.
+        '''
+        len_sentences = []
+        sentence_start = 0
+        for sentence_end, _ in self.get_boundaries(text):
+            if sentence_end > sentence_start:
+                len_sentences.append(sentence_end - sentence_start)
+            sentence_start = sentence_end
+        if len(text) > sentence_start:
+            len_sentences.append(len(text) - sentence_start)
+
+        return len_sentences
+
+    def split(self, text):
+        '''
+        Returns a list of sentences, whitespace between sentences excluded.
+        '''
+        sentences = []
+        sentence_start = 0
+        for sentence_end, next_sentence_start in self.get_boundaries(text):
+            sentences.append(text[sentence_start:sentence_end])
+            sentence_start = next_sentence_start
+        sentences.append(text[sentence_start:])
+
+        return sentences
+
+_srx_sentence_end = r'\p{L}[\.\!\?\:]+[\'"\)\]»«”“’]*'
+_srx_cjk_sentence_end = r'[。！？]+[」』）”’]*'
+
+# SRX-style rules per ISO 639-1 language code. Each rule is a (break,
+# beforebreak, afterbreak) tuple. At every position in the text, the first
+# rule whose beforebreak matches up to that position and whose afterbreak
+# matches from it decides whether the text is split there. Languages that are
+# not listed here use segmentation_rules instead.
+srx_rules = {
+    'de': [(False, r'(?:^|\s)\p{L}\.', r'\s'),
+           (False, r'(?:^|\s)(?:Abs|Anm|Bd|bspw|bzgl|bzw|ca|Dr|etc|evtl|ggf|Hr|Fr|inkl|Jh|Kap|Mio|Mrd|Nr|Prof|sog|Str|usw|vgl|zzgl)\.', r'\s'),
+           (True, _srx_sentence_end, r'\s')],
+    'ja': [(True, _srx_cjk_sentence_end, r'[^」』）”’]'),
+           (True, _srx_sentence_end, r'\s')],
+    'tr': [(False, r'(?:^|\s)\p{L}\.', r'\s'),
+           (False, r'(?:^|\s)(?:Alb|Av|bkz|Cad|Doç|Dr|Ltd|Mah|No|Org|örn|Prof|Sn|Sok|St|Şti|Tel|vb|vs|Yrd)\.', r'\s'),
+           (True, _srx_sentence_end, r'\s')],
+    'zh': [(True, _srx_cjk_sentence_end, r'[^」』）”’]'),
+           (True, _srx_sentence_end, r'\s')]
+}
+
+class SRXSegmenter(Segmenter):
+    '''
+    Splits text into sentences with SRX-style break and no-break rules.
+
+    All rules are compiled into a single pattern of zero-width alternatives in
+    rule order, so that one scan of the text finds every position where a rule
+    applies, and the first applicable rule wins.
+
+    Args:
+        rules: List of (break, beforebreak, afterbreak) tuples.
+    '''
+    def __init__(self, rules):
+        self.rules = rules
+
+        combined_rules = []
+        for rule_i, (is_break, beforebreak, afterbreak) in enumerate(rules):
+            combined_rules.append('(?<={0})(?={1})(?P<{2}{3}>)'.format(beforebreak or '',
+                                                                         afterbreak or '',
+                                                                         'b' if is_break else 'n',
+                                                                         rule_i))
+        self.rules_regex = regex.compile('|'.join('(?:{0})'.format(rule) for rule in combined_rules))
+        self.space_regex = regex.compile(r'\s*')
+
+    def get_boundaries(self, text):
+        '''
+        Returns a list of (sentence_end, next_sentence_start) offsets.
+        '''
+        boundaries = []
+        for hit in self.rules_regex.finditer(text):
+            sentence_end = hit.start()
+            if (hit.lastgroup[0] == 'b' and 0 < sentence_end < len(text)
+            and (len(boundaries) == 0 or boundaries[-1][1] < sentence_end)):
+                boundaries.append((sentence_end, self.space_regex.match(text, sentence_end).end()))
+
+        return boundaries
+
+class SRX:
+    '''
+    Segmentation Rules eXchange (SRX) rule sets.
+
+    Args:
+        language_rules: Dict of rule set names and lists of (break, beforebreak,
+                        afterbreak) tuples.
+        language_maps: List of (language pattern, rule set name) tuples.
+        cascade: Whether the rule sets of all matching language maps are used,
+                 rather than the first one only.
+    '''
+    def __init__(self, language_rules, language_maps, cascade=True):
+        self.language_rules = language_rules
+        self.language_maps = language_maps
+        self.cascade = cascade
+
+    def get_rules(self, language):
+        '''
+        Returns the list of rules that applies to a language.
+        '''
+        rules = []
+        for language_pattern, language_rule_name in self.language_maps:
+            if regex.fullmatch(language_pattern, language or '', flags=regex.IGNORECASE):
+                rules += self.language_rules.get(language_rule_name, [])
+                if not self.cascade:
+                    break
+
+        return rules
+
+    @classmethod
+    def open(cls, path):
+        '''
+        Opens an .srx file (SRX 1.0 or 2.0). SRX 1.0 has no cascading, so only
+        the first matching language map of a 1.0 file is used unless its
+        header says otherwise.
+        '''
+        from lxml import etree
+
+        language_rules = {}
+        language_maps = []
+
+        srx_root = etree.parse(str(path)).getroot()
+        default_cascade = 'no' if srx_root.attrib.get('version') == '1.0' else 'yes'
+        cascade = default_cascade == 'yes'
+        for element in srx_root.iter(etree.Element):
+            localname = etree.QName(element).localname
+            if localname == 'header':
+                cascade = element.attrib.get('cascade', default_cascade).lower() == 'yes'
+            elif localname == 'languagerule':
+                rules = language_rules.setdefault(element.attrib['languagerulename'], [])
+                for rule in element:
+                    if not isinstance(rule.tag, str) or etree.QName(rule).localname != 'rule':
+                        continue
+                    beforebreak, afterbreak = '', ''
+                    for rule_child in rule:
+                        if not isinstance(rule_child.tag, str):
+                            continue
+                        elif etree.QName(rule_child).localname == 'beforebreak':
+                            beforebreak = rule_child.text or ''
+                        elif etree.QName(rule_child).localname == 'afterbreak':
+                            afterbreak = rule_child.text or ''
+                    rules.append((rule.attrib.get('break', 'yes').lower() == 'yes', beforebreak, afterbreak))
+            elif localname == 'languagemap':
+                language_maps.append((element.attrib['languagepattern'], element.attrib['languagerulename']))
+
+        return cls(language_rules, language_maps, cascade)
+
+@functools.lru_cache(maxsize=None)
+def get_segmenter(language=None, srx=None):
+    '''
+    Returns the cached segmenter for a language.
+
+    Args:
+        language (optional): ISO 639-1 code or a language tag (ie. en-US).
+        srx (optional): Path to an .srx file, or an SRX instance, whose rules
+                        are used instead of the built-in ones.
+    '''
+    if srx is not None:
+        if not isinstance(srx, SRX):
+            srx = SRX.open(srx)
+        return SRXSegmenter(srx.get_rules(language))
+
+    if language is not None:
+        language = language.split('-')[0].split('_')[0].lower()
+
+    if language in srx_rules:
+        return SRXSegmenter(srx_rules[language])
+
+    return Segmenter(segmentation_rules.get(language, segmentation_rules['default']))
+
+def split_into_sentences(text_unit: string, language=None, srx=None):
+    return get_segmenter(language, srx).split(text_unit)
+
+def write_raw_zip_member(target_zip, zip_info, raw_file, chunk_size=1024*1024):
+    '''
+    Writes an archive member from data that is compressed already, without
+    compressing it again. Returns whether the member was written.
+
+    zipfile has no public API for this, so the member is written with the
+    internals of zipfile.ZipFile, which have stayed the same from CPython 3.8
+    to 3.13. On other versions, nothing is written and False is returned, and
+    the caller writes the member with ZipFile.open or ZipFile.write instead.
+
+    Args:
+        target_zip: zipfile.ZipFile open for writing.
+        zip_info: zipfile.ZipInfo of the member, with its compress_type, CRC,
+                  compress_size and file_size set.
+        raw_file: File object to read the compressed data from.
+    '''
+    if (not (3, 8) <= sys.version_info[:2] <= (3, 13)
+    or target_zip.mode == 'r' or getattr(target_zip, '_writing', True)):
+        return False
+
+    zip_info.flag_bits &= ~0x08 # Sizes are known, no data descriptor follows.
+    zip_info.header_offset = target_zip.fp.tell()
+    target_zip.fp.write(zip_info.FileHeader())
+
+    bytes_left = zip_info.compress_size
+    while bytes_left > 0:
+        chunk = raw_file.read(min(chunk_size, bytes_left))
+        if not chunk:
+            raise zipfile.BadZipFile('Truncated data for {0}.'.format(zip_info.filename))
+        target_zip.fp.write(chunk)
+        bytes_left -= len(chunk)
+
+    target_zip.filelist.append(zip_info)
+    target_zip.NameToInfo[zip_info.filename] = zip_info
+    target_zip.start_dir = target_zip.fp.tell()
+    target_zip._didModify = True
+
+    return True
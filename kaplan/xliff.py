@@ -6,8 +6,12 @@ import regex
 from copy import deepcopy
 from datetime import datetime
 import difflib
+import hashlib
 import html
+import json
+import os
 from pathlib import Path
+import warnings
 
 nsmap = {
     'xliff': 'urn:oasis:names:tc:xliff:document:2.1',
@@ -29,6 +33,9 @@ class XLIFF:
         self.xliff_version = float(self.xml_root.attrib['version'])
         self.nsmap = self.xml_root.nsmap
 
+        self._changed_units = []
+        self._journal_base = None
+
     def gen_translation_units(self, include_segments_wo_id=True):
         '''
         Returns a Python generator object containing translation units.
@@ -152,23 +159,121 @@ class XLIFF:
         raise TypeError('This function is available for the kxliff.KXLIFF class only.')
 
     @classmethod
-    def open_bilingualfile(cls, bilingualfile):
+    def open_bilingualfile(cls, bilingualfile, name=None):
         '''
         Opens an .xliff file.
+
+        Args:
+            bilingualfile: Path to a file, a bytes buffer, or an already-parsed
+                           lxml tree.
+            name (optional): Name of the file (Defaults to the name of the path).
+        '''
+        if isinstance(bilingualfile, etree._ElementTree):
+            xml_root = bilingualfile.getroot()
+        elif isinstance(bilingualfile, etree._Element):
+            xml_root = bilingualfile
+        elif isinstance(bilingualfile, bytes):
+            xml_root = etree.fromstring(bilingualfile)
+        else:
+            xml_root = etree.parse(bilingualfile).getroot()
+
+        if name is None:
+            if isinstance(bilingualfile, (bytes, etree._ElementTree, etree._Element)):
+                raise ValueError('A name is required for buffers and parsed trees.')
+            name = Path(bilingualfile).name
+
+        bilingualfile_instance = cls(name, xml_root)
+        if isinstance(bilingualfile, (str, Path)):
+            bilingualfile_instance._replay_journal(Path(bilingualfile))
+
+        return bilingualfile_instance
+
+    def close(self):
+        '''
+        Compacts the journal of the bilingual file, if it has one. See
+        XLIFF.save.
         '''
-        xml_root = etree.parse(bilingualfile).getroot()
+        if self._journal_base is not None and _get_journal_path(self._journal_base[0]).exists():
+            self.compact()
 
-        name = Path(bilingualfile).name
+    def compact(self, output_directory=None):
+        '''
+        Writes the whole bilingual file, replacing the previous file at once,
+        and removes its journal.
+
+        Args:
+            output_directory (optional): Path to the directory (Defaults to the
+                                         directory of the journal).
+        '''
+        if output_directory is None:
+            path = self._journal_base[0]
+        else:
+            path = Path(output_directory, self.name)
 
-        return cls(name, xml_root)
+        temporary_path = path.with_name(path.name + '.tmp')
+        with open(temporary_path, 'wb') as f:
+            self.xml_root.getroottree().write(f,
+                                              encoding='UTF-8',
+                                              xml_declaration=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, path)
 
-    def save(self, output_directory):
+        # The journal no longer matches the file, so it is not replayed even
+        # if removing it fails.
+        _get_journal_path(path).unlink(missing_ok=True)
+
+        self._changed_units = []
+        self._journal_base = (path, _get_file_signature(path), None)
+
+    def save(self, output_directory, journal=False):
         '''
         Saves the bilingual file in a given directory.
+
+        Args:
+            output_directory: Path to the directory.
+            journal (optional): Whether the translation units changed since the
+                                last save are appended to a journal next to the
+                                file (<name>.journal), rather than the whole file
+                                being rewritten. The journal is replayed when the
+                                file is opened, so no changes are lost if the
+                                process stops, and it is merged into the file by
+                                XLIFF.compact, XLIFF.close or the next save
+                                without journal. Files whose units have no ID
+                                are always saved whole.
         '''
-        self.xml_root.getroottree().write(str(Path(output_directory, self.name)),
-                                          encoding='UTF-8',
-                                          xml_declaration=True)
+        path = Path(output_directory, self.name)
+
+        if (not journal or self._journal_base is None
+        or self._journal_base[0].resolve() != path.resolve()
+        or not path.exists()
+        or self._journal_base[1] != _get_file_signature(path)):
+            self.compact(output_directory)
+            return
+
+        changed_units = {}
+        for unit in self._changed_units:
+            unit_key = self._get_unit_key(unit)
+            if unit_key is None:
+                self.compact(output_directory)
+                return
+            changed_units[unit_key] = unit
+
+        journal_path = _get_journal_path(path)
+        with open(journal_path, 'a', encoding='UTF-8') as journal_file:
+            if journal_file.tell() == 0:
+                if self._journal_base[2] is None:
+                    self._journal_base = self._journal_base[:2] + (_get_file_digest(path),)
+                journal_file.write(json.dumps({'name': self.name,
+                                               'sha256': self._journal_base[2]}) + '\n')
+            for (file_id, unit_id), unit in changed_units.items():
+                journal_file.write(json.dumps({'file': file_id,
+                                               'unit': unit_id,
+                                               'xml': etree.tostring(unit, encoding='unicode')}) + '\n')
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+        self._changed_units = []
 
     def set_segment_lock(self, segment_no, lock=True):
         '''
@@ -203,6 +308,8 @@ class XLIFF:
             elif not lock and is_locked:
                 segment.attrib['state'] = cur_state[9:]
 
+        self._mark_changed(segment)
+
     def update_segment(self, target_segment, tu_no, segment_no=None, segment_state=None, submitted_by=None):
         '''
         Updates a target segment.
@@ -395,3 +502,117 @@ class XLIFF:
                 _target_segment.tag = '{{{0}}}target'.format(self.nsmap[None])
 
             _segment.getparent().replace(_segment, _target_segment)
+
+        self._mark_changed(_translation_unit)
+
+    def _mark_changed(self, element):
+        '''
+        Marks the translation unit of an element as changed, so that it is
+        written to the journal by the next journaled save.
+        '''
+        unit = element.xpath('ancestor-or-self::*[local-name()="trans-unit" or local-name()="unit"][1]')
+        if unit != []:
+            self._changed_units.append(unit[0])
+
+    def _get_unit_key(self, unit):
+        '''
+        Returns the ID of the file and the ID of a translation unit, or None if
+        either has none.
+        '''
+        file = unit.xpath('ancestor::*[local-name()="file"][1]')
+        if file == []:
+            return None
+        file_id = file[0].attrib.get('id' if self.xliff_version >= 2.0 else 'original')
+        if file_id is None or 'id' not in unit.attrib:
+            return None
+
+        return file_id, unit.attrib['id']
+
+    def _replay_journal(self, path):
+        '''
+        Applies the journal of a bilingual file, if it has one. A journal
+        written for another version of the file, or with a record that cannot
+        be applied, is renamed aside (<name>.journal.<timestamp>) with a
+        warning, rather than being lost.
+        '''
+        journal_path = _get_journal_path(path)
+        signature = _get_file_signature(path)
+        self._journal_base = (path, signature, None)
+        if not journal_path.exists():
+            return
+
+        digest = _get_file_digest(path)
+        with open(journal_path, 'r+b') as journal_file:
+            header = journal_file.readline()
+            try:
+                is_valid = json.loads(header)['sha256'] == digest
+            except (KeyError, TypeError, ValueError):
+                is_valid = False
+            if not is_valid:
+                error = 'it was written for another version of {0}'.format(self.name)
+
+            if is_valid:
+                unit_tag = 'unit' if self.xliff_version >= 2.0 else 'trans-unit'
+                file_key = 'id' if self.xliff_version >= 2.0 else 'original'
+                replayed_units = []
+                journal_end = journal_file.tell()
+                for line in iter(journal_file.readline, b''):
+                    try:
+                        record = json.loads(line)
+                        file_id, unit_id = str(record['file']), str(record['unit'])
+                        replayed_unit = etree.fromstring(record['xml'])
+                    except (KeyError, TypeError, ValueError, etree.XMLSyntaxError):
+                        if line.endswith(b'\n'):
+                            is_valid = False
+                            error = 'a record is corrupt'
+                        break
+                    unit = self.xml_root.xpath('*[local-name()="file"][@{0}=$file]//*[local-name()=$tag][@id=$unit]'.format(file_key),
+                                               file=file_id,
+                                               tag=unit_tag,
+                                               unit=unit_id)
+                    if len(unit) != 1:
+                        is_valid = False
+                        error = 'unit {0} of file {1} was not found'.format(unit_id, file_id)
+                        break
+                    unit[0].getparent().replace(unit[0], replayed_unit)
+                    replayed_units.append(replayed_unit)
+                    journal_end = journal_file.tell()
+
+                if is_valid:
+                    # Drop a record cut short by a crash, so that new records
+                    # start on a line of their own.
+                    journal_file.truncate(journal_end)
+                    self._journal_base = (path, signature, digest)
+                else:
+                    # The records applied are saved with the next changes.
+                    self._changed_units = replayed_units
+
+        if not is_valid:
+            aside_path = journal_path.with_name('{0}.{1}'.format(journal_path.name,
+                                                                 datetime.utcnow().strftime('%Y%m%d%H%M%S%f')))
+            journal_path.rename(aside_path)
+            warnings.warn('The journal of {0} was not applied in full, as {1}. It was moved to {2}.'.format(self.name,
+                                                                                                             error,
+                                                                                                             aside_path))
+
+def _get_file_digest(path, chunk_size=1024*1024):
+    '''
+    Returns the SHA-256 digest of a file.
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def _get_file_signature(path):
+    '''
+    Returns the inode, size and modification time of a file, which tell
+    whether it has changed since it was last read or written.
+    '''
+    stat = os.stat(path)
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+def _get_journal_path(path):
+    return path.with_name(path.name + '.journal')
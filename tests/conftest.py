@@ -0,0 +1,86 @@
+import shutil
+import zipfile
+from copy import deepcopy
+from pathlib import Path
+
+import pytest
+
+DATA_DIR = Path(__file__).parent / 'data'
+SAMPLE_FILES = ('sample.docx', 'sample.odt', 'sample.po', 'sample.txt', 'sample.json')
+
+
+@pytest.fixture
+def sources(tmp_path):
+    '''
+    Copies the sample source files to a temporary directory and returns it.
+    '''
+    source_directory = tmp_path / 'source'
+    source_directory.mkdir()
+    for sample_file in SAMPLE_FILES:
+        shutil.copy(DATA_DIR / sample_file, source_directory)
+
+    return source_directory
+
+
+@pytest.fixture
+def fill_targets():
+    '''
+    Returns a function that fills every segment of a bilingual file with its
+    source in upper case, the same way the expected outputs in
+    tests/data/expected were produced.
+    '''
+    def fill(bilingualfile):
+        nsmap = {'x': bilingualfile.nsmap[None]}
+        for segment in bilingualfile.xml_root.xpath('//x:segment', namespaces=nsmap):
+            source = segment.find('x:source', nsmap)
+            target = segment.find('x:target', nsmap)
+            new_target = deepcopy(source)
+            new_target.tag = '{{{0}}}target'.format(nsmap['x'])
+            if new_target.text:
+                new_target.text = new_target.text.upper()
+            for child in new_target:
+                if child.tail:
+                    child.tail = child.tail.upper()
+            if target is None:
+                segment.append(new_target)
+            else:
+                segment.replace(target, new_target)
+            bilingualfile._mark_changed(segment)
+
+        return bilingualfile
+
+    return fill
+
+
+def read_output(path):
+    '''
+    Reads a target file, returning {member: bytes} for zip archives.
+    '''
+    path = Path(path)
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            return {zip_info.filename: zf.read(zip_info) for zip_info in zf.infolist() if not zip_info.is_dir()}
+    return path.read_bytes()
+
+
+def read_expected(name):
+    '''
+    Reads an expected output from tests/data/expected in the shape of
+    read_output.
+    '''
+    path = DATA_DIR / 'expected' / name
+    if path.is_dir():
+        return {member.relative_to(path).as_posix(): member.read_bytes()
+                for member in path.rglob('*') if member.is_file()}
+    return path.read_bytes()
+
+
+def canonicalize(path):
+    '''
+    Returns the canonical XML (C14N) of a file, so that files that differ only
+    in serialisation details (e.g. redundant namespace declarations) compare
+    equal.
+    '''
+    from lxml import etree
+
+    return etree.tostring(etree.parse(str(path)), method='c14n')
@@ -0,0 +1,104 @@
+import io
+import json
+
+import pytest
+
+from conftest import DATA_DIR, canonicalize, read_expected, read_output
+from kaplan import kxliff as kxliff_module
+from kaplan.kxliff import KXLIFF
+
+
+def _expected_kxliff(sample_file):
+    return canonicalize(DATA_DIR / 'expected' / (sample_file + '.kxliff'))
+
+
+@pytest.mark.parametrize('segmentation', ['default', True])
+def test_po_new_and_new_to_file_agree(sources, tmp_path, monkeypatch, segmentation):
+    monkeypatch.chdir(sources)
+    KXLIFF.new('sample.po', 'en', 'de', segmentation).save(tmp_path)
+    (tmp_path / 'streamed').mkdir()
+
+    path_to_kxliff = KXLIFF.new_to_file('sample.po', 'en', 'de', tmp_path / 'streamed', segmentation)
+
+    assert canonicalize(path_to_kxliff) == canonicalize(tmp_path / 'sample.po.kxliff')
+    if segmentation == 'default':
+        assert canonicalize(path_to_kxliff) == _expected_kxliff('sample.po')
+    else:
+        assert len(KXLIFF.open_bilingualfile(str(path_to_kxliff)).get_translation_units()[0].findall('{*}segment')) == 2
+
+
+def test_new_to_file_declares_namespaces_once(sources, tmp_path):
+    kxliff_bytes = KXLIFF.new_to_file(sources / 'sample.po', 'en', 'de', tmp_path).read_bytes()
+
+    assert kxliff_bytes.count(b'xmlns=') == 1
+    assert kxliff_bytes.count(b'xmlns:kaplan=') == 1
+
+
+def test_interrupted_new_to_file_leaves_no_file(sources, tmp_path, monkeypatch):
+    gen_po_elements = kxliff_module._gen_po_elements
+
+    def gen_failing_po_elements(*args, **kwargs):
+        for i, element in enumerate(gen_po_elements(*args, **kwargs)):
+            if i == 2:
+                raise OSError('Disk full.')
+            yield element
+
+    monkeypatch.setattr(kxliff_module, '_gen_po_elements', gen_failing_po_elements)
+
+    with pytest.raises(OSError):
+        KXLIFF.new_to_file(sources / 'sample.po', 'en', 'de', tmp_path)
+
+    assert list(tmp_path.iterdir()) == [sources]
+
+
+JSON_TEXT = ('{"title": "Caf\\u00e9 \\"quoted\\" text", "nested": {"deep": {"a": "A.", "b": "\\ud83d\\ude00 emoji"}},'
+             ' "list": ["One.", "Two.", 3, 4.5, -1e3, true, false, null], "empty": {}, "last": "Ends here."}')
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 1024*1024])
+def test_json_events_do_not_depend_on_chunks(chunk_size):
+    assert (list(kxliff_module._gen_json_events(io.StringIO(JSON_TEXT), chunk_size))
+            == list(kxliff_module._gen_json_events(io.StringIO(JSON_TEXT))))
+
+
+def test_json_stream_items_match_json_load():
+    assert (list(kxliff_module._gen_json_stream_items(io.StringIO(JSON_TEXT)))
+            == list(kxliff_module._gen_json_items(json.loads(JSON_TEXT))))
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_json_round_trip(sources, tmp_path, monkeypatch, fill_targets, stream):
+    monkeypatch.chdir(sources)
+    KXLIFF.new('sample.json', 'en', 'de', stream=stream).save(tmp_path)
+
+    assert canonicalize(tmp_path / 'sample.json.kxliff') == _expected_kxliff('sample.json')
+
+    fill_targets(KXLIFF.open_bilingualfile(str(tmp_path / 'sample.json.kxliff'))).generate_target_translation(tmp_path)
+
+    assert read_output(tmp_path / 'sample.json') == read_expected('sample.json')
+
+
+def test_txt_new_and_new_to_file_agree(sources, tmp_path, monkeypatch):
+    monkeypatch.chdir(sources)
+    KXLIFF.new('sample.txt', 'en', 'de').save(tmp_path)
+    (tmp_path / 'streamed').mkdir()
+
+    path_to_kxliff = KXLIFF.new_to_file('sample.txt', 'en', 'de', tmp_path / 'streamed')
+
+    assert canonicalize(path_to_kxliff) == canonicalize(tmp_path / 'sample.txt.kxliff') == _expected_kxliff('sample.txt')
+
+
+@pytest.mark.parametrize('segmentation', [False, 'default'])
+def test_txt_lines_without_final_newline(tmp_path, fill_targets, segmentation):
+    (tmp_path / 'lines.txt').write_text('First line. Two sentences.\n\nÜnïcödé line\nLast line, no newline', encoding='UTF-8')
+    (tmp_path / 'target').mkdir()
+
+    kxliff = KXLIFF.open_bilingualfile(str(KXLIFF.new_to_file(tmp_path / 'lines.txt', 'en', 'de', tmp_path, segmentation)))
+
+    assert len(kxliff.get_translation_units()) == 4
+    assert len(kxliff.xml_root.findall('.//{*}segment')) == (4 if segmentation == 'default' else 3)
+
+    fill_targets(kxliff).save(tmp_path)
+    KXLIFF.generate_target_from_file(tmp_path / 'lines.txt.kxliff', tmp_path / 'target')
+
+    assert (tmp_path / 'target' / 'lines.txt').read_text(encoding='UTF-8') == 'FIRST LINE. TWO SENTENCES.\n\nÜNÏCÖDÉ LINE\nLAST LINE, NO NEWLINE'
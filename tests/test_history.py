@@ -0,0 +1,96 @@
+import random
+
+import pytest
+from lxml import etree
+
+from kaplan.kxliff import KXLIFF, SegmentHistory, _apply_delta, _get_delta
+
+XLIFF_NAMESPACE = 'urn:oasis:names:tc:xliff:document:2.1'
+
+
+def _target(text):
+    target = etree.Element('{{{0}}}target'.format(XLIFF_NAMESPACE), nsmap={None: XLIFF_NAMESPACE})
+    target.text = text
+
+    return target
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_delta_round_trip(seed):
+    random_generator = random.Random(seed)
+    text = ''.join(random_generator.choice('ab cd\n') for _ in range(200))
+    for _ in range(20):
+        new_text = list(text)
+        for _ in range(random_generator.randrange(5)):
+            i = random_generator.randrange(len(new_text) + 1)
+            new_text[i:i+random_generator.randrange(3)] = random_generator.choice(['', 'x', 'yz '])
+        new_text = ''.join(new_text)
+
+        assert _apply_delta(text, _get_delta(text, new_text)) == new_text
+        text = new_text
+
+
+def test_segment_history(tmp_path):
+    history_store = SegmentHistory(tmp_path / 'history.khist')
+    texts = ['Version {0} of a rather long segment.'.format(i) for i in range(40)]
+
+    for i, text in enumerate(texts):
+        assert history_store.add_version(1, _target(text), 'translated', str(i), 'author')
+        assert not history_store.add_version(1, _target(text), 'translated', str(i), 'author')
+    history_store.add_version(2, _target('Another segment.'))
+    history_store.close()
+
+    history_store = SegmentHistory(tmp_path / 'history.khist')
+    versions = list(history_store.gen_versions(1))
+
+    assert [version.text for version in versions] == texts
+    assert [version.attrib['modified_on'] for version in versions] == [str(i) for i in range(40)]
+    assert all(version.attrib['state'] == 'translated' and version.attrib['modified_by'] == 'author' for version in versions)
+    assert [row[0] for row in history_store.conn.execute('''SELECT keyframe FROM history WHERE segment='1' ORDER BY id''')] == [1 if i % SegmentHistory.keyframe_interval == 0 else 0 for i in range(40)]
+    # The last version is looked up in the file after it is reopened.
+    assert not history_store.add_version(1, _target(texts[-1]), 'translated', '39', 'author')
+    assert history_store.get_segment_history(2)[0].text == 'Another segment.'
+    assert history_store.get_segment_history(3) is None
+
+
+def _update(kxliff, text):
+    kxliff.update_segment('<target xmlns="{0}">{1}</target>'.format(XLIFF_NAMESPACE, text), 1, 1, 'translated', 'author')
+
+
+def test_history_store_matches_inline_history(sources, tmp_path):
+    inline_kxliff = KXLIFF.new(str(sources / 'sample.txt'), 'en', 'de')
+    stored_kxliff = KXLIFF.new(str(sources / 'sample.txt'), 'en', 'de')
+    stored_kxliff.set_history_store(tmp_path / 'sample.khist')
+    for i in range(5):
+        _update(inline_kxliff, 'Version {0}'.format(i))
+        _update(stored_kxliff, 'Version {0}'.format(i))
+
+    def strip_dates(segment_history):
+        for version in segment_history:
+            del version.attrib['modified_on']
+        return etree.tostring(segment_history)
+
+    assert len(inline_kxliff.get_segment_history(1)) == 4
+    assert strip_dates(stored_kxliff.get_segment_history(1)) == strip_dates(inline_kxliff.get_segment_history(1))
+    assert stored_kxliff.xml_root.find('.//{https://kaplan.pro}history') is None
+
+
+def test_move_history_to_store(sources, tmp_path):
+    kxliff = KXLIFF.new(str(sources / 'sample.txt'), 'en', 'de')
+    for i in range(3):
+        _update(kxliff, 'Version {0}'.format(i))
+    kxliff.save(tmp_path)
+    inline_history = etree.tostring(kxliff.get_segment_history(1))
+
+    kxliff = KXLIFF.open_bilingualfile(str(tmp_path / 'sample.txt.kxliff'))
+    kxliff.set_history_store(tmp_path / 'sample.khist')
+
+    assert kxliff.xml_root.find('.//{https://kaplan.pro}history') is None
+    assert etree.tostring(kxliff.get_segment_history(1)) == inline_history
+
+    # Moving the same history again, e.g. from a copy saved before, adds nothing.
+    kxliff.close()
+    kxliff = KXLIFF.open_bilingualfile(str(tmp_path / 'sample.txt.kxliff'))
+    kxliff.set_history_store(tmp_path / 'sample.khist')
+
+    assert etree.tostring(kxliff.get_segment_history(1)) == inline_history
@@ -0,0 +1,34 @@
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).parent.parent
+
+# `import kaplan` must stay cheap (measured at ~2.5 ms); heavy dependencies
+# are only imported with the submodules that need them.
+IMPORT_TIME_LIMIT = 50000 # in microseconds
+HEAVY_MODULES = ('lxml', 'regex', 'sqlite3')
+
+
+def _import_kaplan():
+    completed_process = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                                        'import kaplan, sys; print(" ".join(sorted(sys.modules)))'],
+                                       cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+
+    return completed_process.stdout.split(), completed_process.stderr.splitlines()
+
+
+def test_import_does_not_load_heavy_modules():
+    modules, _ = _import_kaplan()
+
+    assert not [module for module in modules if module.split('.')[0] in HEAVY_MODULES]
+
+
+def test_import_time():
+    _, import_time_log = _import_kaplan()
+
+    # The last line is the top-level `import kaplan` with its cumulative time.
+    self_time, cumulative_time, module = import_time_log[-1].split('|')
+
+    assert module.strip() == 'kaplan'
+    assert int(cumulative_time) <= IMPORT_TIME_LIMIT
@@ -0,0 +1,104 @@
+import pytest
+from lxml import etree
+
+import kaplan
+from conftest import read_output
+from kaplan.kxliff import KXLIFF
+
+XLIFF_NAMESPACE = 'urn:oasis:names:tc:xliff:document:2.1'
+
+
+@pytest.fixture
+def path_to_kxliff(sources, tmp_path):
+    KXLIFF.new(str(sources / 'sample.txt'), 'en', 'de').save(tmp_path)
+
+    return tmp_path / 'sample.txt.kxliff'
+
+
+def _update(bilingualfile, tu_i, segment_i, text):
+    bilingualfile.update_segment('<target xmlns="{0}">{1}</target>'.format(XLIFF_NAMESPACE, text), tu_i, segment_i, 'translated', 'author')
+
+
+def _journal_path(path_to_kxliff):
+    return path_to_kxliff.with_name(path_to_kxliff.name + '.journal')
+
+
+def test_journal_save_reopen_and_compact(path_to_kxliff, tmp_path):
+    kxliff_bytes = path_to_kxliff.read_bytes()
+    kxliff = kaplan.open_bilingualfile(str(path_to_kxliff))
+    _update(kxliff, 1, 1, 'Erste Zeile')
+    kxliff.save(tmp_path, journal=True)
+    _update(kxliff, 2, 3, 'Es endet hier!')
+    _update(kxliff, 1, 1, 'Erste Zeile, noch einmal')
+    kxliff.save(tmp_path, journal=True)
+
+    assert path_to_kxliff.read_bytes() == kxliff_bytes
+    assert len(_journal_path(path_to_kxliff).read_text().splitlines()) == 4
+
+    reopened_kxliff = kaplan.open_bilingualfile(str(path_to_kxliff))
+
+    assert etree.tostring(reopened_kxliff.xml_root) == etree.tostring(kxliff.xml_root)
+
+    reopened_kxliff.compact()
+    (tmp_path / 'full').mkdir()
+    kxliff.save(tmp_path / 'full')
+
+    assert not _journal_path(path_to_kxliff).exists()
+    assert path_to_kxliff.read_bytes() == (tmp_path / 'full' / 'sample.txt.kxliff').read_bytes()
+
+
+def test_close_compacts_journal(path_to_kxliff, tmp_path):
+    kxliff = kaplan.open_bilingualfile(str(path_to_kxliff))
+    _update(kxliff, 1, 1, 'Erste Zeile')
+    kxliff.save(tmp_path, journal=True)
+
+    kxliff.close()
+
+    assert not _journal_path(path_to_kxliff).exists()
+    assert kaplan.open_bilingualfile(str(path_to_kxliff)).xml_root.find('.//{*}target').text == 'Erste Zeile'
+
+
+def test_journal_of_another_version_is_set_aside(path_to_kxliff, tmp_path):
+    kxliff = kaplan.open_bilingualfile(str(path_to_kxliff))
+    _update(kxliff, 1, 1, 'Erste Zeile')
+    kxliff.save(tmp_path, journal=True)
+    other_kxliff = KXLIFF.open_bilingualfile(str(path_to_kxliff))
+    journal = _journal_path(path_to_kxliff).read_bytes()
+    _update(other_kxliff, 1, 1, 'Andere Zeile')
+    other_kxliff.save(tmp_path)
+    _journal_path(path_to_kxliff).write_bytes(journal)
+
+    with pytest.warns(UserWarning, match='another version'):
+        kxliff = kaplan.open_bilingualfile(str(path_to_kxliff))
+
+    assert kxliff.xml_root.find('.//{*}target').text == 'Andere Zeile'
+    assert not _journal_path(path_to_kxliff).exists()
+    assert [path.read_bytes() for path in tmp_path.glob('sample.txt.kxliff.journal.*')] == [journal]
+
+
+def test_record_cut_short_is_dropped(path_to_kxliff, tmp_path):
+    kxliff = kaplan.open_bilingualfile(str(path_to_kxliff))
+    _update(kxliff, 1, 1, 'Erste Zeile')
+    kxliff.save(tmp_path, journal=True)
+    with open(_journal_path(path_to_kxliff), 'a') as journal_file:
+        journal_file.write('{"file": "1", "unit": "2", "xml": "<unit')
+
+    kxliff = kaplan.open_bilingualfile(str(path_to_kxliff))
+    _update(kxliff, 2, 3, 'Es endet hier!')
+    kxliff.save(tmp_path, journal=True)
+    kxliff = kaplan.open_bilingualfile(str(path_to_kxliff))
+
+    assert [target.text for target in kxliff.xml_root.findall('.//{*}target')[:3]] == ['Erste Zeile', None, 'Es endet hier!']
+    assert len(_journal_path(path_to_kxliff).read_text().splitlines()) == 3
+
+
+def test_generate_target_from_file_with_journal(path_to_kxliff, tmp_path):
+    kxliff = kaplan.open_bilingualfile(str(path_to_kxliff))
+    _update(kxliff, 1, 1, 'Erste Zeile')
+    kxliff.save(tmp_path, journal=True)
+    (tmp_path / 'target').mkdir()
+
+    KXLIFF.generate_target_from_file(path_to_kxliff, tmp_path / 'target')
+
+    assert not _journal_path(path_to_kxliff).exists()
+    assert read_output(tmp_path / 'target' / 'sample.txt').splitlines()[0] == b'Erste Zeile'
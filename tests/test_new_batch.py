@@ -0,0 +1,42 @@
+from pathlib import Path
+
+from conftest import DATA_DIR, SAMPLE_FILES, canonicalize
+from kaplan.kxliff import KXLIFF
+
+
+def test_batch_matches_single_conversions(sources, tmp_path, monkeypatch):
+    monkeypatch.chdir(sources)
+
+    results = KXLIFF.new_batch(SAMPLE_FILES, 'en', 'de', tmp_path / 'batch', workers=2)
+
+    assert [result['source'] for result in results] == list(SAMPLE_FILES)
+    for sample_file, result in zip(SAMPLE_FILES, results):
+        assert result['status'] == 'ok', result['error']
+        assert result['error'] is None
+        assert Path(result['kxliff']) == tmp_path / 'batch' / (sample_file + '.kxliff')
+        assert canonicalize(result['kxliff']) == canonicalize(DATA_DIR / 'expected' / (sample_file + '.kxliff'))
+
+
+def test_failed_file_does_not_stop_batch(sources, tmp_path):
+    (sources / 'broken.docx').write_bytes(b'not a zip file')
+
+    results = KXLIFF.new_batch([sources / 'broken.docx', sources / 'sample.txt'], 'en', 'de', tmp_path / 'batch', workers=2)
+
+    assert results[0]['status'] == 'failed'
+    assert results[0]['kxliff'] is None
+    assert results[0]['error'].startswith('BadZipFile: ')
+    assert results[1]['status'] == 'ok'
+    assert not (tmp_path / 'batch' / 'broken.docx.kxliff').exists()
+
+
+def test_name_collision_fails_later_entry(sources, tmp_path):
+    other_directory = tmp_path / 'other'
+    other_directory.mkdir()
+    (other_directory / 'sample.txt').write_text('Another file.\n')
+
+    results = KXLIFF.new_batch([sources / 'sample.txt', other_directory / 'sample.txt'], 'en', 'de', tmp_path / 'batch', workers=2)
+
+    assert results[0]['status'] == 'ok'
+    assert results[1]['status'] == 'failed'
+    assert results[1]['error'] == 'ValueError: The .kxliff file sample.txt.kxliff is created for {0} already.'.format(sources / 'sample.txt')
+    assert len(KXLIFF.open_bilingualfile(results[0]['kxliff']).get_translation_units()) == 10
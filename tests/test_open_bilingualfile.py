@@ -0,0 +1,68 @@
+import pytest
+from lxml import etree
+
+import kaplan
+from kaplan.kxliff import KXLIFF
+from kaplan.xliff import XLIFF
+
+
+@pytest.fixture
+def kxliff_path(sources, tmp_path):
+    output_directory = tmp_path / 'kxliff'
+    output_directory.mkdir()
+    KXLIFF.new(str(sources / 'sample.txt'), 'en', 'de').save(output_directory)
+
+    return output_directory / 'sample.txt.kxliff'
+
+
+def test_opens_kxliff_from_path(kxliff_path):
+    bilingualfile = kaplan.open_bilingualfile(str(kxliff_path))
+
+    assert type(bilingualfile) is KXLIFF
+    assert bilingualfile.name == 'sample.txt.kxliff'
+    assert len(bilingualfile.get_translation_units()) == 10
+
+
+def test_opens_buffers_and_trees(kxliff_path):
+    buffer = kxliff_path.read_bytes()
+
+    assert type(kaplan.open_bilingualfile(buffer, 'sample.txt.kxliff')) is KXLIFF
+    assert kaplan.open_bilingualfile(buffer).name == 'untitled.kxliff'
+    assert type(kaplan.open_bilingualfile(etree.parse(str(kxliff_path)), 'sample.txt.kxliff')) is KXLIFF
+
+
+def test_renamed_kxliff_falls_back_to_xliff(kxliff_path, tmp_path):
+    renamed_path = tmp_path / 'renamed.xliff'
+    renamed_path.write_bytes(kxliff_path.read_bytes())
+
+    bilingualfile = kaplan.open_bilingualfile(str(renamed_path))
+
+    assert type(bilingualfile) is XLIFF
+    assert len(bilingualfile.get_translation_units()) == 10
+
+
+def test_opens_xliff_1_2(tmp_path):
+    xliff_path = tmp_path / 'sample.xliff'
+    xliff_path.write_text('<xliff xmlns="urn:oasis:names:tc:xliff:document:1.2" version="1.2">'
+                          '<file original="a.txt" source-language="en" target-language="de" datatype="plaintext">'
+                          '<body><trans-unit id="1"><source>Hello.</source><target>Hallo.</target></trans-unit></body>'
+                          '</file></xliff>')
+
+    bilingualfile = kaplan.open_bilingualfile(str(xliff_path))
+
+    assert type(bilingualfile) is XLIFF
+    assert bilingualfile.xliff_version == 1.2
+
+
+@pytest.mark.parametrize('content', [b'not xml at all', b'<html><body/></html>', b'<xliff/>', b''])
+def test_rejects_incompatible_files(tmp_path, content):
+    path = tmp_path / 'incompatible.xliff'
+    path.write_bytes(content)
+
+    with pytest.raises(TypeError):
+        kaplan.open_bilingualfile(str(path))
+
+
+def test_rejects_missing_files(tmp_path):
+    with pytest.raises(TypeError):
+        kaplan.open_bilingualfile(str(tmp_path / 'missing.kxliff'))
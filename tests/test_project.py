@@ -0,0 +1,200 @@
+import hashlib
+import json
+from pathlib import Path
+import shutil
+import zipfile
+
+import pytest
+
+import kaplan
+from conftest import SAMPLE_FILES, read_expected, read_output
+from kaplan.kdb import KDB
+from kaplan.kxliff import KXLIFF
+from kaplan.project import Project, ProjectPackage
+
+
+@pytest.fixture
+def project(sources, tmp_path, fill_targets):
+    '''
+    A project of the sample files, with their targets filled in, and a TM
+    and a termbase with the same content.
+    '''
+    project_directory = tmp_path / 'project'
+    for directory in ('en', 'de', 'TM', 'TB'):
+        (project_directory / directory).mkdir(parents=True)
+
+    files = {}
+    for i, sample_file in enumerate(SAMPLE_FILES):
+        source = project_directory / 'en' / sample_file
+        shutil.copy(sources / sample_file, source)
+        KXLIFF.new(str(source), 'en', 'de').save(project_directory / 'en')
+        targetBF = fill_targets(KXLIFF.new(str(source), 'en', 'de'))
+        targetBF.save(project_directory / 'de')
+        files[i] = {'name': sample_file,
+                    'source': str(source),
+                    'originalBF': str(project_directory / 'en' / (sample_file + '.kxliff')),
+                    'targetBF': str(project_directory / 'de' / (sample_file + '.kxliff'))}
+
+    tm = KDB.new(str(project_directory / 'TM' / 'sample.kdb'), 'en', 'de')
+    tm.submit_entry('Hello world.', 'Hallo Welt.')
+    tm.conn.close()
+    shutil.copy(project_directory / 'TM' / 'sample.kdb', project_directory / 'TB' / 'sample.kdb')
+
+    return Project({'title': 'Sample project',
+                    'directory': str(project_directory),
+                    'source_language': 'en',
+                    'target_language': 'de',
+                    'files': files,
+                    'translation_memories': {0: str(project_directory / 'TM' / 'sample.kdb')},
+                    'termbases': {0: str(project_directory / 'TB' / 'sample.kdb')}})
+
+
+def _read_directory(directory):
+    return {path.relative_to(directory).as_posix(): path.read_bytes()
+            for path in directory.rglob('*') if path.is_file()}
+
+
+def test_generate_targets(project, tmp_path):
+    results = project.generate_targets(tmp_path / 'targets', workers=2)
+
+    assert list(results) == list(project.files)
+    for i, result in results.items():
+        assert result['status'] == 'ok', result['error']
+        assert result['name'] == project.files[i]['name']
+        assert read_output(result['target']) == read_expected(project.files[i]['name'])
+
+
+def test_generate_targets_skips_unchanged_files(project, tmp_path):
+    project.generate_targets(tmp_path / 'targets', workers=2)
+
+    results = project.generate_targets(tmp_path / 'targets', workers=2)
+    assert [result['status'] for result in results.values()] == ['skipped'] * len(SAMPLE_FILES)
+
+    targetBF = kaplan.open_bilingualfile(project.files[3]['targetBF'])
+    targetBF.xml_root.find('.//{*}target').text = 'CHANGED'
+    targetBF.save(tmp_path / 'project' / 'de')
+    (tmp_path / 'project' / 'en' / 'sample.po').write_text((tmp_path / 'project' / 'en' / 'sample.po').read_text() + '\n')
+
+    results = project.generate_targets(tmp_path / 'targets', workers=2)
+    assert {i: result['status'] for i, result in results.items()} == {0: 'skipped', 1: 'skipped', 2: 'ok', 3: 'ok', 4: 'skipped'}
+    assert read_output(tmp_path / 'targets' / 'sample.txt').startswith(b'CHANGED')
+
+    results = project.generate_targets(tmp_path / 'targets', workers=2, files_to_generate=[0], force=True)
+    assert {i: result['status'] for i, result in results.items()} == {0: 'ok'}
+
+
+def test_generate_targets_fails_single_files(project, tmp_path):
+    project.files[1]['targetBF'] = str(tmp_path / 'missing.kxliff')
+    shutil.copy(project.files[3]['targetBF'], tmp_path / 'sample.txt.kxliff')
+    project.files[5] = {'name': 'sample.txt (copy)',
+                        'source': str(tmp_path / 'sample.txt'),
+                        'originalBF': project.files[3]['originalBF'],
+                        'targetBF': str(tmp_path / 'sample.txt.kxliff')}
+    shutil.copy(project.files[3]['source'], tmp_path / 'sample.txt')
+
+    results = project.generate_targets(tmp_path / 'targets', workers=2)
+
+    assert results[1]['status'] == 'failed'
+    assert results[1]['error'].startswith('FileNotFoundError: ')
+    assert results[5]['status'] == 'failed'
+    assert results[5]['error'] == 'ValueError: The target file sample.txt is generated for file 3 already.'
+    assert [results[i]['status'] for i in (0, 2, 3, 4)] == ['ok'] * 4
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+@pytest.mark.parametrize('deduplicate', [False, True])
+def test_export_and_extract(project, tmp_path, parallel, deduplicate):
+    project.export(str(tmp_path / 'sample.kpp'), parallel=parallel, workers=2, deduplicate=deduplicate)
+
+    manifest = Project.extract(str(tmp_path / 'sample.kpp'), tmp_path / 'extracted')
+
+    assert _read_directory(tmp_path / 'extracted') == _read_directory(tmp_path / 'project')
+    assert manifest['digests'] == {path: hashlib.sha256(content).hexdigest()
+                                   for path, content in _read_directory(tmp_path / 'extracted').items()}
+    with zipfile.ZipFile(tmp_path / 'sample.kpp') as project_package:
+        package_members = project_package.namelist()
+    if deduplicate:
+        assert manifest['version'] == 2
+        assert manifest['duplicates'] == {'TB/sample.kdb': 'TM/sample.kdb'}
+        assert 'TB/sample.kdb' not in package_members
+    else:
+        assert 'version' not in manifest
+        assert 'TB/sample.kdb' in package_members
+
+
+def test_extract_refuses_paths_outside_of_project(tmp_path):
+    with zipfile.ZipFile(tmp_path / 'evil.kpp', 'w') as project_package:
+        project_package.writestr('manifest.json', json.dumps({'files': {'0': {'targetBF': '../evil.kxliff'}}}))
+        project_package.writestr('../evil.kxliff', 'evil')
+
+    with pytest.raises(ValueError):
+        Project.extract(str(tmp_path / 'evil.kpp'), tmp_path / 'extracted')
+
+    assert not (tmp_path / 'evil.kxliff').exists()
+
+
+def test_newer_package_versions_are_refused(tmp_path):
+    with zipfile.ZipFile(tmp_path / 'new.kpp', 'w') as project_package:
+        project_package.writestr('manifest.json', json.dumps({'version': ProjectPackage.manifest_version + 1, 'files': {}}))
+
+    with pytest.raises(ValueError):
+        ProjectPackage(str(tmp_path / 'new.kpp'))
+
+
+def test_delta_export_and_extract(project, tmp_path):
+    project.export(str(tmp_path / 'full.kpp'))
+    Project.extract(str(tmp_path / 'full.kpp'), tmp_path / 'extracted')
+
+    targetBF = kaplan.open_bilingualfile(project.files[3]['targetBF'])
+    targetBF.xml_root.find('.//{*}target').text = 'CHANGED'
+    targetBF.save(tmp_path / 'project' / 'de')
+    project.export(str(tmp_path / 'delta.kpp'), baseline=str(tmp_path / 'full.kpp'))
+
+    with zipfile.ZipFile(tmp_path / 'delta.kpp') as project_package:
+        assert sorted(project_package.namelist()) == ['de/sample.txt.kxliff', 'manifest.json']
+    manifest = Project.get_manifest(str(tmp_path / 'delta.kpp'))
+    assert list(manifest['files']) == ['3']
+    assert manifest['digests'].keys() == Project.get_manifest(str(tmp_path / 'full.kpp'))['digests'].keys()
+
+    Project.extract(str(tmp_path / 'delta.kpp'), tmp_path / 'extracted')
+
+    assert _read_directory(tmp_path / 'extracted') == _read_directory(tmp_path / 'project')
+
+    # A delta package needs the files it leaves out.
+    with pytest.raises(ValueError):
+        Project.extract(str(tmp_path / 'delta.kpp'), tmp_path / 'empty')
+
+
+def test_delta_export_against_manifest(project, tmp_path):
+    project.export(str(tmp_path / 'full.kpp'))
+
+    project.export(str(tmp_path / 'delta.kpp'), baseline=Project.get_manifest(str(tmp_path / 'full.kpp')))
+
+    with zipfile.ZipFile(tmp_path / 'delta.kpp') as project_package:
+        assert project_package.namelist() == ['manifest.json']
+    with pytest.raises(ValueError):
+        project.export(str(tmp_path / 'delta.kpp'), baseline={'files': {}})
+
+
+@pytest.mark.parametrize('max_kdb_size_in_memory', [ProjectPackage.max_kdb_size_in_memory, 0])
+def test_read_package_without_extracting(project, tmp_path, monkeypatch, max_kdb_size_in_memory):
+    monkeypatch.setattr(ProjectPackage, 'max_kdb_size_in_memory', max_kdb_size_in_memory)
+    project.export(str(tmp_path / 'sample.kpp'), deduplicate=True)
+
+    with ProjectPackage(str(tmp_path / 'sample.kpp')) as project_package:
+        targetBF = project_package.open_bilingualfile(3)
+        originalBF = project_package.open_bilingualfile(3, 'originalBF')
+        assert type(targetBF) is KXLIFF
+        assert targetBF.name == 'sample.txt.kxliff'
+        assert targetBF.xml_root.find('.//{*}target').text == 'SHORT LINE 0'
+        assert originalBF.xml_root.find('.//{*}target').text is None
+
+        assert project_package.read('en/sample.po') == (tmp_path / 'project' / 'en' / 'sample.po').read_bytes()
+
+        kdbs = [project_package.open_kdb(project_package.manifest['tms']['0']),
+                project_package.open_kdb(project_package.manifest['tbs']['0'])]
+        assert [kdb.get_all_source_entries() for kdb in kdbs] == [['Hello world.'], ['Hello world.']]
+        temp_files = [temp_file for temp_file, _ in project_package._temp_files]
+
+    assert len(temp_files) == (2 if max_kdb_size_in_memory == 0 else 0)
+    assert not [temp_file for temp_file in temp_files if Path(temp_file).exists()]
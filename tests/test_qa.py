@@ -0,0 +1,278 @@
+from copy import deepcopy
+import itertools
+import json
+import zipfile
+
+import pytest
+
+from kaplan.kdb import KDB
+from kaplan.kxliff import KXLIFF
+from kaplan.tools import ForbiddenTermRule, QAChecker, QARule, TermbaseRule, _get_edit_distance, qa_rules
+
+CORPUS = ['the quick brown fox jumps over the lazy dog',
+          'the dog sleeps while the fox jumps',
+          'a brown dog and a brown fox',
+          'translation translations translator translated',
+          'quick quickly quicker quickest',
+          'dog dogs dig dug',
+          'über übersetzung übersetzer']
+
+
+def _get_reference_distance(word_a, word_b):
+    # Optimal string alignment distance without any cut-off.
+    distances = {(i, j): max(i, j) if 0 in (i, j) else None
+                 for i in range(len(word_a) + 1) for j in range(len(word_b) + 1)}
+    for i, j in itertools.product(range(1, len(word_a) + 1), range(1, len(word_b) + 1)):
+        distances[i, j] = min(distances[i - 1, j] + 1,
+                              distances[i, j - 1] + 1,
+                              distances[i - 1, j - 1] + (word_a[i - 1] != word_b[j - 1]))
+        if i > 1 and j > 1 and word_a[i - 1] == word_b[j - 2] and word_a[i - 2] == word_b[j - 1]:
+            distances[i, j] = min(distances[i, j], distances[i - 2, j - 2] + 1)
+
+    return distances[len(word_a), len(word_b)]
+
+
+@pytest.fixture
+def qa_checker():
+    qa_checker = QAChecker()
+    qa_checker.build(CORPUS)
+
+    return qa_checker
+
+
+@pytest.mark.parametrize('word_a, word_b', [('dog', 'dgo'), ('dog', 'dig'), ('quick', 'qiuck'),
+                                            ('translation', 'transaltoin'), ('fox', 'brown'),
+                                            ('', 'ab'), ('übersetzer', 'ubersetzer')])
+@pytest.mark.parametrize('max_distance', [1, 2])
+def test_edit_distance(word_a, word_b, max_distance):
+    assert _get_edit_distance(word_a, word_b, max_distance) == min(_get_reference_distance(word_a, word_b), max_distance + 1)
+
+
+@pytest.mark.parametrize('word', ['dgo', 'quikc', 'qiuckly', 'translatoin', 'transltions', 'brwn', 'übersetzng', 'zzzz', 'do'])
+def test_corrections_match_brute_force(qa_checker, word):
+    known_words = [known_word for known_word in qa_checker.word_counter
+                   if _get_reference_distance(word, known_word) <= qa_checker.max_edit_distance]
+
+    corrections = qa_checker.corrections(word, n=len(qa_checker.word_counter))
+
+    assert sorted(corrections) == sorted(known_words)
+    assert [qa_checker.word_counter[correction] for correction in corrections] == sorted((qa_checker.word_counter[known_word] for known_word in known_words), reverse=True)
+
+
+def test_corrections_for_sentence(qa_checker):
+    corrections = list(qa_checker.corrections_for_sentence('The quikc brown fxo jumps.'))
+
+    assert [correction['word'] for correction in corrections] == ['The', 'quikc', 'fxo']
+    assert corrections[1]['suggestions'][0] == 'quick'
+    assert 'fox' in corrections[2]['suggestions']
+
+
+def test_probability_and_total(qa_checker):
+    total = sum(len([word for word in segment.split() if len(word) > 1]) for segment in CORPUS)
+
+    assert qa_checker.total == total
+    assert qa_checker.probability('the') == 4 / total
+    assert qa_checker.probability('unknown') == 0.0
+    assert QAChecker().probability('the') == 0.0
+
+
+def test_update_clears_cached_corrections(qa_checker):
+    assert qa_checker.corrections('foxx') == ['fox']
+
+    qa_checker.update(['foxy foxy foxy foxy foxy foxy'])
+
+    assert qa_checker.total == sum(qa_checker.word_counter.values())
+    assert qa_checker.corrections('foxx') == ['foxy', 'fox']
+
+
+@pytest.fixture
+def bilingualfiles(sources, tmp_path, fill_targets):
+    paths = []
+    for sample_file in ('sample.docx', 'sample.odt', 'sample.txt'):
+        bilingualfile = fill_targets(KXLIFF.new(str(sources / sample_file), 'en', 'de'))
+        bilingualfile.save(tmp_path)
+        paths.append(str(tmp_path / bilingualfile.name))
+
+    return paths
+
+
+def test_check_files(qa_checker, bilingualfiles, tmp_path):
+    report = qa_checker.check_files(bilingualfiles + [str(tmp_path / 'missing.kxliff')], workers=2)
+
+    assert [checked_file['file'] for checked_file in report['files']] == bilingualfiles + [str(tmp_path / 'missing.kxliff')]
+    for path, checked_file in zip(bilingualfiles, report['files']):
+        assert checked_file['status'] == 'ok'
+        assert checked_file['results'] == qa_checker.check_bilingualfile(path)
+        assert checked_file['segments'] == len(checked_file['results'])
+    assert report['files'][-1]['status'] == 'failed'
+    assert report['files'][-1]['error'].startswith('TypeError: ')
+    assert report['segments'] == sum(checked_file['segments'] for checked_file in report['files'])
+    assert set(qa_checker.rule_timings) == {'capitalization', 'punctuation', 'typo', 'tags'}
+
+
+@pytest.mark.parametrize('memory_map', [True, False])
+def test_save_and_open(qa_checker, tmp_path, memory_map):
+    path_to_model = qa_checker.save(tmp_path / 'model')
+
+    opened_qa_checker = QAChecker.open(path_to_model, memory_map)
+
+    assert path_to_model == tmp_path / 'model.kqac'
+    assert opened_qa_checker.letters == qa_checker.letters
+    assert dict(opened_qa_checker.word_counter.items()) == dict(qa_checker.word_counter)
+    assert opened_qa_checker.total == qa_checker.total
+    assert {delete: sorted(words) for delete, words in opened_qa_checker.deletes.items()} == {delete: sorted(words) for delete, words in qa_checker.deletes.items()}
+    for word in ('dgo', 'quikc', 'übersetzng'):
+        # Words with the same count may come in any order.
+        assert (sorted(opened_qa_checker.corrections(word, n=len(qa_checker.word_counter)))
+                == sorted(qa_checker.corrections(word, n=len(qa_checker.word_counter))))
+    assert 'the' in opened_qa_checker.word_counter and 'unknown' not in opened_qa_checker.word_counter
+
+    opened_qa_checker.update(['foxy'])
+    assert opened_qa_checker.word_counter['foxy'] == 1
+    assert QAChecker.open(path_to_model, memory_map).word_counter.get('foxy') is None
+
+
+@pytest.mark.parametrize('memory_map', [True, False])
+def test_opened_model_in_workers(qa_checker, bilingualfiles, tmp_path, memory_map):
+    opened_qa_checker = QAChecker.open(qa_checker.save(tmp_path / 'model'), memory_map)
+
+    report = opened_qa_checker.check_files(bilingualfiles, workers=2)
+
+    assert [checked_file['results'] for checked_file in report['files']] == [qa_checker.check_bilingualfile(path) for path in bilingualfiles]
+
+
+def test_open_csv_model(qa_checker, tmp_path):
+    # Models saved before .kqac files had a binary format.
+    with zipfile.ZipFile(tmp_path / 'model.kqac', 'w') as zf:
+        zf.writestr('letters.txt', ''.join(qa_checker.letters))
+        zf.writestr('word_counter.csv', ''.join('{0},{1}\r\n'.format(word, count) for word, count in qa_checker.word_counter.most_common()))
+
+    opened_qa_checker = QAChecker.open(tmp_path / 'model.kqac')
+
+    assert opened_qa_checker.word_counter == qa_checker.word_counter
+    assert opened_qa_checker.total == qa_checker.total
+    assert sorted(opened_qa_checker.corrections('dgo')) == sorted(qa_checker.corrections('dgo'))
+
+
+def test_open_newer_model_version(qa_checker, tmp_path):
+    with zipfile.ZipFile(qa_checker.save(tmp_path / 'model')) as zf, \
+         zipfile.ZipFile(tmp_path / 'newer.kqac', 'w') as newer_zf:
+        for name in zf.namelist():
+            if name != 'kqac.json':
+                newer_zf.writestr(name, zf.read(name))
+        newer_zf.writestr('kqac.json', json.dumps({'version': QAChecker.model_version + 1}))
+
+    with pytest.raises(ValueError):
+        QAChecker.open(tmp_path / 'newer.kqac')
+
+
+def _get_model(qa_checker):
+    return (qa_checker.letters, dict(qa_checker.word_counter), qa_checker.total,
+            {delete: sorted(words) for delete, words in qa_checker.deletes.items()})
+
+
+def test_update_and_merge_match_build(qa_checker):
+    updated_qa_checker = QAChecker()
+    for segment in CORPUS:
+        updated_qa_checker.update(iter([segment]))
+
+    partial_qa_checkers = [QAChecker(), QAChecker()]
+    partial_qa_checkers[0].build(CORPUS[:3])
+    partial_qa_checkers[1].build(CORPUS[3:])
+    merged_qa_checker = QAChecker()
+    merged_qa_checker.merge(*partial_qa_checkers)
+
+    assert _get_model(updated_qa_checker) == _get_model(merged_qa_checker) == _get_model(qa_checker)
+
+    qa_checker.build(['only this'])
+    assert dict(qa_checker.word_counter) == {'only': 1, 'this': 1}
+
+
+def test_build_from_kdb_and_bilingualfiles(bilingualfiles, tmp_path):
+    kdb = KDB.new(str(tmp_path / 'tm.kdb'), 'en', 'de')
+    for segment in CORPUS:
+        kdb.submit_entry(segment.capitalize(), segment)
+
+    qa_checker = QAChecker()
+    qa_checker.build(QAChecker.gen_kdb_segments(kdb))
+    qa_checker.update(QAChecker.gen_bilingualfile_segments(bilingualfiles[2]))
+
+    assert qa_checker.word_counter['the'] == 4
+    assert qa_checker.word_counter['SHORT'] == 2
+    assert qa_checker.word_counter['BROWN'] == 4
+
+
+def test_default_rules(qa_checker):
+    segments = {1: {'source': 'Hello world.', 'target': 'hallo welt'},
+                2: {'source': 'The dog.', 'target': 'The dgo.'},
+                3: {'source': 'Untranslated.', 'target': ''},
+                4: {'source': '', 'target': 'No source.'}}
+
+    results = qa_checker.check(segments)
+
+    assert results[1] == [{'level': 'info', 'type': 'capitalization'},
+                          {'level': 'info', 'type': 'punctuation'},
+                          {'level': 'info', 'type': 'typo', 'word': 'hallo', 'suggestions': []},
+                          {'level': 'info', 'type': 'typo', 'word': 'welt', 'suggestions': []}]
+    assert [(result['type'], result['word']) for result in results[2]] == [('typo', 'The'), ('typo', 'dgo')]
+    assert results[2][1]['suggestions'][0] == 'dog'
+    assert sorted(results[2][1]['suggestions']) == ['dig', 'dog', 'dogs', 'dug']
+    assert results[3] == [{'level': 'info', 'message': 'Segment not translated.'}]
+    assert 4 not in results
+
+
+def test_optional_rules():
+    qa_checker = QAChecker(rules=['numbers', 'double_space',
+                                  ForbiddenTermRule(['colour', 'e-mail']),
+                                  TermbaseRule([('file', 'Datei'), ('project', 'Projekt')])])
+
+    results = qa_checker.check({1: {'source': 'Open file 1,000.5 of project 2.', 'target': 'Öffne  Datei 1.000,5 von  Colour 3.'},
+                                2: {'source': 'Send an e-mail.', 'target': 'Sende eine E-Mail.'}})
+
+    assert results == {1: [{'level': 'info', 'type': 'numbers', 'missing': ['2'], 'extra': ['3']},
+                           {'level': 'info', 'type': 'double_space'},
+                           {'level': 'info', 'type': 'forbidden_terms', 'term': 'Colour'},
+                           {'level': 'info', 'type': 'termbase', 'term': 'project', 'suggestions': ['Projekt']}],
+                       2: [{'level': 'info', 'type': 'forbidden_terms', 'term': 'E-Mail'}]}
+    assert set(qa_checker.rule_timings) == {'numbers', 'double_space', 'forbidden_terms', 'termbase'}
+
+
+def test_custom_rule(monkeypatch):
+    class LengthRule(QARule):
+        name = 'length'
+
+        def check(self, segment, qa_checker):
+            if len(segment['target']) > 2 * len(segment['source']):
+                return [{'level': 'info', 'type': 'length'}]
+            return []
+
+    monkeypatch.setitem(qa_rules, 'length', LengthRule)
+
+    assert QAChecker(rules=['length']).check({1: {'source': 'Yes.', 'target': 'Jawohl, gerne.'}}) == {1: [{'level': 'info', 'type': 'length'}]}
+    with pytest.raises(NotImplementedError):
+        QAChecker(rules=[QARule()]).check({1: {'source': 'Yes.', 'target': 'Ja.'}})
+
+
+def test_tag_rule(sources, fill_targets):
+    bilingualfile = fill_targets(KXLIFF.new(str(sources / 'sample.docx'), 'en', 'de'))
+    qa_checker = QAChecker(rules=['tags'])
+
+    results = qa_checker.check_bilingualfile(bilingualfile)
+
+    assert len(results) == 14
+    assert not [result for result in results.values() if result]
+
+    targets = bilingualfile.xml_root.findall('.//{*}target')
+    # Yes.<sc id="3"/>A link.<ec id="3"/> becomes Yes.<ec id="3"/>A link.<sc id="3"/>
+    targets[3].append(targets[3][0])
+    # Hello ... <sc id="1"/>Bold text here! loses its tag.
+    targets[4].text += targets[4][0].tail
+    targets[4].remove(targets[4][0])
+    targets[8].append(deepcopy(targets[8][0]))
+
+    results = qa_checker.check_bilingualfile(bilingualfile)
+
+    assert {segment_key: result for segment_key, result in results.items() if result} == {
+        ('1', '4'): [{'level': 'info', 'type': 'tag_order'}],
+        ('2', '5'): [{'level': 'info', 'type': 'tags', 'missing': ['sc-1'], 'extra': []}],
+        ('3', '9'): [{'level': 'info', 'type': 'tags', 'missing': [], 'extra': ['sc-1']}]}
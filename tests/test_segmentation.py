@@ -0,0 +1,104 @@
+import pytest
+
+from kaplan.utils import SRX, Segmenter, get_segmenter, segmentation_rules, split_into_sentences
+
+# Expected sentences are those of the regex-per-call segmentation the
+# precompiled rule sets replaced.
+DEFAULT_SENTENCES = [
+    ('Hello world. This is a test.', ['Hello world.', 'This is a test.']),
+    ('Dr. Smith is here. He is ok!', ['Dr. Smith is here.', 'He is ok!']),
+    ('Is it? Yes: it is. Done', ['Is it?', 'Yes: it is.', 'Done']),
+    ('No punctuation here', ['No punctuation here']),
+    ('Trailing space.  ', ['Trailing space.', '']),
+    ('  Leading space. Next one.', ['  Leading space.', 'Next one.']),
+    ('U.S.A. is big. Yes.', ['U.S.A. is big.', 'Yes.']),
+    ('Wait... what? Ok.', ['Wait... what?', 'Ok.']),
+    ('Ms. Jones met Mr. Brown. Fine.', ['Ms. Jones met Mr. Brown.', 'Fine.']),
+    ('', ['']),
+]
+
+
+@pytest.mark.parametrize('text, sentences', DEFAULT_SENTENCES)
+def test_split_into_sentences(text, sentences):
+    assert split_into_sentences(text) == sentences
+    assert split_into_sentences(text, 'en') == sentences
+
+
+@pytest.mark.parametrize('text, sentences', DEFAULT_SENTENCES)
+def test_sentence_lengths_cover_text(text, sentences):
+    len_sentences = get_segmenter().get_sentence_lengths(text)
+
+    sentence_start = 0
+    len_sentences_text = []
+    for len_sentence in len_sentences:
+        len_sentences_text.append(text[sentence_start:sentence_start+len_sentence])
+        sentence_start += len_sentence
+
+    assert sentence_start == len(text)
+    assert ([sentence.strip() for sentence in len_sentences_text if sentence.strip()]
+            == [sentence.strip() for sentence in sentences if sentence.strip()])
+
+
+def test_segmenters_are_cached():
+    assert get_segmenter('en') is get_segmenter('en')
+    assert isinstance(get_segmenter('en'), Segmenter)
+
+
+def test_unknown_language_uses_default_rules():
+    text = 'Hello world. This is a test.'
+
+    assert (get_segmenter('xx').split(text)
+            == Segmenter(segmentation_rules['default']).split(text)
+            == ['Hello world.', 'This is a test.'])
+
+
+SRX_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<srx xmlns="http://www.lisa.org/srx20" version="{version}">
+  <header segmentsubflows="yes"{cascade}/>
+  <body>
+    <languagerules>
+      <languagerule languagerulename="English">
+        <rule break="no"><beforebreak>\\bFig\\.</beforebreak><afterbreak>\\s</afterbreak></rule>
+      </languagerule>
+      <languagerule languagerulename="Default">
+        <rule break="yes"><beforebreak>[\\.\\?!]+</beforebreak><afterbreak>\\s</afterbreak></rule>
+      </languagerule>
+    </languagerules>
+    <maprules>
+      <languagemap languagepattern="en.*" languagerulename="English"/>
+      <languagemap languagepattern=".*" languagerulename="Default"/>
+    </maprules>
+  </body>
+</srx>
+'''
+SRX_TEXT = 'See Fig. 2 for details. It is large.'
+
+
+@pytest.mark.parametrize('text, language, sentences', [
+    ('Das ist z. B. gut. Dr. Müller kommt. Ok.', 'de-DE', ['Das ist z. B. gut.', 'Dr. Müller kommt.', 'Ok.']),
+    ('Prof. Dr. Yılmaz geldi. Tamam.', 'tr', ['Prof. Dr. Yılmaz geldi.', 'Tamam.']),
+    ('今日は晴れ。明日は雨？「そうです。」次。', 'ja', ['今日は晴れ。', '明日は雨？', '「そうです。」', '次。']),
+])
+def test_srx_rules(text, language, sentences):
+    assert split_into_sentences(text, language) == sentences
+
+
+@pytest.mark.parametrize('version, cascade, is_cascading', [
+    ('2.0', '', True),
+    ('2.0', ' cascade="no"', False),
+    ('1.0', '', False),
+    ('1.0', ' cascade="yes"', True),
+])
+def test_srx_cascade(tmp_path, version, cascade, is_cascading):
+    path_to_srx = tmp_path / 'rules.srx'
+    path_to_srx.write_text(SRX_TEMPLATE.format(version=version, cascade=cascade))
+
+    srx = SRX.open(path_to_srx)
+
+    assert srx.cascade == is_cascading
+    # Without cascading, English gets the no-break rule only and is not split.
+    if is_cascading:
+        assert split_into_sentences(SRX_TEXT, 'en-US', srx) == ['See Fig. 2 for details.', 'It is large.']
+    else:
+        assert split_into_sentences(SRX_TEXT, 'en-US', srx) == [SRX_TEXT]
+    assert split_into_sentences(SRX_TEXT, 'fr', str(path_to_srx)) == ['See Fig.', '2 for details.', 'It is large.']
@@ -0,0 +1,99 @@
+import zipfile
+
+import pytest
+from lxml import etree
+
+import kaplan
+from conftest import SAMPLE_FILES, read_expected, read_output
+from kaplan.kxliff import KXLIFF
+
+# The expected target files in tests/data/expected were generated by the
+# baseline code from the same sources, with fill_targets.
+
+
+def _new_kxliff(sources, tmp_path, sample_file, fill_targets):
+    kxliff_directory = tmp_path / 'kxliff'
+    kxliff_directory.mkdir(exist_ok=True)
+    KXLIFF.new(sample_file, 'en', 'de').save(kxliff_directory)
+
+    kxliff = fill_targets(kaplan.open_bilingualfile(str(kxliff_directory / (sample_file + '.kxliff'))))
+    kxliff.save(kxliff_directory)
+
+    return kxliff
+
+
+@pytest.mark.parametrize('sample_file', ['sample.docx', 'sample.odt'])
+def test_archive_round_trip(sources, tmp_path, monkeypatch, fill_targets, sample_file):
+    monkeypatch.chdir(sources)
+    kxliff = _new_kxliff(sources, tmp_path, sample_file, fill_targets)
+
+    kxliff.generate_target_translation(tmp_path)
+
+    assert read_output(tmp_path / sample_file) == read_expected(sample_file)
+
+    # A .kxliff file opened from disk generates the same target file.
+    kaplan.open_bilingualfile(str(tmp_path / 'kxliff' / (sample_file + '.kxliff'))).generate_target_translation(tmp_path, target_filename='again_' + sample_file)
+
+    assert read_output(tmp_path / ('again_' + sample_file)) == read_expected(sample_file)
+
+
+def test_missing_original_data_fails(sources, tmp_path, monkeypatch, fill_targets):
+    monkeypatch.chdir(sources)
+    kxliff = _new_kxliff(sources, tmp_path, 'sample.docx', fill_targets)
+    for original_data in kxliff.xml_root.xpath('//x:originalData', namespaces={'x': kxliff.nsmap[None]}):
+        original_data.getparent().remove(original_data)
+
+    with pytest.raises(KeyError):
+        kxliff.generate_target_translation(tmp_path)
+
+
+@pytest.mark.parametrize('sample_file', ['sample.docx', 'sample.odt'])
+@pytest.mark.parametrize('raw_copy', [True, False])
+def test_archive_streaming(sources, tmp_path, monkeypatch, fill_targets, sample_file, raw_copy):
+    monkeypatch.chdir(sources)
+    if not raw_copy:
+        monkeypatch.setattr('kaplan.kxliff.write_raw_zip_member', lambda *args, **kwargs: False)
+    kxliff = _new_kxliff(sources, tmp_path, sample_file, fill_targets)
+
+    kxliff.generate_target_translation(tmp_path, stream=True)
+
+    assert read_output(tmp_path / sample_file) == read_expected(sample_file)
+    with zipfile.ZipFile(sample_file) as source_zip, zipfile.ZipFile(tmp_path / sample_file) as target_zip:
+        assert ([(zip_info.filename, zip_info.compress_type) for zip_info in source_zip.infolist()]
+                == [(zip_info.filename, zip_info.compress_type) for zip_info in target_zip.infolist()])
+        assert target_zip.testzip() is None
+
+
+@pytest.mark.parametrize('sample_file', ['sample.docx', 'sample.odt'])
+def test_generation_leaves_kxliff_unchanged(sources, tmp_path, monkeypatch, fill_targets, sample_file):
+    monkeypatch.chdir(sources)
+    kxliff = _new_kxliff(sources, tmp_path, sample_file, fill_targets)
+    kxliff_before = etree.tostring(kxliff.xml_root)
+
+    kxliff.generate_target_translation(tmp_path)
+    kxliff.generate_target_translation(tmp_path, target_filename='again_' + sample_file)
+
+    assert etree.tostring(kxliff.xml_root) == kxliff_before
+    assert read_output(tmp_path / ('again_' + sample_file)) == read_expected(sample_file)
+
+
+@pytest.mark.parametrize('sample_file', ['sample.po', 'sample.txt'])
+@pytest.mark.parametrize('stream', [False, True])
+def test_text_round_trip(sources, tmp_path, monkeypatch, fill_targets, sample_file, stream):
+    monkeypatch.chdir(sources)
+    kxliff = _new_kxliff(sources, tmp_path, sample_file, fill_targets)
+
+    kxliff.generate_target_translation(tmp_path, stream=stream)
+
+    assert read_output(tmp_path / sample_file) == read_expected(sample_file)
+
+
+@pytest.mark.parametrize('sample_file', SAMPLE_FILES)
+def test_generate_target_from_file(sources, tmp_path, monkeypatch, fill_targets, sample_file):
+    monkeypatch.chdir(sources)
+    _new_kxliff(sources, tmp_path, sample_file, fill_targets)
+
+    path_to_target = KXLIFF.generate_target_from_file(tmp_path / 'kxliff' / (sample_file + '.kxliff'), tmp_path)
+
+    assert path_to_target == tmp_path / sample_file
+    assert read_output(path_to_target) == read_expected(sample_file)